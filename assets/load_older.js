@@ -0,0 +1,28 @@
+import { useEffect, useLayoutEffect, useRef } from "react";
+
+export function LoadOlderMessages({ count, onVisible }) {
+  const elementRef = useRef();
+  // Height of the page when older messages were requested
+  const pendingHeight = useRef(null);
+
+  // Keep the messages that were on screen in place when older messages are added above them
+  useLayoutEffect(() => {
+    if (pendingHeight.current !== null) {
+      window.scrollBy(0, document.documentElement.scrollHeight - pendingHeight.current);
+      pendingHeight.current = null;
+    }
+  }, [count]);
+
+  useEffect(() => {
+    const observer = new IntersectionObserver((entries) => {
+      if (entries[0].isIntersecting && pendingHeight.current === null) {
+        pendingHeight.current = document.documentElement.scrollHeight;
+        onVisible();
+      }
+    });
+    observer.observe(elementRef.current);
+    return () => observer.disconnect();
+  });
+
+  return <div ref={elementRef} style={{ minHeight: "1px" }} />;
+}
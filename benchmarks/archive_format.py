@@ -0,0 +1,139 @@
+"""Benchmark the size and the encode and decode time of conversations in the archive format.
+
+The conversations are encoded the way older versions saved them into local storage (a pickle
+of the `convos`, `convo_model` and `enabled_plugins` dicts, decoded as latin1) and as archives
+with each compression. Decoding the pickle builds the `Message` models, decoding an archive
+builds the compact histories that sessions keep, reading it in chunks like a file or upload.
+The peak memory of decoding includes the decoded conversations.
+"""
+
+import argparse
+import json
+import pickle
+import random
+import statistics
+import time
+import tracemalloc
+from itertools import groupby
+from operator import itemgetter
+from typing import Any, Callable, Iterator
+
+
+def make_convos(n_convos: int, n_messages: int, words: int, agent_rate: float, seed: int) -> dict[str, Any]:
+    """Conversations with long histories, a mix of chat messages and agent responses with tool output."""
+    from reflex_gptp.models import Convo, Message, MessagePart, make_uuid
+    from reflex_gptp.utils import MessagePartType
+
+    rng = random.Random(seed)
+
+    def text() -> str:
+        return " ".join(f"word{rng.randrange(1000)}" for _ in range(words))
+
+    convos = {}
+    for i in range(n_convos):
+        messages = []
+        for j in range(n_messages):
+            if j % 2 == 1 and rng.random() < agent_rate:
+                parts = [
+                    MessagePart(id=make_uuid(), type=MessagePartType.TOOL_END, text=text(), extra_output=text()),
+                    MessagePart(id=make_uuid(), type=MessagePartType.AGENT_FINISH, text=text()),
+                ]
+            else:
+                parts = [MessagePart(id=make_uuid(), type=MessagePartType.TEXT, text=text())]
+            messages.append(Message(id=make_uuid(), parts=parts, own=j % 2 == 0))
+        convos[make_uuid()] = Convo(name=f"Conversation {i}", messages=messages)
+    return {
+        "convos": convos,
+        "convo_model": {k: {"provider": "openai", "name": "gpt-4"} for k in convos},
+        "enabled_plugins": {k: {"Python": False, "Wikipedia": True} for k in convos},
+    }
+
+
+def pickle_codec() -> tuple[Callable[[dict[str, Any]], list[str]], Callable[[list[str]], Any]]:
+    """Save and load the dicts like older versions did with local storage."""
+
+    def save(data: dict[str, Any]) -> list[str]:
+        return [pickle.dumps(data[k]).decode("latin1") for k in ("convos", "convo_model", "enabled_plugins")]
+
+    def load(blobs: list[str]) -> Any:
+        return [pickle.loads(b.encode("latin1")) for b in blobs]
+
+    return save, load
+
+
+def archive_codec(compression: str) -> tuple[Callable[[dict[str, Any]], list[bytes]], Callable[[list[bytes]], Any]]:
+    """Save and load the conversations as an archive."""
+    from reflex_gptp.archive import convo_record, decode, encode, message_record, part_rows
+    from reflex_gptp.message_history import MessageHistory
+
+    def records(data: dict[str, Any]) -> Iterator[dict[str, Any]]:
+        for key, convo in data["convos"].items():
+            yield convo_record(key, convo.name, data["convo_model"][key], data["enabled_plugins"][key])
+            for message in convo.messages:
+                yield message_record(key, message)
+
+    def save(data: dict[str, Any]) -> list[bytes]:
+        return [b"".join(encode(records(data), compression))]
+
+    def load(blobs: list[bytes]) -> Any:
+        chunks = (blobs[0][i : i + 64 * 1024] for i in range(0, len(blobs[0]), 64 * 1024))
+        messages = (r for r in decode(chunks) if r["type"] == "message")
+        return {
+            convo_id: MessageHistory.from_parts(row for record in group for row in part_rows(record))
+            for convo_id, group in groupby(messages, key=itemgetter("convo_id"))
+        }
+
+    return save, load
+
+
+def measure(codec: tuple[Callable, Callable], data: dict[str, Any], repeat: int) -> dict[str, float]:
+    """The size, encode time, decode time and peak memory of decoding."""
+    save, load = codec
+    encode_times, decode_times = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        blobs = save(data)
+        encode_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        load(blobs)
+        decode_times.append(time.perf_counter() - start)
+    # Memory is traced separately, tracing slows down the code that is timed
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    load(blobs)
+    peak = tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return {
+        # A latin1 string has a character per byte of the pickle
+        "size_kb": sum(len(b) for b in blobs) / 1024,
+        "encode_ms": statistics.median(encode_times) * 1000,
+        "decode_ms": statistics.median(decode_times) * 1000,
+        "decode_peak_kb": peak / 1024,
+    }
+
+
+def main() -> None:
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--convos", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=500, help="messages per conversation")
+    parser.add_argument("--words", type=int, default=40, help="words per text")
+    parser.add_argument("--agent-rate", type=float, default=0.2, help="share of responses that used tools")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    data = make_convos(args.convos, args.messages, args.words, args.agent_rate, args.seed)
+    codecs = {"pickle_latin1": pickle_codec(), "archive_none": archive_codec("none"), "archive_gzip": archive_codec("gzip")}
+    try:
+        import zstandard  # noqa: F401
+
+        codecs["archive_zstd"] = archive_codec("zstd")
+    except ImportError:
+        pass
+    results = {name: measure(codec, data, args.repeat) for name, codec in codecs.items()}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
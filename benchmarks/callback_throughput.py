@@ -0,0 +1,70 @@
+"""Benchmark the number of events per second that go through the callback handler's iterator.
+
+A producer task sends tokens to the handler as fast as possible, in batches like an LLM stream,
+while the consumer iterates over them. The iterator that was used before the handler was
+redesigned (a new future and `asyncio.wait` for every event) is measured for comparison.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from typing import AsyncIterator
+
+from reflex_gptp.async_callback import CustomAsyncIteratorCallbackHandler, Event, iterate_events
+from reflex_gptp.utils import OutputType
+
+
+async def legacy_iterate_events(queue: asyncio.Queue[Event]) -> AsyncIterator[Event]:
+    """The iterator of the handler before it was redesigned."""
+    while True:
+        done, other = await asyncio.wait([asyncio.ensure_future(queue.get())], return_when=asyncio.FIRST_COMPLETED)
+        if other:
+            other.pop().cancel()
+        res = done.pop().result()
+        yield res
+        if res[0] in [OutputType.AGENT_FINISH, OutputType.LLM_ERROR, OutputType.INTERRUPT]:
+            break
+
+
+async def run(n_events: int, batch: int, legacy: bool) -> float:
+    """Send `n_events` tokens through a handler and return the events per second."""
+    handler = CustomAsyncIteratorCallbackHandler()
+    run_id = uuid.uuid4()
+    await handler.on_llm_start({}, [], run_id=run_id)
+
+    async def produce() -> None:
+        for i in range(n_events):
+            await handler.on_llm_new_token("tok", run_id=run_id)
+            if i % batch == 0:
+                await asyncio.sleep(0)
+        handler.queue.put_nowait((OutputType.AGENT_FINISH, "", None))
+
+    iterator = legacy_iterate_events(handler.queue) if legacy else iterate_events(handler.queue)
+    start = time.perf_counter()
+    producer = asyncio.create_task(produce())
+    n = 0
+    async for _ in iterator:
+        n += 1
+    await producer
+    return n / (time.perf_counter() - start)
+
+
+def main() -> None:
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--events", type=int, default=200_000)
+    parser.add_argument("--batch", type=int, default=8, help="tokens sent between yields to the event loop")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    results = {}
+    for name, legacy in (("iterate_events", False), ("legacy", True)):
+        rates = [asyncio.run(run(args.events, args.batch, legacy)) for _ in range(args.repeat)]
+        results[name] = {"events_per_sec": max(rates)}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
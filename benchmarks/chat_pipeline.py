@@ -0,0 +1,254 @@
+"""End-to-end benchmark of the chat pipeline, from `StreamState.handle_submit` to the deltas sent to the client.
+
+The app is driven like the websocket handler does, with the events of many simulated sessions,
+and answers with the offline fake provider. The deltas that would be sent to the clients are
+recorded instead. Scenarios:
+
+- `chat`: plain chats,
+- `agent`: an agent that calls an offline tool before it answers,
+- `long_history`: plain chats in conversations with a long history,
+- `many_convos`: plain chats by sessions that have many conversations.
+
+For each scenario it reports the time to the first token that reaches the client, the tokens
+per second that reach the client, the bytes of deltas per token, the CPU time per response, the
+memory that setting up a session allocates and the size of the state of a session at the end,
+as JSON, so the results of two versions can be diffed.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+from typing import Any
+
+import cloudpickle
+
+SCENARIOS = ("chat", "agent", "long_history", "many_convos")
+
+
+class RecordingNamespace:
+    """Stands in for the websocket namespace of the app, and records the updates that are sent to each client."""
+
+    def __init__(self) -> None:
+        self.updates: dict[str, list[tuple[float, int, dict[str, Any]]]] = {}
+
+    async def emit_update(self, update: Any, sid: str) -> None:
+        """Records when an update was sent, its size and its delta."""
+        self.updates.setdefault(sid, []).append((time.perf_counter(), len(update.json()), update.delta))
+
+
+def _has_text(delta: dict[str, Any]) -> bool:
+    return any(isinstance(substate, dict) and substate.get("live_text") for substate in delta.values())
+
+
+def _percentiles(values: list[float]) -> dict[str, float]:
+    values = sorted(values)
+    return {
+        "p50": statistics.median(values),
+        "p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+        "max": values[-1],
+    }
+
+
+class Bench:
+    """Sends events to the app, like the websocket handler of Reflex."""
+
+    def __init__(self) -> None:
+        import reflex as rx
+
+        # Registers the substates of the app
+        import reflex_gptp.state  # noqa: F401
+
+        # Reflex only infers the root state outside of tests, so it's passed explicitly
+        self.app = rx.App(state=rx.State)
+        self.namespace = RecordingNamespace()
+        self.app.event_namespace = self.namespace  # type: ignore
+        # Background tasks look the app up by importing the app module, which would compile the frontend
+        app_module = types.ModuleType("reflex_gptp.reflex_gptp")
+        app_module.app = self.app  # type: ignore
+        sys.modules[app_module.__name__] = app_module
+
+    async def send(self, token: str, state_cls: type, handler: str, **payload: Any) -> asyncio.Task | None:
+        """Process an event of a substate and return the task of the handler, if it runs in the background."""
+        from reflex.app import process
+        from reflex.event import Event
+
+        event = Event(
+            token=token,
+            name=f"{state_cls.get_full_name()}.{handler}",
+            router_data={"pathname": "/", "query": {}},
+            payload=payload,
+        )
+        tasks = set(self.app.background_tasks)
+        async for update in process(self.app, event, token, {}, "127.0.0.1"):
+            await self.namespace.emit_update(update, token)
+        new_tasks = self.app.background_tasks - tasks
+        return new_tasks.pop() if new_tasks else None
+
+    async def get_state(self, token: str, state_cls: type) -> Any:
+        """The substate of a client."""
+        state = await self.app.state_manager.get_state(token)
+        return state.get_substate(state_cls.get_full_name().split("."))
+
+
+async def setup_session(bench: Bench, token: str, scenario: str, args: argparse.Namespace) -> None:
+    """Create the conversations of a session for a scenario."""
+    from reflex_gptp.models import Message, MessagePart, make_uuid
+    from reflex_gptp.state import ConvoState, ModelFormState
+    from reflex_gptp.store import get_store
+    from reflex_gptp.utils import MessagePartType
+
+    await bench.send(token, ConvoState, "load_data")
+    await bench.send(token, ModelFormState, "handle_model_submit", form_data={"provider": "fake", "name": args.model})
+    if scenario == "agent":
+        await bench.send(token, ConvoState, "toggle_plugin", plugin_name="Echo", value=True)
+    elif scenario == "many_convos":
+        for _ in range(args.convos - 1):
+            await bench.send(token, ConvoState, "new_convo")
+    elif scenario == "long_history":
+        state = await bench.get_state(token, ConvoState)
+        text = " ".join(["history"] * args.history_words)
+        for i in range(args.history):
+            part = MessagePart(id=make_uuid(), type=MessagePartType.TEXT, text=text)
+            get_store().append_message(state.current_convo, Message(id=make_uuid(), parts=[part], own=i % 2 == 0))
+        await bench.send(token, ConvoState, "load_data")
+
+
+async def ask(bench: Bench, token: str, question: str) -> dict[str, float]:
+    """Ask a question in a session and measure the response as the client sees it."""
+    from reflex_gptp.state import ConvoState, StreamState
+
+    state = await bench.get_state(token, ConvoState)
+    n_messages = len(state._history(state.current_convo))
+    start = time.perf_counter()
+    n_updates = len(bench.namespace.updates.get(token, []))
+    task = await bench.send(token, StreamState, "handle_submit", form_data={"input": question})
+    if task is not None:
+        await task
+    end = time.perf_counter()
+    updates = bench.namespace.updates[token][n_updates:]
+    state = await bench.get_state(token, ConvoState)
+    history = state._history(state.current_convo)
+    # Without a response the numbers would be meaningless, e.g. if the handler failed
+    if len(history) < n_messages + 2 or history[-1].own:
+        raise RuntimeError(f"No response was stored for {question!r}")
+    first = next((t for t, _, delta in updates if _has_text(delta)), None)
+    if first is None:
+        raise RuntimeError(f"No text of the response to {question!r} was streamed")
+    answer = history[-1]
+    n_tokens = sum(len(re.findall(r"\s*\S+", part.text)) for part in answer.parts)
+    return {
+        "ttft_ms": (first - start) * 1000,
+        "tokens_per_sec": n_tokens / max(end - first, 1e-9),
+        "delta_bytes_per_token": sum(size for _, size, _ in updates) / max(n_tokens, 1),
+    }
+
+
+async def run_scenario(scenario: str, args: argparse.Namespace) -> dict[str, Any]:
+    """Run a scenario with concurrent sessions, each asking questions one after the other."""
+    from reflex_gptp.models import make_uuid
+
+    bench = Bench()
+    tokens = [make_uuid() for _ in range(args.sessions)]
+    # Memory is only traced while the sessions are set up, tracing would inflate the CPU time of the responses
+    tracemalloc.start()
+    memory = tracemalloc.get_traced_memory()[0]
+    for token in tokens:
+        await setup_session(bench, token, scenario, args)
+    memory = tracemalloc.get_traced_memory()[0] - memory
+    tracemalloc.stop()
+
+    async def session(token: str) -> list[dict[str, float]]:
+        return [await ask(bench, token, f"Question {i}") for i in range(args.questions)]
+
+    cpu = time.process_time()
+    results = [r for rs in await asyncio.gather(*(session(t) for t in tokens)) for r in rs]
+    cpu = time.process_time() - cpu
+    state_bytes = [len(cloudpickle.dumps(await bench.app.state_manager.get_state(t))) for t in tokens]
+    return {
+        "responses": len(results),
+        **{key: _percentiles([r[key] for r in results]) for key in results[0]},
+        "cpu_ms_per_response": cpu * 1000 / len(results),
+        "memory_kb_per_session": memory / 1024 / len(tokens),
+        "state_kb_per_session": statistics.mean(state_bytes) / 1024,
+    }
+
+
+def _register_echo_plugin() -> None:
+    """Add an offline plugin for the agent scenario, before the state is created."""
+    from langchain.tools import Tool
+
+    from reflex_gptp.utils import plugin_tool
+
+    async def echo(query: str) -> str:
+        return f"Echo: {query}"
+
+    plugin_tool["Echo"] = lambda: Tool(
+        name="Echo", description="Repeats the input.", func=lambda q: f"Echo: {q}", coroutine=echo
+    )
+
+
+def _version() -> str:
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"], text=True).strip()  # noqa: S603, S607
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main() -> None:
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--sessions", type=int, default=20, help="concurrent sessions")
+    parser.add_argument("--questions", type=int, default=3, help="questions per session")
+    parser.add_argument("--model", default="fake-markov", choices=["fake-markov", "fake-random", "fake-script"])
+    parser.add_argument("--tokens-per-second", type=float, default=200)
+    parser.add_argument("--first-token-delay", type=float, default=0.05)
+    parser.add_argument("--response-tokens", type=int, default=200)
+    parser.add_argument("--history", type=int, default=500, help="messages in the long_history scenario")
+    parser.add_argument("--history-words", type=int, default=60, help="words per message of the long history")
+    parser.add_argument("--convos", type=int, default=50, help="conversations per session in many_convos")
+    parser.add_argument("--output", help="also write the results to this file")
+    args = parser.parse_args()
+
+    # The app reads its configuration when it's imported
+    os.environ.update(
+        {
+            "FAKE_PROVIDER": "true",
+            "FAKE_LLM_SEED": "0",
+            "FAKE_LLM_TOKENS_PER_SECOND": str(args.tokens_per_second),
+            "FAKE_LLM_FIRST_TOKEN_DELAY": str(args.first_token_delay),
+            "FAKE_LLM_RESPONSE_TOKENS": str(args.response_tokens),
+            "FAKE_LLM_TOOL_CALL_RATE": "1",
+            "CONVO_STORE_PATH": os.path.join(tempfile.mkdtemp(), "bench.db"),
+            # All sessions share the (empty) API key of the fake provider, which must not be what limits them
+            "SCHEDULER_MAX_PER_KEY": str(args.sessions),
+            "SCHEDULER_MAX_PER_PROVIDER": str(args.sessions),
+            "SCHEDULER_AGENT_SHARE": "1",
+        }
+    )
+    _register_echo_plugin()
+
+    results = {
+        "version": _version(),
+        "python": sys.version.split()[0],
+        "args": vars(args),
+        "scenarios": {scenario: asyncio.run(run_scenario(scenario, args)) for scenario in args.scenarios},
+    }
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Benchmark the time to compute the delta of an event, as the number of conversations grows.
+
+A session is given more and more conversations, and for each size it measures the time that
+Reflex takes to compute the delta of events that don't change the conversations:
+
+- `token`: a streamed token, which appends to `live_text`,
+- `toggle_drawer`: a UI toggle,
+- `set_question`: a keystroke in the input.
+
+With computed vars that are only recomputed when their dependencies change, these times stay
+flat. Run it on another version of the code to compare, e.g. in a worktree of `HEAD~1`.
+"""
+
+import argparse
+import json
+import statistics
+import time
+from typing import Any, Callable
+
+
+def _substate(state: Any, name: str) -> Any:
+    return state.get_substate([state.get_name(), name])
+
+
+def stream_token(state: Any, i: int) -> None:
+    """A streamed token."""
+    _substate(state, "stream_state").live_text += f" token{i}"
+
+
+def toggle_drawer(state: Any, i: int) -> None:
+    """A UI toggle."""
+    _substate(state, "ui_state").toggle_drawer()
+
+
+def set_question(state: Any, i: int) -> None:
+    """A keystroke in the input."""
+    _substate(state, "ui_state").question = f"question {i}"
+
+
+EVENTS: dict[str, Callable[[Any, int], None]] = {
+    "token": stream_token,
+    "toggle_drawer": toggle_drawer,
+    "set_question": set_question,
+}
+
+
+def make_state(n_convos: int, n_messages: int) -> Any:
+    """A state with conversations that have loaded messages, as if they had been opened."""
+    from reflex_gptp.message_history import MessageHistory
+    from reflex_gptp.models import Convo, Message, MessagePart, make_uuid
+    from reflex_gptp.state import State
+    from reflex_gptp.utils import MessagePartType, plugin_tool
+
+    state = State()
+    convo_state = _substate(state, "convo_state")
+    for i in range(n_convos):
+        key = make_uuid()
+        messages = [
+            Message(
+                id=make_uuid(),
+                parts=[MessagePart(id=make_uuid(), type=MessagePartType.TEXT, text=f"Message {j}")],
+                own=j % 2 == 0,
+            )
+            for j in range(n_messages)
+        ]
+        convo_state.convos[key] = Convo(name=f"Conversation {i}")
+        convo_state._histories[key] = MessageHistory(messages)
+        convo_state.convo_model[key] = {"provider": "openai", "name": "gpt-3.5-turbo"}
+        convo_state.enabled_plugins[key] = {k: False for k in plugin_tool}
+    state.get_delta()
+    state._clean()
+    return state
+
+
+def measure(state: Any, event: Callable[[Any, int], None], n_events: int) -> dict[str, float]:
+    """Apply an event to the state and compute its delta, like Reflex does after each event."""
+    times = []
+    sizes = []
+    for i in range(n_events):
+        start = time.perf_counter()
+        event(state, i)
+        delta = state.get_delta()
+        state._clean()
+        times.append(time.perf_counter() - start)
+        sizes.append(len(json.dumps(delta, default=str)))
+    return {"median_us": statistics.median(times) * 1e6, "delta_bytes": statistics.median(sizes)}
+
+
+def main() -> None:
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--convos", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    parser.add_argument("--messages", type=int, default=5, help="loaded messages per conversation")
+    parser.add_argument("--events", type=int, default=200, help="events per measurement")
+    args = parser.parse_args()
+
+    results: dict[str, dict[str, Any]] = {}
+    for n_convos in args.convos:
+        state = make_state(n_convos, args.messages)
+        results[str(n_convos)] = {name: measure(state, event, args.events) for name, event in EVENTS.items()}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
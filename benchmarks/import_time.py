@@ -0,0 +1,77 @@
+"""Benchmark the cold import time of the app state.
+
+Every run imports the module in a fresh interpreter with `-X importtime`, so nothing is cached in
+memory. Pass `--baseline <git ref>` to also measure another version of the code, which is checked
+out in a temporary git worktree, e.g. to compare before and after a change:
+
+    python benchmarks/import_time.py --baseline HEAD~1
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def measure(cwd: Path, module: str, runs: int) -> dict:
+    """Import `module` `runs` times in `cwd` and return the median time and slowest imports."""
+    totals = []
+    slowest: dict[str, int] = {}
+    for _ in range(runs):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],  # noqa: S603
+            cwd=cwd,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        # Lines look like "import time:  self [us] | cumulative | imported package"
+        times = {}
+        for line in proc.stderr.splitlines():
+            if not line.startswith("import time:") or "cumulative" in line:
+                continue
+            _, cumulative, name = line[len("import time:") :].split("|")
+            times[name.strip()] = int(cumulative)
+        totals.append(times[module])
+        for name, us in times.items():
+            if name.count(".") == 0:
+                slowest[name] = max(slowest.get(name, 0), us)
+    top = sorted(slowest.items(), key=lambda x: -x[1])[:10]
+    return {
+        "median_ms": statistics.median(totals) / 1000,
+        "runs": runs,
+        "slowest_top_level_ms": {name: us / 1000 for name, us in top},
+    }
+
+
+def main() -> None:
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="reflex_gptp.state")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--baseline", help="git ref to compare with")
+    args = parser.parse_args()
+
+    results = {"current": measure(ROOT, args.module, args.runs)}
+    if args.baseline:
+        with tempfile.TemporaryDirectory() as tmp:
+            worktree = Path(tmp) / "baseline"
+            subprocess.run(["git", "worktree", "add", "--detach", str(worktree), args.baseline], cwd=ROOT, check=True)  # noqa: S603, S607
+            try:
+                # Files that are not tracked, like prompts.csv, are needed to import the state
+                for name in ("prompts.csv", ".env"):
+                    if (ROOT / name).exists() and not (worktree / name).exists():
+                        (worktree / name).symlink_to(ROOT / name)
+                results[args.baseline] = measure(worktree, args.module, args.runs)
+            finally:
+                subprocess.run(["git", "worktree", "remove", "--force", str(worktree)], cwd=ROOT, check=True)  # noqa: S603, S607
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Benchmark how fast an interrupted response releases its chain and its HTTP stream.
+
+A local fake OpenAI server streams tokens at a fixed rate. A response is interrupted after a
+number of tokens, and the benchmark measures the time until the interrupt reaches the consumer
+of the callback handler (interrupt-to-idle) and until the server sees the connection closed,
+and counts the tokens that the server still sent after the interrupt.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+
+from aiohttp import web
+
+
+class FakeServer:
+    """An OpenAI-compatible server that streams chat completions token by token."""
+
+    def __init__(self, n_tokens: int, interval: float) -> None:
+        self.n_tokens = n_tokens
+        self.interval = interval
+        self.sent = 0
+        self.disconnected_at: float | None = None
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        """Streams a completion until all tokens are sent or the client disconnects."""
+        await request.read()
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        try:
+            for _ in range(self.n_tokens):
+                chunk = {
+                    "id": "chatcmpl-fake",
+                    "object": "chat.completion.chunk",
+                    "created": 0,
+                    "model": "gpt-3.5-turbo",
+                    "choices": [{"index": 0, "delta": {"content": "token "}, "finish_reason": None}],
+                }
+                await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.sent += 1
+                await asyncio.sleep(self.interval)
+            await response.write(b"data: [DONE]\n\n")
+        except (ConnectionResetError, asyncio.CancelledError):
+            self.disconnected_at = time.perf_counter()
+            raise
+        return response
+
+
+async def interrupt_once(server: FakeServer, after_tokens: int) -> dict[str, float]:
+    """Stream a response, interrupt it and measure how long it takes to be released."""
+    from langchain.memory import ConversationBufferMemory
+
+    from reflex_gptp.async_callback import CustomAsyncIteratorCallbackHandler
+    from reflex_gptp.chains import get_chain
+    from reflex_gptp.state import wrap_done
+    from reflex_gptp.utils import OutputType
+
+    server.sent = 0
+    server.disconnected_at = None
+    callback = CustomAsyncIteratorCallbackHandler()
+    memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
+    chain = get_chain("openai", "gpt-3.5-turbo", "sk-fake", frozenset(), memory)
+    interrupt = asyncio.Event()
+    run = asyncio.create_task(
+        wrap_done(chain.ainvoke({"input": "Hello"}, {"callbacks": [callback]}), callback.queue, interrupt)
+    )
+    n_tokens = sent_at_interrupt = 0
+    start = 0.0
+    async for output_type, _, _ in callback.aiter():
+        if output_type == OutputType.TOKEN:
+            n_tokens += 1
+            if n_tokens == after_tokens:
+                start = time.perf_counter()
+                sent_at_interrupt = server.sent
+                interrupt.set()
+    idle = time.perf_counter() - start
+    await run
+    deadline = time.perf_counter() + 5
+    while server.disconnected_at is None and time.perf_counter() < deadline:
+        await asyncio.sleep(0.001)
+    disconnected = (server.disconnected_at or deadline) - start
+    return {
+        "interrupt_to_idle_ms": idle * 1000,
+        "server_disconnect_ms": disconnected * 1000,
+        "tokens_after_interrupt": server.sent - sent_at_interrupt,
+    }
+
+
+async def run(args: argparse.Namespace) -> dict[str, dict[str, float]]:
+    """Start the fake server and interrupt responses from it."""
+    server = FakeServer(args.tokens, args.interval)
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", server.chat_completions)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", args.port)
+    await site.start()
+    try:
+        samples = [await interrupt_once(server, args.interrupt_after) for _ in range(args.repeat)]
+    finally:
+        await runner.cleanup()
+    return {
+        key: {
+            "median": statistics.median(s[key] for s in samples),
+            "max": max(s[key] for s in samples),
+        }
+        for key in samples[0]
+    }
+
+
+def main() -> None:
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tokens", type=int, default=2000, help="tokens in a full response")
+    parser.add_argument("--interval", type=float, default=0.005, help="seconds between tokens")
+    parser.add_argument("--interrupt-after", type=int, default=20, help="tokens received before interrupting")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    # The OpenAI client reads the base URL when the chat model is created
+    os.environ["OPENAI_API_BASE"] = f"http://127.0.0.1:{args.port}/v1"
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Benchmark the memory that the loaded messages of a conversation take on the server.
+
+Messages are built from rows like those of the conversation store, once as `Message` models
+(how sessions kept them before) and once as a `MessageHistory`, and the memory that is still
+allocated afterwards is measured with tracemalloc. The text of the messages is counted
+separately, it's the same in both representations.
+
+The history is a mix of chat messages with a single text part and agent responses with tool
+parts and extra output, like conversations with plugins.
+"""
+
+import argparse
+import json
+import random
+import sys
+import tracemalloc
+import uuid
+from typing import Any, Callable, Iterator
+
+
+def rows(n_messages: int, words: int, agent_rate: float, seed: int) -> Iterator[tuple]:
+    """The parts of the messages of a conversation, as the conversation store returns them."""
+    rng = random.Random(seed)
+
+    def text() -> str:
+        return " ".join(f"word{rng.randrange(1000)}" for _ in range(words))
+
+    for i in range(n_messages):
+        m_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        own = i % 2 == 0
+        if not own and rng.random() < agent_rate:
+            # The type is a new string for every row, like the strings that SQLite returns
+            yield m_id, own, str(uuid.uuid4()), "".join("tool_end"), text(), text(), text()
+            yield m_id, own, str(uuid.uuid4()), "".join("agent_finish"), text(), None, None
+        else:
+            yield m_id, own, str(uuid.uuid4()), "".join("text"), text(), None, None
+
+
+def as_models(parts: Iterator[tuple]) -> list:
+    """Build `Message` models, like the conversation store did before messages were compact."""
+    from reflex_gptp.models import Message, MessagePart
+    from reflex_gptp.utils import MessagePartType
+
+    messages: list[Message] = []
+    for m_id, own, p_id, p_type, text, extra_output, extra_output1 in parts:
+        if not messages or messages[-1].id != m_id:
+            messages.append(Message(id=m_id, parts=[], own=bool(own)))
+        messages[-1].parts.append(
+            MessagePart(
+                id=p_id, type=MessagePartType(p_type), text=text, extra_output=extra_output, extra_output1=extra_output1
+            )
+        )
+    return messages
+
+
+def as_history(parts: Iterator[tuple]) -> Any:
+    """Build a `MessageHistory`."""
+    from reflex_gptp.message_history import MessageHistory
+
+    return MessageHistory.from_parts(parts)
+
+
+def measure(build: Callable[[Iterator[tuple]], Any], args: argparse.Namespace) -> int:
+    """The memory that the messages built from the rows still take, in bytes."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    messages = build(rows(args.messages, args.words, args.agent_rate, args.seed))
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del messages
+    return size
+
+
+def main() -> None:
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=10_000)
+    parser.add_argument("--words", type=int, default=40, help="words per text")
+    parser.add_argument("--agent-rate", type=float, default=0.2, help="share of responses that used tools")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # Load the models before measuring, so the imports aren't counted
+    as_models(iter(()))
+    as_history(iter(()))
+    text_bytes = sum(sys.getsizeof(t) for r in rows(args.messages, args.words, args.agent_rate, args.seed) for t in r[4:] if t)
+    scale = 10_000 / args.messages
+    results: dict[str, Any] = {"text_bytes_per_10k": round(text_bytes * scale)}
+    for name, build in {"models": as_models, "history": as_history}.items():
+        size = measure(build, args)
+        results[name] = {
+            "bytes_per_10k": round(size * scale),
+            "overhead_bytes_per_message": round((size - text_bytes) / args.messages),
+        }
+    results["ratio"] = round(results["models"]["bytes_per_10k"] / results["history"]["bytes_per_10k"], 2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
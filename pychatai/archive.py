@@ -0,0 +1,259 @@
+"""A versioned and compressed format for conversations, to back them up and move them between stores.
+
+An archive is a stream of JSON lines, compressed with gzip (or zstd if `zstandard` is installed):
+
+    {"format": "pychatai-convos", "version": 1, "schema": {...}}
+    {"type": "convo", "id": "...", "name": "...", "provider": "...", "model": "...", "plugins": {...}, ...}
+    {"type": "message", "convo_id": "...", "id": "...", "own": true, "parts": [{"id": "...", "type": "text", "text": "..."}]}
+
+The first line names the version of the format and describes the fields of every record.
+A conversation is followed by its messages from old to new, so archives are written and read
+one record at a time and never need all conversations in memory. Parts leave out extra output
+they don't have. Readers accept archives of their version and older ones, and conversations
+that older versions of the app pickled into local storage are read as records too.
+"""
+
+import json
+import pickle
+import time
+import zlib
+from typing import Any, Iterable, Iterator
+
+from reflex_gptp.models import UUID, Convo, Message, MessagePart
+from reflex_gptp.utils import MessagePartType
+
+FORMAT = "pychatai-convos"
+FORMAT_VERSION = 1
+
+SCHEMA: dict[str, dict[str, str]] = {
+    "convo": {
+        "id": "string",
+        "name": "string",
+        "provider": "string",
+        "model": "string",
+        "plugins": "object of booleans by plugin name",
+        "created_at": "number, seconds since the epoch",
+        "updated_at": "number, seconds since the epoch",
+    },
+    "message": {
+        "convo_id": "string",
+        "id": "string",
+        "own": "boolean, whether the user wrote the message",
+        "parts": "array of parts",
+    },
+    "part": {
+        "id": "string",
+        "type": " | ".join(t.value for t in MessagePartType),
+        "text": "string",
+        "extra_output": "string, optional",
+        "extra_output1": "string, optional",
+    },
+}
+
+Record = dict[str, Any]
+
+# Lines are compressed in batches of about this many bytes
+CHUNK_SIZE = 64 * 1024
+
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+class ArchiveError(ValueError):
+    """An archive that can't be read."""
+
+
+def _zstd() -> Any:
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ArchiveError("zstd compression needs the zstandard package") from e
+    return zstandard
+
+
+def _compressor(compression: str) -> Any:
+    if compression == "gzip":
+        return zlib.compressobj(wbits=31)
+    if compression == "zstd":
+        return _zstd().ZstdCompressor().compressobj()
+    if compression == "none":
+        return None
+    raise ArchiveError(f"Unknown compression: {compression}")
+
+
+def encode(records: Iterable[Record], compression: str = "gzip") -> Iterator[bytes]:
+    """Encode records as an archive, in chunks.
+
+    Args:
+        records: Conversation and message records, every conversation followed by its messages.
+        compression: `gzip`, `zstd` or `none`.
+    """
+    compressor = _compressor(compression)
+    header = {"format": FORMAT, "version": FORMAT_VERSION, "schema": SCHEMA}
+    lines = [json.dumps(header).encode()]
+    size = 0
+    for record in records:
+        line = json.dumps(record, ensure_ascii=False).encode()
+        lines.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            data = b"\n".join(lines) + b"\n"
+            lines, size = [], 0
+            if compressor is not None:
+                data = compressor.compress(data)
+            if data:
+                yield data
+    data = b"\n".join(lines) + b"\n" if lines else b""
+    if compressor is not None:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
+
+
+def _decompressed(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Decompress chunks of an archive, recognizing the compression from its first bytes."""
+    chunks = iter(chunks)
+    start = b""
+    for chunk in chunks:
+        start += chunk
+        if len(start) >= len(_ZSTD_MAGIC):
+            break
+    if start.startswith(_ZSTD_MAGIC):
+        decompressor = _zstd().ZstdDecompressor().decompressobj()
+    elif start[:1] in (b"\x1f", b"\x78"):
+        # Reads both gzip and zlib streams
+        decompressor = zlib.decompressobj(wbits=47)
+    else:
+        yield start
+        yield from chunks
+        return
+    try:
+        yield decompressor.decompress(start)
+        for chunk in chunks:
+            yield decompressor.decompress(chunk)
+    except zlib.error as e:
+        raise ArchiveError(f"Corrupt archive: {e}") from e
+    if not decompressor.eof:
+        raise ArchiveError("Truncated archive")
+
+
+def decode(chunks: Iterable[bytes]) -> Iterator[Record]:
+    """Decode the records of an archive, as its chunks are read.
+
+    Raises:
+        ArchiveError: If the data isn't an archive, or is an archive of a newer version.
+    """
+    header: Record | None = None
+    rest = b""
+    for data in _decompressed(chunks):
+        lines = (rest + data).split(b"\n")
+        rest = lines.pop()
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise ArchiveError(f"Corrupt archive: {e}") from e
+            if header is None:
+                header = _check_header(record)
+            else:
+                yield record
+    if rest.strip():
+        raise ArchiveError("Truncated archive")
+    if header is None:
+        raise ArchiveError("Empty archive")
+
+
+def _check_header(header: Any) -> Record:
+    if not isinstance(header, dict) or header.get("format") != FORMAT:
+        raise ArchiveError("Not a conversation archive")
+    if not isinstance(header.get("version"), int) or header["version"] > FORMAT_VERSION:
+        raise ArchiveError(f"Archive version {header.get('version')} is newer than this version of the app")
+    return header
+
+
+def convo_record(
+    convo_id: UUID,
+    name: str,
+    model: dict[str, str],
+    plugins: dict[str, bool],
+    created_at: float = 0.0,
+    updated_at: float = 0.0,
+) -> Record:
+    """The record of a conversation."""
+    return {
+        "type": "convo",
+        "id": convo_id,
+        "name": name,
+        "provider": model["provider"],
+        "model": model["name"],
+        "plugins": dict(plugins),
+        "created_at": created_at,
+        "updated_at": updated_at,
+    }
+
+
+def message_record(convo_id: UUID, message: Message) -> Record:
+    """The record of a finished message of a conversation."""
+    parts = []
+    for p in message.parts:
+        part = {"id": p.id, "type": MessagePartType(p.type).value, "text": p.text}
+        if p.extra_output is not None:
+            part["extra_output"] = p.extra_output
+        if p.extra_output1 is not None:
+            part["extra_output1"] = p.extra_output1
+        parts.append(part)
+    return {"type": "message", "convo_id": convo_id, "id": message.id, "own": message.own, "parts": parts}
+
+
+def record_message(record: Record) -> Message:
+    """The message of a message record."""
+    return Message(
+        id=record["id"],
+        parts=[
+            MessagePart(
+                id=p["id"],
+                type=MessagePartType(p["type"]),
+                text=p["text"],
+                extra_output=p.get("extra_output"),
+                extra_output1=p.get("extra_output1"),
+            )
+            for p in record["parts"]
+        ],
+        own=record["own"],
+    )
+
+
+def part_rows(record: Record) -> Iterator[tuple[UUID, bool, UUID, str, str, str | None, str | None]]:
+    """The parts of a message record as `(message_id, own, part_id, type, text, extra_output, extra_output1)`.
+
+    These are the rows that `MessageHistory.from_parts()` reads, so messages don't have to be validated as models.
+    """
+    for p in record["parts"]:
+        yield record["id"], record["own"], p["id"], p["type"], p["text"], p.get("extra_output"), p.get("extra_output1")
+
+
+def local_storage_records(
+    convos: str, convo_model: str, enabled_plugins: str, default_model: dict[str, str]
+) -> Iterator[Record]:
+    """Read the conversations that older versions pickled into local storage, as records.
+
+    Args:
+        convos: The pickled conversations, decoded as latin1.
+        convo_model: The pickled models of the conversations, if any.
+        enabled_plugins: The pickled plugins of the conversations, if any.
+        default_model: The model of conversations that have none.
+    """
+    try:
+        pickled_convos: dict[UUID, Convo] = pickle.loads(convos.encode("latin1"))
+        models = pickle.loads(convo_model.encode("latin1")) if convo_model else {}
+        plugins = pickle.loads(enabled_plugins.encode("latin1")) if enabled_plugins else {}
+    # Unpickling corrupt data can fail in many ways, e.g. with references to classes that don't exist
+    except (pickle.UnpicklingError, EOFError, ValueError, AttributeError, ImportError, IndexError, TypeError) as e:
+        raise ArchiveError(f"Corrupt conversations in local storage: {e}") from e
+    # Older versions didn't keep the time of conversations, they count as created when they're read
+    now = time.time()
+    for key, convo in pickled_convos.items():
+        yield convo_record(key, convo.name, models.get(key, default_model), plugins.get(key, {}), now, now)
+        for message in convo.messages:
+            yield message_record(key, message)
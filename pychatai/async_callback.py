@@ -1,7 +1,8 @@
 from __future__ import annotations
 
 import asyncio
-from typing import Any, AsyncIterator, Union, cast
+from typing import Any, AsyncIterator, Union
+from uuid import UUID
 
 from anthropic import AuthenticationError as AnthropicAuthenticationError
 from langchain.callbacks.base import AsyncCallbackHandler
@@ -12,84 +13,186 @@ from openai.error import AuthenticationError as OpenAIAuthenticationError
 
 from reflex_gptp.utils import OutputType
 
-# TODO If used by two LLM runs in parallel this won't work as expected
+Event = tuple[OutputType, str, str | None]
+
+# Prefix of the output of tool runs that were answered from the tool cache
+CACHED_TOOL_OUTPUT_FLAG = "[cached] "
+
+# Events after which a stream ends
+TERMINAL_OUTPUT_TYPES = frozenset([OutputType.AGENT_FINISH, OutputType.LLM_ERROR, OutputType.INTERRUPT])
+
+
+async def iterate_events(queue: asyncio.Queue[Event]) -> AsyncIterator[Event]:
+    """Iterate over the events in a queue until the stream ends."""
+    while True:
+        event = await queue.get()
+        yield event
+        if event[0] in TERMINAL_OUTPUT_TYPES:
+            break
 
 
 class CustomAsyncIteratorCallbackHandler(AsyncCallbackHandler):
-    """Callback handler that returns an async iterator."""
+    """Callback handler that returns async iterators over the events of LLM runs.
+
+    By default all events go to `queue`, which is iterated with `aiter()`.
+    With `demultiplex=True`, the handler can be shared by runs that happen in parallel:
+    every top-level run gets its own stream, that receives the events of the run and all
+    of its child runs. The ids of new top-level runs are put on `runs`, and the events of
+    a run are iterated with `aiter_run(run_id)`.
+    """
 
-    queue: asyncio.Queue[tuple[OutputType, str, str | None]]
+    queue: asyncio.Queue[Event]
+    runs: asyncio.Queue[UUID]
 
     @property
     def always_verbose(self) -> bool:
         return True
 
-    def __init__(self) -> None:
+    def __init__(self, demultiplex: bool = False) -> None:
         self.queue = asyncio.Queue()
+        self.runs = asyncio.Queue()
+        self.demultiplex = demultiplex
+        self._streams: dict[UUID, asyncio.Queue[Event]] = {}
+        # Top-level run of every run that has started and not ended yet
+        self._roots: dict[UUID, UUID] = {}
+        # Tool runs that were answered from the tool cache
+        self._cached_runs: set[UUID] = set()
+
+    def _start_run(self, run_id: UUID, parent_run_id: UUID | None) -> None:
+        if parent_run_id is not None:
+            self._roots[run_id] = self._roots.get(parent_run_id, parent_run_id)
+            return
+        self._roots[run_id] = run_id
+        if self.demultiplex:
+            self._streams[run_id] = asyncio.Queue()
+            self.runs.put_nowait(run_id)
+
+    def _end_run(self, run_id: UUID, output: str = "", error: BaseException | None = None) -> None:
+        root = self._roots.pop(run_id, None)
+        if root != run_id or run_id not in self._streams:
+            return
+        # The stream of a top-level run ends when the run ends, if no earlier event ended it
+        if error is None:
+            self._streams[run_id].put_nowait((OutputType.AGENT_FINISH, output, None))
+        elif isinstance(error, asyncio.CancelledError):
+            self._streams[run_id].put_nowait((OutputType.INTERRUPT, "Interrupted", None))
+        else:
+            self._streams[run_id].put_nowait((OutputType.LLM_ERROR, str(error), None))
+
+    def _put(self, event: Event, run_id: UUID | None) -> None:
+        root = self._roots.get(run_id) if run_id is not None else None
+        self._streams.get(root, self.queue).put_nowait(event)  # type: ignore
+
+    async def on_chain_start(
+        self,
+        serialized: dict[str, Any],
+        inputs: dict[str, Any],
+        *,
+        run_id: UUID,
+        parent_run_id: UUID | None = None,
+        **kwargs: Any,
+    ) -> None:
+        """Track the top-level run of a chain that started."""
+        self._start_run(run_id, parent_run_id)
+
+    async def on_chain_end(self, outputs: dict[str, Any], *, run_id: UUID, **kwargs: Any) -> None:
+        """End the stream of a top-level chain run with its output."""
+        output = outputs.get("output", outputs.get("text", "")) if isinstance(outputs, dict) else outputs
+        self._end_run(run_id, str(output))
+
+    async def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        """End the stream of a top-level chain run that failed or was interrupted."""
+        self._end_run(run_id, error=error)
 
     async def on_chat_model_start(
         self,
         serialized: dict[str, Any],
         messages: list[list[BaseMessage]],
+        *,
+        run_id: UUID,
+        parent_run_id: UUID | None = None,
         **kwargs: Any,
     ) -> None:
-        pass
+        """Track the top-level run of a chat model that started."""
+        self._start_run(run_id, parent_run_id)
 
-    async def on_llm_start(self, serialized: dict[str, Any], prompts: list[str], **kwargs: Any) -> None:
-        # If two calls are made in a row, this resets the state
-        pass
+    async def on_llm_start(
+        self,
+        serialized: dict[str, Any],
+        prompts: list[str],
+        *,
+        run_id: UUID,
+        parent_run_id: UUID | None = None,
+        **kwargs: Any,
+    ) -> None:
+        """Track the top-level run of an LLM that started."""
+        self._start_run(run_id, parent_run_id)
 
-    async def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+    async def on_llm_new_token(self, token: str, *, run_id: UUID | None = None, **kwargs: Any) -> None:
+        """Put a streamed token on the stream of its run."""
         if token is not None and token != "":
-            self.queue.put_nowait((OutputType.TOKEN, token, None))
+            self._put((OutputType.TOKEN, token, None), run_id)
 
-    async def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
-        pass
+    async def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        """End the stream of a top-level LLM run with its text."""
+        generations = response.generations
+        self._end_run(run_id, generations[0][0].text if generations and generations[0] else "")
 
-    async def on_agent_finish(self, finish: AgentFinish, **kwargs: Any) -> None:
-        self.queue.put_nowait((OutputType.AGENT_FINISH, finish.return_values["output"], finish.log))
+    async def on_agent_finish(self, finish: AgentFinish, *, run_id: UUID | None = None, **kwargs: Any) -> None:
+        """Put the final answer of an agent on the stream of its run."""
+        self._put((OutputType.AGENT_FINISH, finish.return_values["output"], finish.log), run_id)
 
-    async def on_llm_error(self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any) -> None:
+    async def on_llm_error(
+        self, error: Union[Exception, KeyboardInterrupt], *, run_id: UUID | None = None, **kwargs: Any
+    ) -> None:
+        """Put an error of an LLM on the stream of its run, unless the run was interrupted."""
+        if isinstance(error, asyncio.CancelledError):
+            # Cancelled runs were interrupted, which is not an error and is reported by whoever cancelled them
+            if run_id is not None:
+                self._roots.pop(run_id, None)
+            return
         message = str(error)
         if isinstance(error, AnthropicAuthenticationError | OpenAIAuthenticationError):
             message = "Authentication error. Please check your API key and try again."
-        self.queue.put_nowait((OutputType.LLM_ERROR, message, None))
+        self._put((OutputType.LLM_ERROR, message, None), run_id)
+        if run_id is not None:
+            self._roots.pop(run_id, None)
 
-    async def on_tool_start(self, serialized: dict[str, Any], input_str: str, **kwargs) -> None:
-        self.queue.put_nowait((OutputType.TOOL_START, serialized["name"], input_str))
-
-    async def on_tool_end(self, output: str, name: str, **kwargs) -> None:
-        self.queue.put_nowait((OutputType.TOOL_END, name, output))
+    async def on_tool_start(
+        self, serialized: dict[str, Any], input_str: str, *, run_id: UUID, parent_run_id: UUID | None = None, **kwargs
+    ) -> None:
+        """Put the start of a tool run on the stream of its run."""
+        self._start_run(run_id, parent_run_id)
+        self._put((OutputType.TOOL_START, serialized["name"], input_str), run_id)
+
+    async def on_text(self, text: str, *, run_id: UUID, cache_hit: bool = False, **kwargs: Any) -> None:
+        """Remember the tool runs that were answered from the tool cache."""
+        if cache_hit:
+            self._cached_runs.add(run_id)
+
+    async def on_tool_end(self, output: str, name: str, *, run_id: UUID, **kwargs) -> None:
+        """Put the output of a tool run on the stream of its run."""
+        if run_id in self._cached_runs:
+            self._cached_runs.discard(run_id)
+            output = CACHED_TOOL_OUTPUT_FLAG + output
+        self._put((OutputType.TOOL_END, name, output), run_id)
+        self._end_run(run_id, output)
+
+    async def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        """End a tool run that failed or was interrupted."""
+        self._cached_runs.discard(run_id)
+        self._end_run(run_id, error=error)
 
     # TODO implement the other methods
 
-    async def aiter(self) -> AsyncIterator[tuple[OutputType, str, str | None]]:  # noqa: A003
-        while True:
-            # Wait for the next token in the queue,
-            # but stop waiting if the done event is set
-            done, other = await asyncio.wait(
-                [
-                    # NOTE: If you add other tasks here, update the code below,
-                    # which assumes each set has exactly one task each
-                    asyncio.ensure_future(self.queue.get()),
-                ],
-                return_when=asyncio.FIRST_COMPLETED,
-            )
-
-            # Cancel the other task
-            if other:
-                other.pop().cancel()
-
-            # Extract the value of the first completed task
-            res = cast(tuple[OutputType, str, str | None], done.pop().result())
-            output_type = res[0]
-
-            yield res
-
-            # If the agent finished or there is an error, stop the loop
-            if output_type in [
-                OutputType.AGENT_FINISH,
-                OutputType.LLM_ERROR,
-                OutputType.INTERRUPT,
-            ]:
-                break
+    def aiter(self) -> AsyncIterator[Event]:  # noqa: A003
+        """Iterate over the events in `queue` until an agent finishes, an error occurs or the run is interrupted."""
+        return iterate_events(self.queue)
+
+    async def aiter_run(self, run_id: UUID) -> AsyncIterator[Event]:
+        """Iterate over the events of a top-level run, when demultiplexing."""
+        try:
+            async for event in iterate_events(self._streams[run_id]):
+                yield event
+        finally:
+            self._streams.pop(run_id, None)
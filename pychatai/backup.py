@@ -0,0 +1,190 @@
+"""Export and import of the conversations of a client, as archives that are streamed one record at a time.
+
+    python -m reflex_gptp.backup export <client id> conversations.jsonl.gz
+    python -m reflex_gptp.backup import <client id> conversations.jsonl.gz
+
+Exports read the messages of a conversation from the store in batches, and imports write them
+in batches, so neither keeps more than a batch of messages in memory however long the history is.
+Imports skip the conversations that are already stored, so importing an archive again, or into the
+store it was exported from, changes nothing. A stored conversation may have changed since it was
+exported, e.g. a response was regenerated, and merging the old messages into it would mix both histories.
+"""
+
+import argparse
+import os
+import sys
+from contextlib import nullcontext
+from itertools import chain, groupby, islice
+from typing import BinaryIO, Container, Iterable, Iterator, NamedTuple
+
+from reflex_gptp.archive import (
+    CHUNK_SIZE,
+    ArchiveError,
+    Record,
+    convo_record,
+    decode,
+    encode,
+    message_record,
+    record_message,
+)
+from reflex_gptp.store import ConvoInfo, ConvoStore, get_store
+
+# Number of messages that are read from or written to the store at once
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "500"))
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+
+# Compression of archives by the extension of their file name, and the file name of exports by their compression
+compressions = {".gz": "gzip", ".zst": "zstd", ".jsonl": "none", ".ndjson": "none"}
+export_filenames = {"gzip": "conversations.jsonl.gz", "zstd": "conversations.jsonl.zst", "none": "conversations.jsonl"}
+
+
+class ImportResult(NamedTuple):
+    """The number of conversations and messages in an archive that were imported or skipped."""
+
+    convos: int
+    messages: int
+    # Messages of conversations that were already stored, or that were already stored themselves
+    skipped_messages: int
+
+
+def export_records(store: ConvoStore, client_id: str, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[Record]:
+    """The records of all conversations of a client, read from the store as they're consumed."""
+    for info in store.list_convos(client_id):
+        model = {"provider": info.provider, "name": info.model}
+        yield convo_record(info.id, info.name, model, info.plugins, info.created_at, info.updated_at)
+        for batch in store.iter_messages(info.id, batch_size):
+            for message in batch:
+                yield message_record(info.id, message)
+
+
+def export_archive(
+    store: ConvoStore, client_id: str, compression: str = "gzip", batch_size: int = EXPORT_BATCH_SIZE
+) -> Iterator[bytes]:
+    """The chunks of an archive of all conversations of a client."""
+    return encode(export_records(store, client_id, batch_size), compression)
+
+
+def _by_convo(records: Iterable[Record]) -> Iterator[tuple[str, Iterator[Record]]]:
+    """Group consecutive records by the id of their conversation, records of other types are left out.
+
+    In an exported archive, a conversation and its messages are one group. Archives that were
+    concatenated or reordered may have more groups of a conversation.
+    """
+    records = (r for r in records if r["type"] in ("convo", "message"))
+    return groupby(records, lambda r: r["id"] if r["type"] == "convo" else r["convo_id"])
+
+
+def _message_records(convo_id: str, records: Iterable[Record]) -> Iterator[Record]:
+    for record in records:
+        if record["type"] == "convo":
+            raise ArchiveError(f"Duplicate conversation {convo_id}")
+        yield record
+
+
+def _split_group(convo_id: str, group: Iterator[Record], known: Container[str]) -> tuple[Record | None, Iterator[Record]]:
+    """Split a group of records into its conversation record, if it starts with one, and its message records."""
+    first = next(group)
+    if first["type"] == "convo":
+        if convo_id in known:
+            raise ArchiveError(f"Duplicate conversation {convo_id}")
+        return first, _message_records(convo_id, group)
+    if convo_id not in known:
+        raise ArchiveError(f"Message of an unknown conversation {convo_id}")
+    return None, _message_records(convo_id, chain([first], group))
+
+
+def _convo_info(record: Record) -> ConvoInfo:
+    return ConvoInfo(
+        record["id"],
+        record["name"],
+        record["provider"],
+        record["model"],
+        record["plugins"],
+        record["created_at"],
+        record["updated_at"],
+    )
+
+
+def import_records(
+    store: ConvoStore, client_id: str, records: Iterable[Record], batch_size: int = IMPORT_BATCH_SIZE
+) -> ImportResult:
+    """Import the conversations and messages of an archive for a client.
+
+    Conversations that are already stored, by this client or another one, are left as they are.
+    Messages are imported into the conversation of their `convo_id`, which must come before them
+    in the archive. Every group of records of a conversation is imported in a transaction, which in
+    an exported archive is the conversation with all its messages, so an invalid record doesn't
+    leave a conversation with part of its messages, and importing the archive again after fixing it is safe.
+
+    Raises:
+        ArchiveError: If a record is invalid, a conversation is in the archive twice, or a message
+            comes before its conversation.
+    """
+    n_convos = n_messages = n_skipped = 0
+    # The conversations of the archive so far, and whether they were imported
+    imported: dict[str, bool] = {}
+    try:
+        for convo_id, group in _by_convo(records):
+            with store.transaction():
+                convo, message_records = _split_group(convo_id, group, imported)
+                if convo is not None:
+                    imported[convo_id] = store.import_convo(client_id, _convo_info(convo))
+                    n_convos += imported[convo_id]
+                if not imported[convo_id]:
+                    n_skipped += sum(1 for _ in message_records)
+                    continue
+                messages = map(record_message, message_records)
+                while batch := list(islice(messages, batch_size)):
+                    n = store.import_messages(convo_id, batch)
+                    n_messages += n
+                    n_skipped += len(batch) - n
+    except ArchiveError:
+        raise
+    except (KeyError, TypeError, ValueError) as e:
+        raise ArchiveError(f"Invalid record: {e!r}") from e
+    return ImportResult(n_convos, n_messages, n_skipped)
+
+
+def import_archive(
+    store: ConvoStore, client_id: str, chunks: Iterable[bytes], batch_size: int = IMPORT_BATCH_SIZE
+) -> ImportResult:
+    """Import an archive, as its chunks are read."""
+    return import_records(store, client_id, decode(chunks), batch_size)
+
+
+def read_chunks(f: BinaryIO) -> Iterator[bytes]:
+    """Read a file in chunks."""
+    return iter(lambda: f.read(CHUNK_SIZE), b"")
+
+
+def main() -> None:
+    """Export or import the conversations of a client from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("client_id", help="the client id, which the app keeps in the local storage of the browser")
+    parser.add_argument("path", help="the archive, or - for stdout or stdin")
+    parser.add_argument(
+        "--compression", choices=["gzip", "zstd", "none"], help="of exports, by default from the extension of the path"
+    )
+    args = parser.parse_args()
+
+    store = get_store()
+    if args.command == "export":
+        compression = args.compression or compressions.get(os.path.splitext(args.path)[1], "gzip")
+        with open(args.path, "wb") if args.path != "-" else nullcontext(sys.stdout.buffer) as f:
+            for chunk in export_archive(store, args.client_id, compression):
+                f.write(chunk)
+    else:
+        with open(args.path, "rb") if args.path != "-" else nullcontext(sys.stdin.buffer) as f:
+            try:
+                result = import_archive(store, args.client_id, read_chunks(f))
+            except ArchiveError as e:
+                parser.exit(1, f"Could not import {args.path}: {e}\n")
+        print(
+            f"Imported {result.convos} conversations and {result.messages} messages, "
+            f"skipped {result.skipped_messages} messages."
+        )
+
+
+if __name__ == "__main__":
+    main()
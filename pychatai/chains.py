@@ -0,0 +1,96 @@
+"""Chains and agents that answer the user, cached per model and set of enabled plugins.
+
+Building an agent (and its tools) or an LLM chain for every message is measurable overhead,
+so they are built once per provider, model, API key and set of plugins. Every request gets a
+shallow copy of the cached chain with its own memory, the callbacks are passed when it's invoked.
+"""
+
+import os
+from collections import OrderedDict
+from typing import NamedTuple
+
+from langchain.agents import AgentType, initialize_agent
+from langchain.chains import LLMChain
+from langchain.chains.base import Chain
+from langchain.chat_models.base import BaseChatModel
+from langchain.memory import ConversationBufferMemory
+from langchain.prompts import (
+    ChatPromptTemplate,
+    HumanMessagePromptTemplate,
+    MessagesPlaceholder,
+    SystemMessagePromptTemplate,
+)
+from langchain.tools import BaseTool
+
+from reflex_gptp.llm_pool import hash_api_key, llm_pool
+from reflex_gptp.tool_cache import cache_tool
+from reflex_gptp.utils import plugin_tool
+
+CHAIN_CACHE_SIZE = int(os.getenv("CHAIN_CACHE_SIZE", "128"))
+
+SYSTEM_PROMPT = "You are a nice chatbot having a conversation with a human. The output should be valid markdown."
+
+CHAT_PROMPT = ChatPromptTemplate(
+    messages=[
+        SystemMessagePromptTemplate.from_template(SYSTEM_PROMPT),
+        # The `variable_name` here is what must align with memory
+        MessagesPlaceholder(variable_name="chat_history"),
+        HumanMessagePromptTemplate.from_template("{input}"),
+    ]
+)  # type: ignore
+
+# Plugins whose tools keep state between calls, these tools are created for every request
+stateful_plugins = {"Python"}
+
+ChainKey = tuple[str, str, str, frozenset[str]]
+
+
+class _CachedChain(NamedTuple):
+    llm: BaseChatModel
+    chain: Chain
+    tools: dict[str, BaseTool]
+
+
+_chains: OrderedDict[ChainKey, _CachedChain] = OrderedDict()
+
+
+def _build(provider: str, llm: BaseChatModel, plugins: frozenset[str]) -> _CachedChain:
+    if not plugins:
+        return _CachedChain(llm, LLMChain(llm=llm, prompt=CHAT_PROMPT, verbose=True), {})
+    tools = {name: cache_tool(name, plugin_tool[name]()) for name in sorted(plugins)}
+    agent = (
+        AgentType.OPENAI_MULTI_FUNCTIONS if provider == "openai" else AgentType.CHAT_CONVERSATIONAL_REACT_DESCRIPTION
+    )
+    return _CachedChain(llm, initialize_agent(list(tools.values()), llm, agent=agent, verbose=True), tools)
+
+
+def get_chain(
+    provider: str, model: str, api_key: str, plugins: frozenset[str], memory: ConversationBufferMemory
+) -> Chain:
+    """Get a chain that answers the `input` of the user, with the history in `memory`.
+
+    Without plugins this is an LLM chain, otherwise an agent that can use the tools of the plugins.
+    """
+    llm = llm_pool.acquire(provider, model, api_key)
+    key = (provider, model, hash_api_key(api_key), plugins)
+    cached = _chains.get(key)
+    # If the pool replaced the client, the cached chain is rebuilt around the new one
+    if cached is None or cached.llm is not llm:
+        cached = _build(provider, llm, plugins)
+        _chains[key] = cached
+        while len(_chains) > CHAIN_CACHE_SIZE:
+            _chains.popitem(last=False)
+    else:
+        _chains.move_to_end(key)
+    update: dict = {"memory": memory}
+    if plugins & stateful_plugins:
+        update["tools"] = [plugin_tool[n]() if n in stateful_plugins else t for n, t in cached.tools.items()]
+    # `copy()` leaves out the fields that are excluded from exports, like the callbacks, so they are passed too
+    return cached.chain.copy(update={**cached.chain.__dict__, **update})
+
+
+def release_chain(chain: Chain) -> None:
+    """Release the resources of the stateful tools of a chain from `get_chain`, when it's no longer used."""
+    for tool in getattr(chain, "tools", []):
+        if hasattr(tool, "close"):
+            tool.close()
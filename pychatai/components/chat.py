@@ -1,11 +1,22 @@
 """Component that displays the chat messages and a welcome message with some settings."""
 
 from functools import partial
+from typing import Any
 
 import reflex as rx
 
 from reflex_gptp import styles
-from reflex_gptp.state import Message, MessagePart, MessagePartType, Prompt, State
+from reflex_gptp.state import (
+    ConvoState,
+    Message,
+    MessagePart,
+    MessagePartType,
+    ModelFormState,
+    Prompt,
+    State,
+    StreamState,
+    UIState,
+)
 from reflex_gptp.utils import providers_models
 
 custom_markdown = partial(
@@ -22,7 +33,7 @@ def extra_output_icon(mp: MessagePart) -> rx.Component:
         tag="info_outline",
         color="blue",
         cursor="pointer",
-        on_click=lambda: State.toggle_chat_modal(mp.id),  # type: ignore
+        on_click=lambda: UIState.toggle_chat_modal(mp.id),  # type: ignore
     )
 
 
@@ -30,7 +41,7 @@ def extra_output_modal(mp: MessagePart) -> rx.Component:
     """A modal with extra output."""
 
     def toggle_fn():
-        return State.toggle_chat_modal(mp.id)  # type: ignore
+        return UIState.toggle_chat_modal(mp.id)  # type: ignore
 
     return rx.modal(
         rx.modal_overlay(
@@ -60,7 +71,7 @@ def extra_output_modal(mp: MessagePart) -> rx.Component:
         ),
         on_overlay_click=toggle_fn,
         on_esc=toggle_fn,
-        is_open=State.chat_modals_visible[mp.id],
+        is_open=UIState.chat_modals_visible[mp.id],
     )
 
 
@@ -122,7 +133,7 @@ def chat_bubble(message: Message) -> rx.Component:
                                     tag="plus_square",
                                     cursor="pointer",
                                     align_self="flex-start",
-                                    on_click=lambda: State.set_chat_popover_visible(message.id),  # type: ignore
+                                    on_click=lambda: UIState.set_chat_popover_visible(message.id),  # type: ignore
                                 ),
                             ),
                             rx.popover_content(
@@ -132,7 +143,7 @@ def chat_bubble(message: Message) -> rx.Component:
                                         rx.text(
                                             "Copy",
                                             cursor="pointer",
-                                            on_click=lambda: State.copy_message(message),  # type: ignore
+                                            on_click=lambda: UIState.copy_message(message),  # type: ignore
                                             _hover={"bg": styles.accent_light},
                                             width="100%",
                                             text_align="center",
@@ -140,7 +151,7 @@ def chat_bubble(message: Message) -> rx.Component:
                                         rx.text(
                                             "Regenerate",
                                             cursor="pointer",
-                                            on_click=lambda: State.regenerate_response(message),  # type: ignore
+                                            on_click=lambda: ConvoState.regenerate_response(message),  # type: ignore
                                             _hover={"bg": styles.accent_light},
                                             width="100%",
                                             text_align="center",
@@ -148,11 +159,11 @@ def chat_bubble(message: Message) -> rx.Component:
                                     )
                                 ),
                                 rx.popover_close_button(
-                                    on_click=lambda: State.set_chat_popover_visible(message.id, False)  # type: ignore
+                                    on_click=lambda: UIState.set_chat_popover_visible(message.id, False)  # type: ignore
                                 ),
                             ),
                             is_lazy=True,
-                            is_open=State.chat_popovers_visible[message.id],
+                            is_open=UIState.chat_popovers_visible[message.id],
                         ),  # type: ignore
                     ),
                     rx.hstack(
@@ -166,7 +177,7 @@ def chat_bubble(message: Message) -> rx.Component:
                                     tag="plus_square",
                                     cursor="pointer",
                                     align_self="flex-start",
-                                    on_click=lambda: State.set_chat_popover_visible(message.id, True),  # type: ignore
+                                    on_click=lambda: UIState.set_chat_popover_visible(message.id, True),  # type: ignore
                                 ),
                             ),
                             rx.popover_content(
@@ -175,18 +186,18 @@ def chat_bubble(message: Message) -> rx.Component:
                                     rx.text(
                                         "Copy",
                                         cursor="pointer",
-                                        on_click=lambda: State.copy_message(message),  # type: ignore
+                                        on_click=lambda: UIState.copy_message(message),  # type: ignore
                                         _hover={"bg": styles.accent_light},
                                         width="100%",
                                         text_align="center",
                                     ),
                                 ),
                                 rx.popover_close_button(
-                                    on_click=lambda: State.set_chat_popover_visible(message.id, False)  # type: ignore
+                                    on_click=lambda: UIState.set_chat_popover_visible(message.id, False)  # type: ignore
                                 ),
                             ),
                             is_lazy=True,
-                            is_open=State.chat_popovers_visible[message.id],
+                            is_open=UIState.chat_popovers_visible[message.id],
                         ),  # type: ignore
                     ),
                 ),
@@ -195,9 +206,40 @@ def chat_bubble(message: Message) -> rx.Component:
                 **styles.message_style,
             ),
         ),
+        id=message.id,
         display="flex",
         justify_content=rx.cond(message.own, "flex-end", "flex-start"),
         margin_bottom="1",
+        outline=rx.cond(ConvoState.highlighted_message == message.id, f"2px solid {styles.accent_dark}", "none"),
+        # Let the browser skip rendering bubbles that are scrolled out of view
+        content_visibility="auto",
+        contain_intrinsic_size="auto 4em",
+    )
+
+
+def live_chat_bubble() -> rx.Component:
+    """The chat bubble of the response that is currently being streamed."""
+    return rx.box(
+        rx.cond(
+            StreamState.live_message.is_loading,
+            rx.vstack(
+                rx.skeleton_text(no_of_lines=2, width="100%"),
+                rx.cond(StreamState.live_message.queue_status != "", rx.text(StreamState.live_message.queue_status, color="gray")),
+                align_items="flex-start",
+                width="100%",
+            ),
+            rx.box(
+                rx.foreach(StreamState.live_message.parts, lambda mp: chat_bubble_part(mp)),  # type: ignore
+                custom_markdown(StreamState.live_text),
+                overflow="auto",
+                bg=styles.border_color,
+                shadow=styles.shadow_light,
+                **styles.message_style,
+            ),
+        ),
+        display="flex",
+        justify_content="flex-start",
+        margin_bottom="1",
     )
 
 
@@ -213,6 +255,22 @@ class AlwaysScrollToBottom(rx.Component):
 always_scroll_to_bottom = AlwaysScrollToBottom.create
 
 
+class LoadOlderMessages(rx.Component):
+    """A component that triggers `on_visible` when it is scrolled into view, and keeps the scroll position when older messages are added above it."""
+
+    library = "../public/load_older.js"
+    tag = "LoadOlderMessages"
+
+    count: rx.Var[int]
+
+    def get_event_triggers(self) -> dict[str, Any]:
+        """Get the event triggers of the component."""
+        return {**super().get_event_triggers(), "on_visible": list}
+
+
+load_older_messages = LoadOlderMessages.create
+
+
 def model_modal() -> rx.Component:
     """A modal that allows the user to change the model."""
     return rx.modal(
@@ -220,7 +278,7 @@ def model_modal() -> rx.Component:
             rx.modal_content(
                 rx.modal_header(
                     rx.hstack(
-                        rx.text("Model"), rx.icon(tag="close", cursor="pointer", on_click=State.toggle_model_modal)
+                        rx.text("Model"), rx.icon(tag="close", cursor="pointer", on_click=ModelFormState.toggle_model_modal)
                     )
                 ),
                 rx.modal_body(
@@ -231,31 +289,31 @@ def model_modal() -> rx.Component:
                                     list(providers_models.keys()),
                                     id="provider",
                                     placeholder="Select a provider.",
-                                    value=State.form_provider,
+                                    value=ModelFormState.form_provider,
                                     is_required=True,
-                                    on_change=State.handle_provider_change,
+                                    on_change=ModelFormState.handle_provider_change,
                                     color_schemes="twitter",
                                 ),
                                 rx.select(
-                                    State.form_provider_models,
+                                    ModelFormState.form_provider_models,
                                     id="name",
                                     placeholder="Select a model.",
                                     is_required=True,
-                                    value=State.form_model,
-                                    on_change=State.handle_model_change,
+                                    value=ModelFormState.form_model,
+                                    on_change=ModelFormState.handle_model_change,
                                     color_schemes="twitter",
                                 ),
                             ),
                             rx.button("Set", type_="submit"),
                         ),
-                        on_submit=State.handle_model_submit,
+                        on_submit=ModelFormState.handle_model_submit,
                     )
                 ),
             )
         ),
-        is_open=State.show_model_modal,
-        on_overlay_click=State.toggle_model_modal,
-        on_esc=State.toggle_model_modal,
+        is_open=ModelFormState.show_model_modal,
+        on_overlay_click=ModelFormState.toggle_model_modal,
+        on_esc=ModelFormState.toggle_model_modal,
     )
 
 
@@ -266,18 +324,18 @@ def plugins_modal() -> rx.Component:
             rx.modal_content(
                 rx.modal_header(
                     rx.hstack(
-                        rx.text("Plugins"), rx.icon(tag="close", cursor="pointer", on_click=State.toggle_plugins_modal)
+                        rx.text("Plugins"), rx.icon(tag="close", cursor="pointer", on_click=UIState.toggle_plugins_modal)
                     )
                 ),
                 rx.modal_body(
                     rx.vstack(
                         rx.checkbox_group(
                             rx.foreach(
-                                State.current_convo_plugins,
+                                ConvoState.current_convo_plugins,
                                 lambda x: rx.checkbox(
                                     x[0],
                                     is_checked=x[1],
-                                    on_change=lambda val: State.toggle_plugin(x[0], val),  # type: ignore
+                                    on_change=lambda val: ConvoState.toggle_plugin(x[0], val),  # type: ignore
                                 ),
                             ),
                         ),
@@ -286,9 +344,9 @@ def plugins_modal() -> rx.Component:
                 ),
             )
         ),
-        is_open=State.show_plugins_modal,
-        on_overlay_click=State.toggle_plugins_modal,
-        on_esc=State.toggle_plugins_modal,
+        is_open=UIState.show_plugins_modal,
+        on_overlay_click=UIState.toggle_plugins_modal,
+        on_esc=UIState.toggle_plugins_modal,
     )
 
 
@@ -299,7 +357,7 @@ def prompt_accordion_item(p: Prompt) -> rx.Component:
             rx.heading(p.title, text_align="left", max_width="70%"),
             rx.accordion_icon(),
             rx.spacer(),
-            rx.button("choose", on_click=lambda: State.set_prompt(p)),  # type: ignore
+            rx.button("choose", on_click=lambda: UIState.set_prompt(p)),  # type: ignore
         ),
         rx.accordion_panel(rx.text(p.text)),
     )
@@ -312,23 +370,37 @@ def prompts_modal() -> rx.Component:
             rx.modal_content(
                 rx.modal_header(
                     rx.hstack(
-                        rx.text("Prompts"), rx.icon(tag="close", cursor="pointer", on_click=State.toggle_prompts_modal)
+                        rx.text("Prompts"), rx.icon(tag="close", cursor="pointer", on_click=UIState.toggle_prompts_modal)
                     )
                 ),
                 rx.modal_body(
+                    rx.debounce_input(
+                        rx.input(placeholder="Search prompts", value=UIState.prompt_query, on_change=UIState.search_prompts),
+                        debounce_timeout=300,
+                    ),
                     rx.accordion(
-                        rx.foreach(State.prompts, prompt_accordion_item),  # type: ignore
+                        rx.foreach(UIState.prompts, prompt_accordion_item),  # type: ignore
                         allow_multiple=True,
                         allow_toggle=True,
                         width="100%",
                     ),  # type: ignore
+                    rx.hstack(
+                        rx.button(
+                            "Previous", on_click=UIState.previous_prompts_page, is_disabled=UIState.prompts_offset == 0
+                        ),
+                        rx.text(UIState.prompts_page_info),
+                        rx.button("Next", on_click=UIState.next_prompts_page, is_disabled=~UIState.prompts_has_next_page),
+                        justify_content="space-between",
+                        width="100%",
+                        padding_y="2",
+                    ),
                     rx.link("Source", href="https://github.com/f/awesome-chatgpt-prompts", is_external=True),
                 ),
             )
         ),
-        is_open=State.show_prompts_modal,
-        on_overlay_click=State.toggle_prompts_modal,
-        on_esc=State.toggle_prompts_modal,
+        is_open=UIState.show_prompts_modal,
+        on_overlay_click=UIState.toggle_prompts_modal,
+        on_esc=UIState.toggle_prompts_modal,
     )
 
 
@@ -340,7 +412,7 @@ def api_key_modal() -> rx.Component:
                 rx.modal_header(
                     rx.hstack(
                         rx.text("Set your API keys"),
-                        rx.icon(tag="close", cursor="pointer", on_click=State.toggle_api_key_modal),
+                        rx.icon(tag="close", cursor="pointer", on_click=UIState.toggle_api_key_modal),
                     )
                 ),
                 rx.modal_body(
@@ -370,12 +442,55 @@ def api_key_modal() -> rx.Component:
                         align_items="normal",
                     )
                 ),
-                rx.modal_footer(rx.button("Close", on_click=State.toggle_api_key_modal)),
+                rx.modal_footer(rx.button("Close", on_click=UIState.toggle_api_key_modal)),
+            )
+        ),
+        is_open=UIState.show_api_key_modal,
+        on_overlay_click=UIState.toggle_api_key_modal,
+        on_esc=UIState.toggle_api_key_modal,
+    )
+
+
+def backup_modal() -> rx.Component:
+    """A modal that allows the user to export and import their conversations."""
+    return rx.modal(
+        rx.modal_overlay(
+            rx.modal_content(
+                rx.modal_header(
+                    rx.hstack(
+                        rx.text("Back up conversations"),
+                        rx.icon(tag="close", cursor="pointer", on_click=UIState.toggle_backup_modal),
+                    )
+                ),
+                rx.modal_body(
+                    rx.vstack(
+                        rx.heading("Export"),
+                        rx.button("Download all conversations", on_click=ConvoState.export_convos),
+                        rx.heading("Import"),
+                        rx.upload(
+                            rx.text("Drop an archive here, or click to choose one."),
+                            rx.foreach(rx.selected_files("import"), rx.text),
+                            id="import",
+                            multiple=False,
+                            max_files=1,
+                            border="1px dashed #ccc",
+                            padding="1em",
+                            cursor="pointer",
+                        ),
+                        rx.button(
+                            "Import",
+                            on_click=ConvoState.import_convos(rx.upload_files(upload_id="import")),  # type: ignore
+                        ),
+                        rx.text(ConvoState.import_status),
+                        align_items="normal",
+                    )
+                ),
+                rx.modal_footer(rx.button("Close", on_click=UIState.toggle_backup_modal)),
             )
         ),
-        is_open=State.show_api_key_modal,
-        on_overlay_click=State.toggle_api_key_modal,
-        on_esc=State.toggle_api_key_modal,
+        is_open=UIState.show_backup_modal,
+        on_overlay_click=UIState.toggle_backup_modal,
+        on_esc=UIState.toggle_backup_modal,
     )
 
 
@@ -388,9 +503,17 @@ def chat_messages() -> rx.Component:
     """
     return rx.box(
         rx.cond(
-            State.convo_has_messages,
+            ConvoState.convo_has_messages,
             rx.box(
-                rx.foreach(State.current_convo_messages, chat_bubble),
+                rx.cond(
+                    ConvoState.current_convo_has_older,
+                    load_older_messages(
+                        count=ConvoState.current_convo_messages.length(),  # type: ignore
+                        on_visible=ConvoState.load_older_messages,
+                    ),
+                ),
+                rx.foreach(ConvoState.current_convo_messages, chat_bubble),
+                rx.cond(StreamState.live_convo == ConvoState.current_convo, live_chat_bubble()),
                 always_scroll_to_bottom(),
                 display="flex",
                 flex="1",
@@ -399,28 +522,28 @@ def chat_messages() -> rx.Component:
             rx.box(
                 rx.button(
                     rx.vstack(
-                        rx.text(State.current_provider),
-                        rx.image(src=f"{State.current_provider}.ico", height="32px", background="white"),
+                        rx.text(ConvoState.current_provider),
+                        rx.image(src=f"{ConvoState.current_provider}.ico", height="32px", background="white"),
                         align_items="center",
                     ),
                     height="fit-content",
                     padding="7px",
                     shadow="lg",
-                    on_click=State.toggle_model_modal,
+                    on_click=ModelFormState.toggle_model_modal,
                 ),
                 rx.hstack(
                     rx.button(
                         rx.hstack(
                             rx.text("Plugins"),
-                            rx.cond(State.n_enabled_plugins > 0, rx.badge(State.n_enabled_plugins)),
+                            rx.cond(ConvoState.n_enabled_plugins > 0, rx.badge(ConvoState.n_enabled_plugins)),
                         ),
                         height="fit-content",
                         padding="7px",
                         shadow="lg",
-                        on_click=State.toggle_plugins_modal,
+                        on_click=UIState.toggle_plugins_modal,
                     ),
                     rx.button(
-                        "Prompts", height="fit-content", padding="7px", shadow="lg", on_click=State.toggle_prompts_modal
+                        "Prompts", height="fit-content", padding="7px", shadow="lg", on_click=UIState.toggle_prompts_modal
                     ),
                 ),
                 rx.text(
@@ -428,7 +551,7 @@ def chat_messages() -> rx.Component:
                     text_align=["center", "center", "left"],
                     width="auto",
                 ),
-                rx.cond(~State.have_api_key, rx.text("You haven't set an API key yet.")),
+                rx.cond(~ConvoState.have_api_key, rx.text("You haven't set an API key yet.")),
                 model_modal(),
                 plugins_modal(),
                 prompts_modal(),
@@ -441,6 +564,7 @@ def chat_messages() -> rx.Component:
             ),
         ),
         api_key_modal(),
+        backup_modal(),
         py="8",
         display="flex",
         flex="1",
@@ -4,7 +4,7 @@ import reflex as rx
 from reflex.components.forms.textarea import TextArea
 
 from reflex_gptp import styles
-from reflex_gptp.state import State
+from reflex_gptp.state import StreamState, UIState
 
 
 class GrowingTextArea(TextArea):
@@ -25,14 +25,14 @@ def input_bar() -> rx.Component:
     """The input bar component."""
     return rx.box(
         rx.cond(
-            State.processing,
+            StreamState.processing,
             rx.button(
                 "Interrupt",
                 bg="#fef2f2",
                 color="#b91c1c",
                 _hover={"bg": "#fca5a5"},
                 border_radius="lg",
-                on_click=State.interrupt_chat,
+                on_click=StreamState.interrupt_chat,
             ),
         ),
         rx.box(
@@ -41,26 +41,26 @@ def input_bar() -> rx.Component:
                     growing_text_area(
                         placeholder="Type your message here",
                         id="input",
-                        should_focus=State.input_should_focus,
-                        on_blur=State.remove_focus,
+                        should_focus=UIState.input_should_focus,
+                        on_blur=UIState.remove_focus,
                         p="2",
-                        value=State.question,
-                        on_change=State.set_question,
+                        value=UIState.question,
+                        on_change=UIState.set_question,
                         border="none",
                         focus_border_color="transparent",
                         _hover={"border_color": styles.accent_color},
-                        is_disabled=State.processing,
+                        is_disabled=StreamState.processing,
                     ),
                     rx.button(
-                        rx.cond(State.processing, rx.spinner(color="gray", size="sm"), rx.icon(tag="arrow_forward")),
+                        rx.cond(StreamState.processing, rx.spinner(color="gray", size="sm"), rx.icon(tag="arrow_forward")),
                         type_="submit",
                         bg="transparent",
                         _hover={"bg": styles.accent_color},
-                        is_disabled=State.processing | State.empty_question,
+                        is_disabled=StreamState.processing | UIState.empty_question,
                     ),
                     align_items="flex-end",
                 ),
-                on_submit=State.handle_question_submit,
+                on_submit=StreamState.handle_question_submit,
                 width="100%",
             ),
             backdrop_filter="auto",
@@ -3,7 +3,7 @@
 import reflex as rx
 
 from reflex_gptp import styles
-from reflex_gptp.state import State
+from reflex_gptp.state import ConvoState, UIState
 
 
 def navbar(sidebar: rx.Component) -> rx.Component:
@@ -14,7 +14,7 @@ def navbar(sidebar: rx.Component) -> rx.Component:
                 rx.icon(
                     tag="hamburger",
                     mr=4,
-                    on_click=State.toggle_drawer,
+                    on_click=UIState.toggle_drawer,
                     cursor="pointer",
                 ),
                 rx.tablet_and_desktop(
@@ -23,24 +23,24 @@ def navbar(sidebar: rx.Component) -> rx.Component:
                 rx.spacer(),
                 rx.hstack(
                     rx.cond(
-                        State.convo_has_messages,
+                        ConvoState.convo_has_messages,
                         rx.tooltip(
-                            rx.image(src=f"{State.current_provider}.ico", height="16px", background="white"),
-                            label=f"Provider: {State.current_provider}; Model: {State.current_model}",
+                            rx.image(src=f"{ConvoState.current_provider}.ico", height="16px", background="white"),
+                            label=f"Provider: {ConvoState.current_provider}; Model: {ConvoState.current_model}",
                         ),
                     ),
                     rx.tooltip(
                         rx.editable(
                             rx.editable_preview(),
                             rx.editable_input(text_align="center"),
-                            placeholder=State.current_convo_name,
-                            on_submit=State.change_convo_name,
+                            placeholder=ConvoState.current_convo_name,
+                            on_submit=ConvoState.change_convo_name,
                         ),
                         label="Click to change conversation name",
                     ),
                 ),
                 rx.spacer(),
-                rx.button(rx.icon(tag="add"), on_click=State.handle_new_convo_click),
+                rx.button(rx.icon(tag="add"), on_click=ConvoState.handle_new_convo_click),
                 rx.color_mode_button(rx.color_mode_icon(), float="right"),
             ),
         ),
@@ -54,7 +54,7 @@ def navbar(sidebar: rx.Component) -> rx.Component:
                             margin_left="1em",
                             margin_top="1em",
                             z_index="999",
-                            on_click=State.toggle_drawer,
+                            on_click=UIState.toggle_drawer,
                             _hover={
                                 "cursor": "pointer",
                                 "color": styles.accent_color,
@@ -69,8 +69,8 @@ def navbar(sidebar: rx.Component) -> rx.Component:
             ),
             placement="left",
             block_scroll_on_mount=False,
-            is_open=State.drawer_open,
-            on_close=State.toggle_drawer,
+            is_open=UIState.drawer_open,
+            on_close=UIState.toggle_drawer,
             bg="rgba(255,255,255, 0.5)",
         ),  # type: ignore
         position="sticky",
@@ -4,7 +4,8 @@ import reflex as rx
 from reflex.style import color_mode
 
 from reflex_gptp import styles
-from reflex_gptp.state import UUID, State
+from reflex_gptp.models import SearchResult
+from reflex_gptp.state import UUID, ConvoState, UIState
 
 
 def convo_link(convo_key_name: tuple[UUID, str]) -> rx.Component:
@@ -14,7 +15,7 @@ def convo_link(convo_key_name: tuple[UUID, str]) -> rx.Component:
     return rx.hstack(
         rx.text(
             name,
-            on_click=lambda: State.handle_convo_link_click(key),  # type: ignore
+            on_click=lambda: ConvoState.handle_convo_link_click(key),  # type: ignore
             cursor="pointer",
             margin_top="0px",
         ),
@@ -22,21 +23,45 @@ def convo_link(convo_key_name: tuple[UUID, str]) -> rx.Component:
         rx.icon(
             tag="delete",
             mr=4,
-            on_click=lambda: State.delete_convo(key),  # type: ignore
+            on_click=lambda: ConvoState.delete_convo(key),  # type: ignore
             cursor="pointer",
         ),
         border_top="1px solid #eee",
     )
 
 
+def search_result(result: SearchResult) -> rx.Component:
+    """A message that matches the search, which opens it when clicked."""
+    return rx.box(
+        rx.text(result.convo_name, font_weight="bold"),
+        rx.markdown(result.snippet),
+        on_click=lambda: ConvoState.open_search_result(result.convo_id, result.message_id),  # type: ignore
+        cursor="pointer",
+        border_top="1px solid #eee",
+    )
+
+
 def sidebar() -> rx.Component:
     """The sidebar component."""
     return rx.vstack(
         rx.heading("Conversations", size="lg"),
-        rx.vstack(rx.foreach(State.convo_keys_names, convo_link), flex="1", overflow_y="auto", align_items="stretch"),
+        rx.debounce_input(
+            rx.input(placeholder="Search messages", value=ConvoState.search_query, on_change=ConvoState.search_messages),
+            debounce_timeout=300,
+        ),
+        rx.cond(
+            ConvoState.search_query,
+            rx.vstack(
+                rx.foreach(ConvoState.search_results, search_result), flex="1", overflow_y="auto", align_items="stretch"
+            ),
+            rx.vstack(
+                rx.foreach(ConvoState.convo_keys_names, convo_link), flex="1", overflow_y="auto", align_items="stretch"
+            ),
+        ),
         rx.hstack(
-            rx.button("Set API key", on_click=State.toggle_api_key_modal, width="100%"),
-            rx.button(rx.icon(tag="delete", on_click=State.delete_convos)),
+            rx.button("Set API key", on_click=UIState.toggle_api_key_modal, width="100%"),
+            rx.button(rx.icon(tag="download"), on_click=UIState.toggle_backup_modal),
+            rx.button(rx.icon(tag="delete", on_click=ConvoState.delete_convos)),
         ),
         align_items="stretch",
         flex_direction="column",
@@ -56,7 +81,7 @@ def sidebar_wrapper(sb: rx.Component) -> rx.Component:
         bg=rx.cond(color_mode == "light", styles.bg_light_color, styles.bg_dark_color),
         shadow=styles.shadow_light,
         position="fixed",
-        left=rx.cond(State.drawer_open, 0, "-80"),
+        left=rx.cond(UIState.drawer_open, 0, "-80"),
         display="flex",
         height="100%",
         transition="all 0.2s ease-in-out",
@@ -0,0 +1,53 @@
+"""Computed vars that are cached and only recomputed when the vars they declare as dependencies change.
+
+Reflex recomputes the computed vars of `rx.var` on every event, and sends them in every delta,
+even when the event only streamed a token. `rx.cached_var` finds the dependencies of a var by
+disassembling its getter, which misses vars that are only read through helpers or local
+variables. The vars of `cached_var()` declare their dependencies instead:
+
+    @cached_var("convos", "current_convo")
+    def current_convo_name(self) -> str:
+        return self.convos[self.current_convo].name
+
+Dependencies can be base vars, backend vars or other computed vars of the same state.
+"""
+
+from types import CodeType, FunctionType
+from typing import Any, Callable, Optional
+
+from reflex.vars import ComputedVar
+
+
+class DependentVar(ComputedVar):
+    """A cached computed var with explicitly declared dependencies."""
+
+    # The names of the vars that the var is computed from
+    _dependencies: frozenset[str] = frozenset()
+
+    def _deps(
+        self,
+        objclass: type,
+        obj: FunctionType | CodeType | None = None,
+        self_name: Optional[str] = None,
+    ) -> set[str]:
+        """The declared dependencies, instead of those found in the bytecode of the getter."""
+        unknown = self._dependencies - set(objclass.vars) - set(objclass.backend_vars)
+        if unknown:
+            raise ValueError(f"Computed var {self._var_name} depends on unknown vars: {', '.join(sorted(unknown))}")
+        return set(self._dependencies)
+
+
+def cached_var(*dependencies: str) -> Callable[[Callable[[Any], Any]], DependentVar]:
+    """Decorate a getter as a computed var that is only recomputed when one of its dependencies changes.
+
+    Args:
+        dependencies: The names of the vars that the getter reads.
+    """
+
+    def decorator(fget: Callable[[Any], Any]) -> DependentVar:
+        cvar = DependentVar(fget=fget)
+        cvar._cache = True
+        cvar._dependencies = frozenset(dependencies)
+        return cvar
+
+    return decorator
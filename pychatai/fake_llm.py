@@ -0,0 +1,186 @@
+"""An offline fake LLM provider, for load, latency and soak tests without a network or API keys.
+
+The fake chat model streams a response at a configurable rate, after a configurable delay for
+the first token. The text comes from a script or is generated from it, depending on the model:
+
+- `fake-script` answers with the responses of the script in turn,
+- `fake-markov` generates text with a bigram Markov chain trained on the script,
+- `fake-random` picks random words of the script.
+
+In agent runs, it can call a random tool before it gives its final answer, and any response can
+fail with an error partway through.
+"""
+
+import asyncio
+import itertools
+import json
+import os
+import random
+import re
+import time
+from typing import Any, Iterator
+
+from langchain.callbacks.manager import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain.chat_models.base import BaseChatModel
+from langchain.pydantic_v1 import PrivateAttr
+from langchain.schema import AIMessage, BaseMessage, ChatGeneration, ChatResult
+
+FAKE_LLM_TOKENS_PER_SECOND = float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND", "50"))
+FAKE_LLM_FIRST_TOKEN_DELAY = float(os.getenv("FAKE_LLM_FIRST_TOKEN_DELAY", "0.3"))
+# Number of tokens of generated responses
+FAKE_LLM_RESPONSE_TOKENS = int(os.getenv("FAKE_LLM_RESPONSE_TOKENS", "150"))
+# A text file with the responses of the script, separated by lines with `---`
+FAKE_LLM_SCRIPT = os.getenv("FAKE_LLM_SCRIPT", "")
+# Probabilities that an agent run calls a tool, and that a response fails
+FAKE_LLM_TOOL_CALL_RATE = float(os.getenv("FAKE_LLM_TOOL_CALL_RATE", "0"))
+FAKE_LLM_ERROR_RATE = float(os.getenv("FAKE_LLM_ERROR_RATE", "0"))
+# If set, the sequence of responses of a model is reproducible
+FAKE_LLM_SEED = os.getenv("FAKE_LLM_SEED", "")
+
+DEFAULT_SCRIPT = """Sure! Here is a short overview of the topic.
+
+The most important thing to keep in mind is that every system has trade-offs. A faster solution
+often uses more memory, and a simpler solution is often easier to maintain than a clever one.
+
+- Start by measuring where the time goes.
+- Fix the biggest problem first.
+- Measure again to make sure it helped.
+
+Let me know if you want me to go into more detail on any of these steps.
+---
+That's a good question. In short, it depends on what you want to optimize for.
+
+```python
+def fibonacci(n: int) -> int:
+    a, b = 0, 1
+    for _ in range(n):
+        a, b = b, a + b
+    return a
+```
+
+This version runs in linear time and constant memory, which is fine for most uses.
+---
+I'm not completely sure, but here is what I know. The answer has a few parts, and the details
+matter, so I'll go through them one by one and point out where I'm making assumptions."""
+
+
+class FakeLLMError(Exception):
+    """An error of the fake LLM, to test how errors are handled."""
+
+
+def _load_script(path: str) -> list[str]:
+    text = DEFAULT_SCRIPT
+    if path:
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+    return [response.strip() for response in re.split(r"^---$", text, flags=re.MULTILINE) if response.strip()]
+
+
+def _tokenize(text: str) -> list[str]:
+    return re.findall(r"\s*\S+", text)
+
+
+def _markov(words: list[str], n_tokens: int, rng: random.Random) -> str:
+    chain: dict[str, list[str]] = {}
+    for word, next_word in itertools.pairwise(words):
+        chain.setdefault(word, []).append(next_word)
+    word = rng.choice(words)
+    result = [word]
+    for _ in range(n_tokens - 1):
+        word = rng.choice(chain.get(word) or words)
+        result.append(word)
+    return " ".join(result)
+
+
+def _agent_action(action: str, action_input: str) -> str:
+    blob = json.dumps({"action": action, "action_input": action_input}, indent=4)
+    return f"```json\n{blob}\n```"
+
+
+class FakeChatModel(BaseChatModel):
+    """A chat model that streams scripted or generated text, without calling any service."""
+
+    model: str = "fake-markov"
+    tokens_per_second: float = FAKE_LLM_TOKENS_PER_SECOND
+    first_token_delay: float = FAKE_LLM_FIRST_TOKEN_DELAY
+    response_tokens: int = FAKE_LLM_RESPONSE_TOKENS
+    script: list[str] = _load_script(FAKE_LLM_SCRIPT)
+    tool_call_rate: float = FAKE_LLM_TOOL_CALL_RATE
+    error_rate: float = FAKE_LLM_ERROR_RATE
+    seed: int | None = int(FAKE_LLM_SEED) if FAKE_LLM_SEED else None
+
+    _rng: random.Random = PrivateAttr()
+
+    def __init__(self, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        # Seeded once per model, so the responses of a seeded model still differ from each other
+        self._rng = random.Random(self.seed)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def _respond(self, messages: list[BaseMessage]) -> tuple[list[str], int | None]:
+        """The tokens of the response, and after how many tokens it fails, if it does."""
+        rng = self._rng
+        turn = sum(isinstance(m, AIMessage) for m in messages)
+        if self.model == "fake-script":
+            text = self.script[turn % len(self.script)]
+        else:
+            words = " ".join(self.script).split()
+            if self.model == "fake-random":
+                text = " ".join(rng.choice(words) for _ in range(self.response_tokens))
+            else:
+                text = _markov(words, self.response_tokens, rng)
+
+        # Agents of the conversational type list their tools and expect a JSON blob with an action
+        prompt = "\n".join(str(m.content) for m in messages)
+        if "action_input" in prompt:
+            tools = re.findall(r"^> (.+?):", prompt, flags=re.MULTILINE)
+            answered_tool = str(messages[-1].content).startswith("TOOL RESPONSE")
+            if tools and not answered_tool and rng.random() < self.tool_call_rate:
+                text = _agent_action(rng.choice(tools), " ".join(text.split()[:5]))
+            else:
+                text = _agent_action("Final Answer", text)
+
+        tokens = _tokenize(text)
+        fail_after = rng.randrange(len(tokens) + 1) if rng.random() < self.error_rate else None
+        return tokens, fail_after
+
+    def _stream_tokens(self, messages: list[BaseMessage]) -> Iterator[tuple[str, float]]:
+        """The tokens of the response with the delay before each of them."""
+        tokens, fail_after = self._respond(messages)
+        for i, token in enumerate(tokens):
+            if i == fail_after:
+                raise FakeLLMError("The fake LLM failed, as configured with FAKE_LLM_ERROR_RATE.")
+            yield token, self.first_token_delay if i == 0 else 1 / self.tokens_per_second
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: CallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        text = ""
+        for token, delay in self._stream_tokens(messages):
+            time.sleep(delay)
+            text += token
+            if run_manager is not None:
+                run_manager.on_llm_new_token(token)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    async def _agenerate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: AsyncCallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        text = ""
+        for token, delay in self._stream_tokens(messages):
+            await asyncio.sleep(delay)
+            text += token
+            if run_manager is not None:
+                await run_manager.on_llm_new_token(token)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
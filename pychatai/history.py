@@ -0,0 +1,154 @@
+"""Building the chat history that is sent to the LLM."""
+
+import os
+from collections import deque
+from functools import lru_cache
+from typing import Callable, Iterable, Sequence
+
+from langchain.schema import AIMessage, BaseMessage, HumanMessage
+
+from reflex_gptp.models import UUID, Message
+from reflex_gptp.utils import model_context_size
+
+# Tokens of the context window that are kept free for the system prompt, the question and the response
+RESPONSE_RESERVE_TOKENS = int(os.getenv("RESPONSE_RESERVE_TOKENS", "1024"))
+# If set, the history never takes more than this many tokens, even if the model allows more
+MAX_HISTORY_TOKENS = int(os.getenv("MAX_HISTORY_TOKENS", "0"))
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+
+        # Downloads the encoding the first time, which fails without network access
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:  # noqa: BLE001
+        # The failure is cached too, so the download isn't tried again for every text
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """Count the tokens in a text.
+
+    This uses the `cl100k_base` encoding for every model, which is exact for OpenAI models
+    and close enough for the budget of other providers. Without tiktoken, or if the encoding
+    can't be loaded, it's estimated.
+    """
+    encoding = _encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def history_budget(model: str) -> int:
+    """The number of tokens that the history of a conversation with a model may use."""
+    budget = model_context_size.get(model, 4096) - RESPONSE_RESERVE_TOKENS
+    if MAX_HISTORY_TOKENS > 0:
+        budget = min(budget, MAX_HISTORY_TOKENS)
+    return max(budget, 0)
+
+
+def to_langchain_message(message: Message) -> BaseMessage:
+    """Convert a message to the message sent to the LLM."""
+    msg_cls = HumanMessage if message.own else AIMessage
+    return msg_cls(content="\n".join([x.text for x in message.parts]))
+
+
+def message_tokens(message: Message) -> int:
+    """The number of tokens of a finished message, which is cached on the message."""
+    if message.n_tokens is None:
+        message.n_tokens = count_tokens("\n".join([x.text for x in message.parts]))
+    return message.n_tokens
+
+
+class ContextWindow:
+    """The newest messages of a conversation that fit in the history budget of a model.
+
+    The window is updated incrementally: messages that were added since the last turn are
+    appended and the oldest ones are dropped until the window fits the budget again.
+    """
+
+    def __init__(self, model: str) -> None:
+        self.model = model
+        self.budget = history_budget(model)
+        self._messages: deque[tuple[BaseMessage, int]] = deque()
+        self._n_tokens = 0
+        self.last_id: UUID | None = None
+
+    def __len__(self) -> int:
+        """The number of messages in the window."""
+        return len(self._messages)
+
+    def extend(self, messages: Iterable[Message]) -> None:
+        """Append finished messages to the window, dropping the oldest messages that no longer fit."""
+        for message in messages:
+            n_tokens = message_tokens(message)
+            self._messages.append((to_langchain_message(message), n_tokens))
+            self._n_tokens += n_tokens
+            self.last_id = message.id
+        while self._messages and self._n_tokens > self.budget:
+            self._n_tokens -= self._messages.popleft()[1]
+
+    def prepend(self, messages: Iterable[Message]) -> bool:
+        """Prepend older messages, newest first, until the budget is full.
+
+        Returns:
+            Whether all messages fit in the window.
+        """
+        for message in messages:
+            n_tokens = message_tokens(message)
+            if self._n_tokens + n_tokens > self.budget:
+                return False
+            self._messages.appendleft((to_langchain_message(message), n_tokens))
+            self._n_tokens += n_tokens
+        return True
+
+    def messages(self, reserve: int = 0) -> list[BaseMessage]:
+        """The messages in the window, leaving room for `reserve` more tokens."""
+        n_tokens = self._n_tokens
+        skip = 0
+        for _, tokens in self._messages:
+            if n_tokens + reserve <= self.budget:
+                break
+            n_tokens -= tokens
+            skip += 1
+        return [m for m, _ in list(self._messages)[skip:]]
+
+
+def update_context_window(
+    window: ContextWindow | None,
+    model: str,
+    messages: Sequence[Message],
+    load_older: Callable[[UUID], Sequence[Message]] | None = None,
+) -> ContextWindow:
+    """Bring the context window of a conversation up to date with its finished messages.
+
+    Args:
+        window: The window of the previous turn, if any.
+        model: The model that the history is for.
+        messages: The newest messages of the conversation that are loaded, from old to new.
+        load_older: Loads a page of messages older than the given message id, from old to new.
+            It's used when the loaded messages don't fill the budget of a new window.
+
+    Returns:
+        The updated window, which is a new one if the previous one could not be updated.
+    """
+    if window is not None and window.model == model:
+        # Only the messages after the last one in the window are new
+        for i in range(len(messages) - 1, -1, -1):
+            if messages[i].id == window.last_id:
+                window.extend(messages[i + 1 :])
+                return window
+    window = ContextWindow(model)
+    if not messages:
+        return window
+    window.extend(messages[-1:])
+    if not window:
+        return window
+    older = messages[:-1]
+    while window.prepend(older[::-1]) and load_older is not None:
+        older = load_older(older[0].id if older else messages[-1].id)
+        if not older:
+            break
+    return window
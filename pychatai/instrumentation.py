@@ -0,0 +1,98 @@
+"""Metrics of the requests that the app answers, recorded while they stream."""
+
+import asyncio
+import itertools
+import os
+import time
+from typing import Any
+from uuid import UUID
+
+from langchain.callbacks.base import AsyncCallbackHandler
+
+from reflex_gptp.metrics import Counter, Gauge, Histogram
+from reflex_gptp.utils import OutputType
+
+# Sizes of the state of sessions, in bytes
+STATE_SIZE_BUCKETS = tuple(float(2**i) for i in range(10, 27, 2))
+# The size of the state is recorded after every this many responses, or never if 0.
+# Measuring it pickles the whole state of the session, which takes longer the more messages are loaded.
+STATE_SIZE_SAMPLE_INTERVAL = int(os.getenv("STATE_SIZE_SAMPLE_INTERVAL", "50"))
+
+responses_total = Counter(
+    "pychatai_responses_total", "Responses by provider and outcome (ok, error, interrupted).", ("provider", "outcome")
+)
+time_to_first_token = Histogram(
+    "pychatai_time_to_first_token_seconds", "Time from a question until the first token of its response.", ("provider",)
+)
+response_duration = Histogram(
+    "pychatai_response_duration_seconds", "Time from a question until its response is finished.", ("provider",)
+)
+tokens_out = Counter("pychatai_tokens_out_total", "Tokens streamed to clients.", ("provider",))
+llm_errors = Counter("pychatai_llm_errors_total", "Responses that failed.", ("provider",))
+tool_calls = Counter("pychatai_tool_calls_total", "Tool runs by tool and outcome (ok, error).", ("tool", "outcome"))
+tool_duration = Histogram("pychatai_tool_duration_seconds", "Duration of tool runs.", ("tool",))
+active_streams = Gauge("pychatai_active_streams", "Responses that are being generated.")
+session_state_size = Histogram(
+    "pychatai_session_state_bytes",
+    "Pickled size of the state of a session after a sample of responses.",
+    buckets=STATE_SIZE_BUCKETS,
+)
+_responses = itertools.count()
+
+
+def sample_state_size() -> bool:
+    """Whether to record the size of the state after the current response."""
+    return STATE_SIZE_SAMPLE_INTERVAL > 0 and next(_responses) % STATE_SIZE_SAMPLE_INTERVAL == 0
+
+
+class RequestMetrics(AsyncCallbackHandler):
+    """Records the metrics of a request.
+
+    The events of the response are passed to `observe()`, tool runs are seen as a callback handler
+    of the chain, and `finish()` is called when the response is finished.
+    """
+
+    def __init__(self, provider: str) -> None:
+        self.provider = provider
+        self.started = time.perf_counter()
+        self.first_token: float | None = None
+        self.outcome = "ok"
+        self._tool_runs: dict[UUID, tuple[str, float]] = {}
+        active_streams.inc()
+
+    def observe(self, output_type: OutputType) -> None:
+        """Record an event of the response."""
+        if output_type == OutputType.TOKEN:
+            if self.first_token is None:
+                self.first_token = time.perf_counter()
+                time_to_first_token.labels(self.provider).observe(self.first_token - self.started)
+            tokens_out.labels(self.provider).inc()
+        elif output_type == OutputType.LLM_ERROR:
+            self.outcome = "error"
+            llm_errors.labels(self.provider).inc()
+        elif output_type == OutputType.INTERRUPT:
+            self.outcome = "interrupted"
+
+    def finish(self) -> None:
+        """Record the end of the response."""
+        active_streams.dec()
+        response_duration.labels(self.provider).observe(time.perf_counter() - self.started)
+        responses_total.labels(self.provider, self.outcome).inc()
+
+    async def on_tool_start(self, serialized: dict[str, Any], input_str: str, *, run_id: UUID, **kwargs: Any) -> None:
+        """Start timing a tool run."""
+        self._tool_runs[run_id] = (serialized["name"], time.perf_counter())
+
+    def _end_tool_run(self, run_id: UUID, outcome: str) -> None:
+        if (tool_run := self._tool_runs.pop(run_id, None)) is not None:
+            name, started = tool_run
+            tool_calls.labels(name, outcome).inc()
+            tool_duration.labels(name).observe(time.perf_counter() - started)
+
+    async def on_tool_end(self, output: str, *, run_id: UUID, **kwargs: Any) -> None:
+        """Record a tool run that finished."""
+        self._end_tool_run(run_id, "ok")
+
+    async def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        """Record a tool run that failed or was interrupted."""
+        self._end_tool_run(run_id, "interrupted" if isinstance(error, asyncio.CancelledError) else "error")
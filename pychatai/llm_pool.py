@@ -0,0 +1,209 @@
+"""A process-wide pool of LLM clients that are reused across requests.
+
+Creating a chat model for every message also creates new HTTP clients, so every response
+starts with new connections and TLS handshakes. The pool keeps a bounded number of clients,
+keyed by provider, model and a hash of the API key, and drops clients that have been idle
+for too long. Callbacks are not bound to the pooled clients, they are passed per request
+through the `callbacks` entry of the config when the chain is invoked.
+
+The HTTP responses that a request opens are tracked, so that an interrupted request can close
+the streams it was reading, instead of leaving them to be read or garbage collected later.
+"""
+
+import asyncio
+import contextlib
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Callable, Iterator
+
+from langchain.chat_models import ChatAnthropic, ChatOpenAI
+from langchain.chat_models.base import BaseChatModel
+
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "64"))
+LLM_POOL_IDLE_TIMEOUT = float(os.getenv("LLM_POOL_IDLE_TIMEOUT", "300"))
+
+PoolKey = tuple[str, str, str]
+
+TEMPERATURE = 0.7
+
+
+def _openai(model: str, api_key: str) -> BaseChatModel:
+    return ChatOpenAI(
+        model=model,
+        max_tokens=None,
+        temperature=TEMPERATURE,
+        api_key=api_key,
+        n=1,
+        streaming=True,
+    )
+
+
+def _anthropic(model: str, api_key: str) -> BaseChatModel:
+    return ChatAnthropic(
+        anthropic_api_key=api_key,  # type: ignore
+        streaming=True,
+        model_name=model,
+        temperature=TEMPERATURE,
+        verbose=True,
+    )
+
+
+def _fake(model: str, api_key: str) -> BaseChatModel:
+    from reflex_gptp.fake_llm import FakeChatModel
+
+    return FakeChatModel(model=model)
+
+
+llm_factories: dict[str, Callable[[str, str], BaseChatModel]] = {
+    "openai": _openai,
+    "anthropic": _anthropic,
+    "fake": _fake,
+}
+
+
+# HTTP responses of the current request that may still be open
+_open_responses: ContextVar[set[Any] | None] = ContextVar("_open_responses", default=None)
+
+
+@contextlib.contextmanager
+def track_responses() -> Iterator[set[Any]]:
+    """Track the HTTP responses that LLM clients open in this context and in tasks created in it."""
+    responses: set[Any] = set()
+    token = _open_responses.set(responses)
+    try:
+        yield responses
+    finally:
+        _open_responses.reset(token)
+
+
+def _track_response(response: Any) -> None:
+    responses = _open_responses.get()
+    if responses is not None:
+        responses.add(response)
+
+
+async def close_responses(responses: set[Any]) -> None:
+    """Close tracked HTTP responses, so the connections of streams that were not read to the end are closed."""
+    while responses:
+        response = responses.pop()
+        if hasattr(response, "aclose"):
+            # httpx, used by the anthropic client
+            await response.aclose()
+        else:
+            # aiohttp, used by the openai client
+            response.close()
+
+
+def hash_api_key(api_key: str) -> str:
+    """Hash an API key, so it can be used in keys without keeping it around in plain text."""
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+
+async def _on_aiohttp_request_end(session: Any, context: Any, params: Any) -> None:
+    _track_response(params.response)
+
+
+async def _on_httpx_response(response: Any) -> None:
+    _track_response(response)
+
+
+def _track_httpx_responses(llm: BaseChatModel) -> None:
+    # The anthropic client doesn't take an HTTP client in this version, so the hook is added to the one it created
+    http_client = getattr(getattr(llm, "async_client", None), "_client", None)
+    if http_client is not None:
+        http_client.event_hooks["response"].append(_on_httpx_response)
+
+
+# Sessions of evicted clients that are being closed, so their tasks aren't garbage collected before they finish
+_closing: set[asyncio.Task] = set()
+
+
+def _on_closed(task: asyncio.Task) -> None:
+    _closing.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Closing the HTTP session of an LLM client failed: {task.exception()!r}")
+
+
+class _PooledClient:
+    def __init__(self, llm: BaseChatModel) -> None:
+        self.llm = llm
+        self.last_used = time.monotonic()
+        # Keep-alive HTTP session for the `openai` module, which otherwise opens a new one per request
+        self.session: Any = None
+
+
+class LLMClientPool:
+    """A bounded pool of LLM clients with least-recently-used and idle eviction."""
+
+    def __init__(self, max_size: int = LLM_POOL_SIZE, idle_timeout: float = LLM_POOL_IDLE_TIMEOUT) -> None:
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._clients: OrderedDict[PoolKey, _PooledClient] = OrderedDict()
+
+    def __len__(self) -> int:
+        """The number of clients in the pool."""
+        return len(self._clients)
+
+    def acquire(self, provider: str, model: str, api_key: str) -> BaseChatModel:
+        """Get the client for a provider, model and API key, creating it if needed.
+
+        For OpenAI, this also makes the `openai` module use the keep-alive session of the client
+        in the current context, so it must be called in the task that invokes the LLM (or the
+        task that creates it).
+
+        Raises:
+            ValueError: If the provider is unknown.
+        """
+        if provider not in llm_factories:
+            raise ValueError(f"Unknown provider {provider}")
+        now = time.monotonic()
+        self._evict_idle(now)
+        key = (provider, model, hash_api_key(api_key))
+        client = self._clients.get(key)
+        if client is None:
+            client = _PooledClient(llm_factories[provider](model, api_key))
+            if provider == "anthropic":
+                _track_httpx_responses(client.llm)
+            self._clients[key] = client
+            while len(self._clients) > self.max_size:
+                self._close(self._clients.popitem(last=False)[1])
+        else:
+            self._clients.move_to_end(key)
+        client.last_used = now
+        if provider == "openai":
+            self._bind_openai_session(client)
+        return client.llm
+
+    def _bind_openai_session(self, client: _PooledClient) -> None:
+        import aiohttp
+        import openai
+
+        if client.session is None or client.session.closed:
+            trace_config = aiohttp.TraceConfig()
+            trace_config.on_request_end.append(_on_aiohttp_request_end)
+            client.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(keepalive_timeout=self.idle_timeout), trace_configs=[trace_config]
+            )
+        openai.aiosession.set(client.session)
+
+    def _evict_idle(self, now: float) -> None:
+        while self._clients:
+            key, client = next(iter(self._clients.items()))
+            if now - client.last_used < self.idle_timeout:
+                break
+            del self._clients[key]
+            self._close(client)
+
+    @staticmethod
+    def _close(client: _PooledClient) -> None:
+        if client.session is not None and not client.session.closed:
+            with contextlib.suppress(RuntimeError):
+                task = asyncio.get_running_loop().create_task(client.session.close())
+                _closing.add(task)
+                task.add_done_callback(_on_closed)
+
+
+llm_pool = LLMClientPool()
@@ -0,0 +1,148 @@
+"""A compact representation of the finished messages of a conversation.
+
+The messages that a session keeps loaded are stored as tuples instead of `Message` and
+`MessagePart` models: every pydantic model carries a `__dict__` and a set of its set fields,
+and every id is a 36 character string. In a `MessageHistory`:
+
+- a message is a tuple `(id, own, parts, n_tokens)` and a part a tuple `(id, type, text, extra_output, extra_output1)`,
+- ids are stored as the integers of their UUIDs, ids that aren't UUIDs are kept as they are,
+- part types are the members of `MessagePartType`, so they aren't a new string for every part loaded from the store.
+
+Messages are only converted to `Message` models when they're read, i.e. for the UI and the LLM.
+A history is a sequence of messages, and slicing it returns a history that shares the records.
+"""
+
+import uuid
+from typing import Iterable, Iterator, Optional, Sequence, overload
+
+from reflex_gptp.models import UUID, Message, MessagePart
+from reflex_gptp.utils import MessagePartType
+
+PackedId = int | str
+PartRecord = tuple[PackedId, MessagePartType, str, Optional[str], Optional[str]]
+MessageRecord = tuple[PackedId, bool, tuple[PartRecord, ...], Optional[int]]
+
+
+def pack_id(id_: UUID) -> PackedId:
+    """The integer of a UUID, or the id itself if it isn't a UUID in canonical form."""
+    try:
+        packed = uuid.UUID(id_)
+    except ValueError:
+        return id_
+    # Ids must survive the round trip, e.g. ids in upper case are kept as they are
+    return packed.int if str(packed) == id_ else id_
+
+
+def unpack_id(packed: PackedId) -> UUID:
+    """The id that was packed by `pack_id()`."""
+    return str(uuid.UUID(int=packed)) if isinstance(packed, int) else packed
+
+
+def _pack_part(part: MessagePart) -> PartRecord:
+    return (pack_id(part.id), MessagePartType(part.type), part.text, part.extra_output, part.extra_output1)
+
+
+def _pack(message: Message) -> MessageRecord:
+    return (pack_id(message.id), message.own, tuple(_pack_part(p) for p in message.parts), message.n_tokens)
+
+
+def _unpack(record: MessageRecord) -> Message:
+    m_id, own, parts, n_tokens = record
+    return Message(
+        id=unpack_id(m_id),
+        parts=[
+            MessagePart(id=unpack_id(p_id), type=p_type, text=text, extra_output=extra, extra_output1=extra1)
+            for p_id, p_type, text, extra, extra1 in parts
+        ],
+        own=own,
+        n_tokens=n_tokens,
+    )
+
+
+class MessageHistory(Sequence[Message]):
+    """The finished messages of a conversation, from old to new."""
+
+    __slots__ = ("_records",)
+
+    def __init__(self, messages: Iterable[Message] = ()) -> None:
+        self._records: list[MessageRecord] = [_pack(m) for m in messages]
+
+    @classmethod
+    def from_parts(
+        cls, rows: Iterable[tuple[UUID, bool, UUID, str, str, Optional[str], Optional[str]]]
+    ) -> "MessageHistory":
+        """Build a history from the parts of its messages, in order.
+
+        Args:
+            rows: `(message_id, own, part_id, type, text, extra_output, extra_output1)` for every part,
+                like the rows of the conversation store.
+        """
+        history = cls()
+        records = history._records
+        m_id: UUID | None = None
+        parts: list[PartRecord] = []
+        own = False
+        for row_m_id, row_own, p_id, p_type, text, extra, extra1 in rows:
+            if row_m_id != m_id:
+                if m_id is not None:
+                    records.append((pack_id(m_id), own, tuple(parts), None))
+                m_id, own, parts = row_m_id, bool(row_own), []
+            parts.append((pack_id(p_id), MessagePartType(p_type), text, extra, extra1))
+        if m_id is not None:
+            records.append((pack_id(m_id), own, tuple(parts), None))
+        return history
+
+    @classmethod
+    def _from_records(cls, records: list[MessageRecord]) -> "MessageHistory":
+        history = cls()
+        history._records = records
+        return history
+
+    def __len__(self) -> int:
+        """The number of messages."""
+        return len(self._records)
+
+    @overload
+    def __getitem__(self, index: int) -> Message:
+        ...
+
+    @overload
+    def __getitem__(self, index: slice) -> "MessageHistory":
+        ...
+
+    def __getitem__(self, index: int | slice) -> "Message | MessageHistory":
+        """A message as a model, or a slice of the history that shares its records."""
+        if isinstance(index, slice):
+            return self._from_records(self._records[index])
+        return _unpack(self._records[index])
+
+    def __iter__(self) -> Iterator[Message]:
+        """Iterate over the messages as models, from old to new."""
+        return map(_unpack, self._records)
+
+    def __repr__(self) -> str:
+        """The number of messages, without converting them."""
+        return f"MessageHistory({len(self)} messages)"
+
+    def message_id(self, index: int) -> UUID:
+        """The id of a message, without converting the message."""
+        return unpack_id(self._records[index][0])
+
+    def find(self, message_id: UUID) -> int:
+        """The index of the message with an id, or -1 if it isn't in the history."""
+        packed = pack_id(message_id)
+        for i in range(len(self._records) - 1, -1, -1):
+            if self._records[i][0] == packed:
+                return i
+        return -1
+
+    def append(self, message: Message) -> None:
+        """Append a finished message."""
+        self._records.append(_pack(message))
+
+    def prepend(self, messages: "Iterable[Message]") -> None:
+        """Insert older messages before the first one, in their order."""
+        if isinstance(messages, MessageHistory):
+            self._records[:0] = messages._records
+        else:
+            self._records[:0] = [_pack(m) for m in messages]
@@ -0,0 +1,155 @@
+"""Metrics for monitoring the app, exposed in the Prometheus text format.
+
+Metrics are only updated from the event loop, so they are plain numbers without locks.
+Metrics with labels have a child per combination of label values, see `labels()`.
+"""
+
+import bisect
+import math
+from abc import ABC, abstractmethod
+from typing import Any
+
+# Upper bounds of the buckets of histograms of durations, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class _Metric(ABC):
+    type_ = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (), **kwargs: Any) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._kwargs = kwargs
+        self._children: dict[tuple[str, ...], Any] = {}
+        if name:
+            registry.append(self)
+
+    def labels(self, *values: str, **labels: str) -> Any:
+        """The child of a metric with labels, for the given label values."""
+        key = tuple(values) if values else tuple(str(labels[n]) for n in self.labelnames)
+        if len(key) != len(self.labelnames):
+            raise ValueError(f"Expected values for the labels {self.labelnames}")
+        child = self._children.get(key)
+        if child is None:
+            # Children are not registered, they are rendered by their parent
+            child = self._children[key] = type(self)("", self.documentation, **self._kwargs)
+        return child
+
+    @abstractmethod
+    def _samples(self) -> list[tuple[str, dict[str, str], float]]:
+        """The samples of the metric as `(name suffix, labels, value)`."""
+
+    def render(self) -> str:
+        """The metric in the Prometheus text format."""
+        lines = [f"# HELP {self.name} {_escape(self.documentation)}", f"# TYPE {self.name} {self.type_}"]
+        children = self._children.items() if self.labelnames else [((), self)]
+        for values, child in children:
+            labels = dict(zip(self.labelnames, values, strict=True))
+            for suffix, extra, value in child._samples():
+                lines.append(f"{self.name}{suffix}{_format_labels({**labels, **extra})} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """A value that only goes up, like the number of requests."""
+
+    type_ = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        """Increase the counter."""
+        self.value += amount
+
+    def _samples(self) -> list[tuple[str, dict[str, str], float]]:
+        return [("", {}, self.value)]
+
+
+class Gauge(_Metric):
+    """A value that goes up and down, like the number of running requests."""
+
+    type_ = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.value = 0.0
+
+    def set(self, value: float) -> None:  # noqa: A003
+        """Set the value."""
+        self.value = value
+
+    def inc(self, amount: float = 1) -> None:
+        """Increase the value."""
+        self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        """Decrease the value."""
+        self.value -= amount
+
+    def _samples(self) -> list[tuple[str, dict[str, str], float]]:
+        return [("", {}, self.value)]
+
+
+class Histogram(_Metric):
+    """The distribution of observed values, like durations, in cumulative buckets."""
+
+    type_ = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames, buckets=buckets)
+        self.buckets = tuple(sorted(buckets))
+        # Number of observations in each bucket, the last one is for values above all bounds
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """Add an observation."""
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def _samples(self) -> list[tuple[str, dict[str, str], float]]:
+        samples = []
+        cumulative = 0
+        for bound, count in zip((*self.buckets, math.inf), self.bucket_counts, strict=True):
+            cumulative += count
+            samples.append(("_bucket", {"le": _format_value(bound)}, cumulative))
+        samples.append(("_sum", {}, self.sum))
+        samples.append(("_count", {}, self.count))
+        return samples
+
+
+registry: list[_Metric] = []
+
+
+def render() -> str:
+    """All metrics in the Prometheus text format."""
+    return "\n".join(metric.render() for metric in registry) + "\n"
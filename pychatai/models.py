@@ -0,0 +1,79 @@
+"""Data models for conversations and prompts."""
+
+import uuid
+from typing import Optional
+
+import reflex as rx
+
+from reflex_gptp.utils import MessagePartType
+
+UUID = str
+
+
+def make_uuid() -> UUID:
+    """Generate a UUID.
+
+    Returns:
+        UUID: A random UUID.
+    """
+    return str(uuid.uuid4())
+
+
+class MessagePart(rx.Base):
+    """A message part."""
+
+    id: UUID  # noqa: A003
+    type: MessagePartType  # noqa: A003
+    text: str
+    extra_output: Optional[str] = None
+    extra_output1: Optional[str] = None
+
+
+class Message(rx.Base):
+    """A message."""
+
+    id: UUID  # noqa: A003
+    parts: list[MessagePart]
+    own: bool
+    is_loading: bool = False
+    # Position in the queue of the scheduler and time waited, while the response waits to start
+    queue_status: str = ""
+    # Number of tokens of the finished message, counted once and kept when it's packed in a history
+    n_tokens: Optional[int] = None
+
+    def append_text(self, text: str) -> None:
+        """Append streamed text to the last text part, or start a new text part."""
+        if self.parts and self.parts[-1].type == MessagePartType.TEXT:
+            self.parts[-1].text += text
+        else:
+            self.parts.append(MessagePart(id=make_uuid(), type=MessagePartType.TEXT, text=text))
+
+
+class Convo(rx.Base):
+    """A conversation."""
+
+    name: str
+    # The loaded messages of a session are kept in `ConvoState._histories`, this is only
+    # set on conversations that older versions pickled into local storage
+    messages: list[Message] = []
+    # Whether the store has messages older than the loaded ones
+    has_older: bool = False
+    created_at: float = 0.0
+    updated_at: float = 0.0
+
+
+class SearchResult(rx.Base):
+    """A message that matches a search."""
+
+    convo_id: UUID
+    convo_name: str
+    message_id: UUID
+    # The matching part of the text, with the matching words in bold
+    snippet: str
+
+
+class Prompt(rx.Base):
+    """A prompt."""
+
+    title: str
+    text: str
@@ -0,0 +1,90 @@
+"""The library of prompts, searched on the server so clients only receive a page of results.
+
+The prompts are read from a CSV file with a title and a text per row, the first time they are
+searched. Searches match prompts that have words starting with every word of the query, so
+prompts can be found while the query is typed.
+"""
+
+import bisect
+import csv
+import os
+import re
+
+from reflex_gptp.models import Prompt
+
+PROMPTS_PATH = os.getenv("PROMPTS_PATH", "prompts.csv")
+# Number of prompts in a page of search results
+PROMPT_PAGE_SIZE = int(os.getenv("PROMPT_PAGE_SIZE", "20"))
+
+
+def _words(text: str) -> set[str]:
+    return set(re.findall(r"\w+", text.casefold()))
+
+
+class PromptIndex:
+    """An inverted index of prompts for prefix search."""
+
+    def __init__(self, prompts: list[Prompt]) -> None:
+        self.prompts = prompts
+        self._postings: dict[str, set[int]] = {}
+        # Prompts whose title matches a word are ranked before prompts that only match in their text
+        self._in_title: dict[str, set[int]] = {}
+        for i, prompt in enumerate(prompts):
+            for word in _words(prompt.title):
+                self._in_title.setdefault(word, set()).add(i)
+            for word in _words(prompt.title) | _words(prompt.text):
+                self._postings.setdefault(word, set()).add(i)
+        self._vocabulary = sorted(self._postings)
+
+    @classmethod
+    def from_csv(cls, path: str) -> "PromptIndex":
+        """Read the prompts from a CSV file with a header row."""
+        with open(path, encoding="utf-8") as f:
+            reader = csv.reader(f)
+            next(reader)
+            return cls([Prompt(title=row[0], text=row[1]) for row in reader])
+
+    def _matching(self, prefix: str) -> tuple[set[int], set[int]]:
+        """The prompts with a word that starts with a prefix, and those among them with such a word in their title."""
+        matches: set[int] = set()
+        in_title: set[int] = set()
+        start = bisect.bisect_left(self._vocabulary, prefix)
+        for word in self._vocabulary[start:]:
+            if not word.startswith(prefix):
+                break
+            matches |= self._postings[word]
+            in_title |= self._in_title.get(word, set())
+        return matches, in_title
+
+    def search(self, query: str, offset: int = 0, limit: int = PROMPT_PAGE_SIZE) -> tuple[list[Prompt], int]:
+        """Search prompts that match every word of a query.
+
+        Returns:
+            A page of the prompts that match, and the number of prompts that match.
+        """
+        words = _words(query)
+        if not words:
+            return self.prompts[offset : offset + limit], len(self.prompts)
+        matches: set[int] | None = None
+        title_matches: set[int] = set()
+        for word in words:
+            word_matches, in_title = self._matching(word)
+            matches = word_matches if matches is None else matches & word_matches
+            title_matches |= in_title
+        ranked = sorted(matches or (), key=lambda i: (i not in title_matches, i))
+        return [self.prompts[i] for i in ranked[offset : offset + limit]], len(ranked)
+
+
+_index: PromptIndex | None = None
+
+
+def get_prompt_index() -> PromptIndex:
+    """Get the prompt index of this process, which is built when it's first used."""
+    global _index
+    if _index is None:
+        try:
+            _index = PromptIndex.from_csv(PROMPTS_PATH)
+        except FileNotFoundError:
+            print(f"Prompts file {PROMPTS_PATH} not found, the prompt library is empty.")
+            _index = PromptIndex([])
+    return _index
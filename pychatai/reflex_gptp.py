@@ -1,13 +1,20 @@
 """The main app file for the app."""
 
+from typing import Literal
+
 import reflex as rx
+from fastapi import Response
+from fastapi.responses import StreamingResponse
 
 from reflex_gptp import styles
+from reflex_gptp.backup import export_archive, export_filenames
 from reflex_gptp.components.chat import chat_messages
 from reflex_gptp.components.input import input_bar
 from reflex_gptp.components.nav import navbar
 from reflex_gptp.components.side import sidebar, sidebar_wrapper
-from reflex_gptp.state import State
+from reflex_gptp.metrics import CONTENT_TYPE, render
+from reflex_gptp.state import ConvoState, UIState
+from reflex_gptp.store import get_store
 from rxconfig import config
 
 docs_url = "https://reflex.dev/docs/getting-started/introduction"
@@ -31,7 +38,7 @@ def index() -> rx.Component:
                 flex_direction="column",
                 align_items="stretch",
             ),
-            pl=rx.cond(State.drawer_open, [0, 80, 80, 80, 80], "0"),
+            pl=rx.cond(UIState.drawer_open, [0, 80, 80, 80, 80], "0"),
             transition="all 0.2s ease-in-out",
             min_h="100svh",
             align_items="stretch",
@@ -43,10 +50,33 @@ def index() -> rx.Component:
 # Add state and page to the app.
 app = rx.App(
     style=styles.base_style,
-    load_events={"index": [State.load_data]},
+    load_events={"index": [ConvoState.load_data]},
     stylesheets=[
         "styles.css",  # This path is relative to assets/
     ],
 )
 app.add_page(index, title="PyChatAI")
+
+
+async def metrics() -> Response:
+    """The metrics of the backend, in the Prometheus text format."""
+    return Response(render(), media_type=CONTENT_TYPE)
+
+
+app.api.add_api_route("/metrics", metrics)
+
+
+async def export(client_id: str, compression: Literal["gzip", "none"] = "gzip") -> StreamingResponse:
+    """The conversations of a client as an archive, streamed from the conversation store.
+
+    Like the state of a session, the conversations are only protected by the client id.
+    """
+    return StreamingResponse(
+        export_archive(get_store(), client_id, compression),
+        media_type="application/gzip" if compression == "gzip" else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{export_filenames[compression]}"'},
+    )
+
+
+app.api.add_api_route("/export", export)
 app.compile()
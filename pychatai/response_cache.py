@@ -0,0 +1,116 @@
+"""An opt-in cache of LLM responses, for questions that are asked again with the same history.
+
+The cache is stored in SQLite, so it survives restarts. Entries expire after a time to live,
+and the least recently used entries are dropped when the cache is full.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any
+
+from langchain.schema import BaseMessage
+
+from reflex_gptp.metrics import Counter
+from reflex_gptp.utils import OutputType
+
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "false").lower() == "true"
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "pychatai_cache.db")
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "86400"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "10000"))
+
+response_cache_hits = Counter("pychatai_response_cache_hits_total", "Questions answered from the response cache.")
+response_cache_misses = Counter("pychatai_response_cache_misses_total", "Questions not found in the response cache.")
+
+
+def response_cache_key(
+    provider: str, model: str, temperature: float, system_prompt: str, history: list[BaseMessage], question: str
+) -> str:
+    """The key of a response in the cache."""
+    data = [provider, model, temperature, system_prompt, [[m.type, m.content] for m in history], question]
+    return hashlib.sha256(json.dumps(data).encode()).hexdigest()
+
+
+class ResponseCache:
+    """A response cache with least-recently-used and time-to-live eviction, stored in SQLite."""
+
+    def __init__(
+        self,
+        path: str = RESPONSE_CACHE_PATH,
+        ttl: float = RESPONSE_CACHE_TTL,
+        max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+    ) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses "
+            "(key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)")
+        self._conn.commit()
+
+    def get(self, key: str) -> str | None:
+        """Get a response, if it's in the cache and has not expired."""
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+            if row is not None:
+                self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        if row is None:
+            response_cache_misses.inc()
+            return None
+        response_cache_hits.inc()
+        return row[0]
+
+    def put(self, key: str, response: str) -> None:
+        """Add a response to the cache, dropping expired and least recently used responses."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, response, now, now),
+            )
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN "
+                "(SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def stats(self) -> dict[str, float]:
+        """The number of hits and misses of the cache."""
+        return {"hits": response_cache_hits.value, "misses": response_cache_misses.value}
+
+
+async def replay_response(response: str, queue: asyncio.Queue) -> dict[str, Any]:
+    """Stream a cached response to the queue of a callback handler, like an LLM chain would.
+
+    Returns:
+        The output of the chain that generated the response.
+    """
+    for token in re.findall(r"\s*\S+", response):
+        queue.put_nowait((OutputType.TOKEN, token, None))
+        await asyncio.sleep(0)
+    return {"text": response}
+
+
+_cache: ResponseCache | None = None
+
+
+def get_response_cache() -> ResponseCache | None:
+    """Get the response cache, if it's enabled with the `RESPONSE_CACHE` environment variable."""
+    global _cache
+    if RESPONSE_CACHE and _cache is None:
+        _cache = ResponseCache()
+    return _cache
@@ -0,0 +1,205 @@
+"""Running the code of the Python plugin in a pool of sandboxed worker processes.
+
+The code that an agent writes runs in a separate process with limits on CPU time and memory,
+so a heavy or runaway computation can't stall or take down the web server. Every run of the
+tool gets its own worker, which keeps its variables between the calls of that run and is killed
+when the run ends, the code times out or the run is cancelled (e.g. when the user interrupts the
+chat). Workers are started ahead of time, so a run doesn't wait for Python to start.
+"""
+
+import asyncio
+import json
+import os
+import sys
+from typing import Any
+
+from langchain.callbacks.manager import AsyncCallbackManagerForToolRun, CallbackManagerForToolRun
+from langchain_experimental.tools.python.tool import PythonREPLTool, sanitize_input
+
+SANDBOX_POOL_SIZE = int(os.getenv("SANDBOX_POOL_SIZE", "2"))
+# Wall-clock time that a single call may take, in seconds
+SANDBOX_TIMEOUT = float(os.getenv("SANDBOX_TIMEOUT", "30"))
+# CPU time that a worker may use over all calls of a run, in seconds
+SANDBOX_CPU_SECONDS = int(os.getenv("SANDBOX_CPU_SECONDS", "60"))
+SANDBOX_MEMORY_MB = int(os.getenv("SANDBOX_MEMORY_MB", "512"))
+
+_WORKER_SCRIPT = os.path.join(os.path.dirname(__file__), "sandbox_worker.py")
+# Responses are single lines, that can be as long as the output of the code
+_LINE_LIMIT = 2**24
+
+
+class SandboxError(Exception):
+    """The worker process could not run the code."""
+
+
+class SandboxWorker:
+    """A worker process with its own Python namespace."""
+
+    def __init__(self, process: asyncio.subprocess.Process) -> None:
+        self.process = process
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    async def start(cls) -> "SandboxWorker":
+        """Start a worker process and wait until it's ready."""
+        # The environment of the server, with its API keys, is not passed on to the code
+        env = {
+            "PATH": os.environ.get("PATH", ""),
+            "SANDBOX_CPU_SECONDS": str(SANDBOX_CPU_SECONDS),
+            "SANDBOX_MEMORY_MB": str(SANDBOX_MEMORY_MB),
+        }
+        process = await asyncio.create_subprocess_exec(
+            sys.executable,
+            "-I",
+            _WORKER_SCRIPT,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            env=env,
+            limit=_LINE_LIMIT,
+        )
+        worker = cls(process)
+        try:
+            await worker._read()
+        except BaseException:
+            worker.kill()
+            raise
+        return worker
+
+    @property
+    def alive(self) -> bool:
+        """Whether the process of the worker is still running."""
+        return self.process.returncode is None
+
+    async def _read(self) -> dict[str, Any]:
+        line = await self.process.stdout.readline()  # type: ignore
+        if not line:
+            await self.process.wait()
+            raise SandboxError(f"The Python process exited with code {self.process.returncode}.")
+        return json.loads(line)
+
+    async def run(self, code: str, timeout: float = SANDBOX_TIMEOUT) -> str:
+        """Run code in the namespace of the worker and return what it printed.
+
+        The worker is killed if the code doesn't finish in time or if this is cancelled.
+
+        Raises:
+            SandboxError: If the code timed out or the worker exited, e.g. because it exceeded its limits.
+        """
+        async with self._lock:
+            if not self.alive:
+                raise SandboxError("The Python process is no longer running.")
+            try:
+                self.process.stdin.write((json.dumps({"code": code}) + "\n").encode())  # type: ignore
+                await self.process.stdin.drain()  # type: ignore
+                return (await asyncio.wait_for(self._read(), timeout))["output"]
+            except asyncio.TimeoutError:
+                self.kill()
+                raise SandboxError(f"The code did not finish within {timeout:g} seconds.") from None
+            except BaseException:
+                self.kill()
+                raise
+
+    def kill(self) -> None:
+        """Kill the worker process, it does not wait for the process to exit."""
+        if self.alive:
+            self.process.kill()
+
+
+class SandboxPool:
+    """A pool of worker processes that are started ahead of time."""
+
+    def __init__(self, size: int = SANDBOX_POOL_SIZE) -> None:
+        self.size = size
+        self._idle: list[SandboxWorker] = []
+        self._starting = 0
+
+    async def acquire(self) -> SandboxWorker:
+        """Take a worker from the pool, or start one if there is none, and refill the pool in the background."""
+        while self._idle:
+            worker = self._idle.pop()
+            if worker.alive:
+                break
+        else:
+            worker = await SandboxWorker.start()
+        self._refill()
+        return worker
+
+    def release(self, worker: SandboxWorker) -> None:
+        """Give back a worker, which is killed because its namespace is only for one run."""
+        worker.kill()
+        self._refill()
+
+    def _refill(self) -> None:
+        for _ in range(self.size - len(self._idle) - self._starting):
+            self._starting += 1
+            asyncio.get_running_loop().create_task(self._start_idle())
+
+    async def _start_idle(self) -> None:
+        try:
+            self._idle.append(await SandboxWorker.start())
+        except Exception as e:  # noqa: BLE001
+            print(f"Could not start a sandbox worker: {type(e)}: {e}")
+        finally:
+            self._starting -= 1
+
+    def close(self) -> None:
+        """Kill all idle workers."""
+        while self._idle:
+            self._idle.pop().kill()
+
+
+sandbox_pool = SandboxPool()
+
+
+async def _run_in_new_worker(code: str) -> str:
+    worker = await SandboxWorker.start()
+    try:
+        return await worker.run(code)
+    finally:
+        worker.kill()
+        # The process must exit before the event loop of the call is closed
+        await worker.process.wait()
+
+
+class SandboxedPythonTool(PythonREPLTool):
+    """The Python REPL tool, running the code in a sandboxed worker process.
+
+    Variables are kept between the calls of one tool, until `close()` is called.
+    """
+
+    worker: SandboxWorker | None = None
+
+    class Config:
+        """Allows the worker, which isn't a pydantic model, as a field."""
+
+        arbitrary_types_allowed = True
+
+    def _run(self, query: str, run_manager: CallbackManagerForToolRun | None = None) -> str:
+        """Run the code for an agent that runs synchronously.
+
+        The workers of the pool belong to the event loop of the server, so the code runs in a worker
+        of its own on an event loop of this call, and variables aren't kept between synchronous calls.
+        """
+        if self.sanitize_input:
+            query = sanitize_input(query)
+        try:
+            return asyncio.run(_run_in_new_worker(query))
+        except SandboxError as e:
+            return f"Error: {e}"
+
+    async def _arun(self, query: str, run_manager: AsyncCallbackManagerForToolRun | None = None) -> str:
+        if self.sanitize_input:
+            query = sanitize_input(query)
+        if self.worker is None or not self.worker.alive:
+            self.worker = await sandbox_pool.acquire()
+        try:
+            return await self.worker.run(query)
+        except SandboxError as e:
+            return f"Error: {e}"
+
+    def close(self) -> None:
+        """Kill the worker of the tool, if it has one."""
+        if self.worker is not None:
+            sandbox_pool.release(self.worker)
+            self.worker = None
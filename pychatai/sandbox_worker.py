@@ -0,0 +1,61 @@
+"""A worker process that runs Python code for the sandbox, see `sandbox.py`.
+
+The worker reads requests from stdin and writes responses to stdout, one JSON object per line.
+It's started as a script, so it doesn't import the app.
+"""
+
+import ast
+import contextlib
+import io
+import json
+import os
+import sys
+
+
+def _limit_resources() -> None:
+    import resource
+
+    cpu_seconds = int(os.environ.get("SANDBOX_CPU_SECONDS", "0"))
+    if cpu_seconds > 0:
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 1))
+    memory_mb = int(os.environ.get("SANDBOX_MEMORY_MB", "0"))
+    if memory_mb > 0:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_mb * 1024 * 1024,) * 2)
+
+
+def _run(code: str, namespace: dict) -> str:
+    """Run code like a REPL: the value of a trailing expression is printed."""
+    stdout = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stdout):
+            tree = ast.parse(code)
+            last = tree.body.pop() if tree.body and isinstance(tree.body[-1], ast.Expr) else None
+            exec(compile(tree, "<sandbox>", "exec"), namespace)  # noqa: S102
+            if last is not None:
+                value = eval(compile(ast.Expression(last.value), "<sandbox>", "eval"), namespace)  # noqa: S307
+                if value is not None:
+                    print(repr(value))
+    except Exception as e:  # noqa: BLE001
+        stdout.write(f"{type(e).__name__}: {e}")
+    return stdout.getvalue()
+
+
+def main() -> None:
+    """Serve requests until stdin is closed."""
+    # The protocol gets its own copies of stdin and stdout, so code that uses them can't corrupt it
+    requests = os.fdopen(os.dup(sys.stdin.fileno()), "r")
+    protocol = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+    os.dup2(os.open(os.devnull, os.O_RDONLY), sys.stdin.fileno())
+    os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    _limit_resources()
+    namespace: dict = {"__name__": "__main__"}
+    protocol.write(json.dumps({"ready": True}) + "\n")
+    protocol.flush()
+    for line in requests:
+        output = _run(json.loads(line)["code"], namespace)
+        protocol.write(json.dumps({"output": output}) + "\n")
+        protocol.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""Admission control for the streams of LLM responses.
+
+Every response takes a slot of its provider and of its API key while it runs, so a burst of
+users doesn't exceed the rate limits of providers and slow down every stream at once. Responses
+that don't get a slot wait in a fair queue: sessions take turns, so one session with many
+requests doesn't hold up the others. Agent runs, which can take long, may only use a share of
+the slots, so plain chats don't starve behind them.
+"""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Coroutine, TypeVar
+
+from reflex_gptp.llm_pool import hash_api_key
+from reflex_gptp.metrics import Counter, Gauge, Histogram
+
+SCHEDULER_MAX_PER_PROVIDER = int(os.getenv("SCHEDULER_MAX_PER_PROVIDER", "32"))
+SCHEDULER_MAX_PER_KEY = int(os.getenv("SCHEDULER_MAX_PER_KEY", "8"))
+# Share of the slots of a provider or API key that agent runs may take
+SCHEDULER_AGENT_SHARE = float(os.getenv("SCHEDULER_AGENT_SHARE", "0.5"))
+# Requests beyond this many waiting ones are rejected
+SCHEDULER_MAX_QUEUE = int(os.getenv("SCHEDULER_MAX_QUEUE", "256"))
+# Seconds between updates of the queue status of a waiting request
+SCHEDULER_STATUS_INTERVAL = float(os.getenv("SCHEDULER_STATUS_INTERVAL", "1"))
+
+scheduler_active = Gauge("pychatai_scheduler_active", "Responses that are running.")
+scheduler_queued = Gauge("pychatai_scheduler_queued", "Responses that are waiting for a slot.")
+scheduler_rejected = Counter("pychatai_scheduler_rejected_total", "Responses rejected because the queue was full.")
+scheduler_wait = Histogram("pychatai_scheduler_wait_seconds", "Time that responses waited for a slot.", ("provider",))
+
+T = TypeVar("T")
+
+
+class QueueFullError(Exception):
+    """Too many requests are waiting already."""
+
+
+class _Ticket:
+    def __init__(self, provider: str, key: str, session: str, agent: bool) -> None:
+        self.provider = provider
+        self.key = key
+        self.session = session
+        self.agent = agent
+        self.admitted = asyncio.get_running_loop().create_future()
+        self.queued_at = time.monotonic()
+
+
+class Scheduler:
+    """Admits requests when their provider and API key have a free slot, in a fair order across sessions."""
+
+    def __init__(
+        self,
+        max_per_provider: int = SCHEDULER_MAX_PER_PROVIDER,
+        max_per_key: int = SCHEDULER_MAX_PER_KEY,
+        agent_share: float = SCHEDULER_AGENT_SHARE,
+        max_queue: int = SCHEDULER_MAX_QUEUE,
+    ) -> None:
+        self.max_per_provider = max_per_provider
+        self.max_per_key = max_per_key
+        self.agent_share = agent_share
+        self.max_queue = max_queue
+        # Running requests per provider and per API key, and the agent runs among them
+        self._active: dict[tuple[str, str], int] = {}
+        self._active_agents: dict[tuple[str, str], int] = {}
+        # Waiting requests per session, sessions are admitted in turns in this order
+        self._queues: OrderedDict[str, deque[_Ticket]] = OrderedDict()
+        self._n_queued = 0
+
+    def _limits(self, ticket: _Ticket) -> list[tuple[tuple[str, str], int]]:
+        return [(("provider", ticket.provider), self.max_per_provider), (("key", ticket.key), self.max_per_key)]
+
+    def _can_admit(self, ticket: _Ticket) -> bool:
+        for slot, limit in self._limits(ticket):
+            if self._active.get(slot, 0) >= limit:
+                return False
+            if ticket.agent and self._active_agents.get(slot, 0) >= max(1, int(limit * self.agent_share)):
+                return False
+        return True
+
+    def _admit(self, ticket: _Ticket) -> None:
+        for slot, _ in self._limits(ticket):
+            self._active[slot] = self._active.get(slot, 0) + 1
+            if ticket.agent:
+                self._active_agents[slot] = self._active_agents.get(slot, 0) + 1
+        scheduler_active.inc()
+        scheduler_wait.labels(ticket.provider).observe(time.monotonic() - ticket.queued_at)
+        ticket.admitted.set_result(None)
+
+    def _release(self, ticket: _Ticket) -> None:
+        for slot, _ in self._limits(ticket):
+            self._active[slot] -= 1
+            if ticket.agent:
+                self._active_agents[slot] -= 1
+        scheduler_active.dec()
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Admit the first waiting request of each session in turn, as long as any can be admitted."""
+        admitted = True
+        while admitted:
+            admitted = False
+            for session in list(self._queues):
+                queue = self._queues[session]
+                if not self._can_admit(queue[0]):
+                    continue
+                self._admit(queue.popleft())
+                self._n_queued -= 1
+                scheduler_queued.dec()
+                del self._queues[session]
+                # The session goes to the back of the line
+                if queue:
+                    self._queues[session] = queue
+                admitted = True
+
+    def _dequeue(self, ticket: _Ticket) -> None:
+        queue = self._queues.get(ticket.session)
+        if queue is not None and ticket in queue:
+            queue.remove(ticket)
+            self._n_queued -= 1
+            scheduler_queued.dec()
+            if not queue:
+                del self._queues[ticket.session]
+
+    def position(self, ticket: _Ticket) -> int:
+        """The approximate position of a waiting request in the queue, starting at 1."""
+        index = self._queues[ticket.session].index(ticket)
+        return sum(min(len(queue), index + 1) for queue in self._queues.values())
+
+    async def run(
+        self,
+        coro: Coroutine[Any, Any, T],
+        provider: str,
+        api_key: str,
+        session: str,
+        agent: bool = False,
+        on_wait: Callable[[int, float], None] | None = None,
+    ) -> T:
+        """Run a coroutine that streams a response, once it's admitted.
+
+        Args:
+            coro: The coroutine.
+            provider: The provider of the LLM.
+            api_key: The API key that is used.
+            session: The session that makes the request.
+            agent: Whether the request is an agent run.
+            on_wait: Called with the position in the queue and the seconds waited so far, while the request waits.
+
+        Raises:
+            QueueFullError: If too many requests are waiting already.
+        """
+        if self._n_queued >= self.max_queue:
+            coro.close()
+            scheduler_rejected.inc()
+            raise QueueFullError("Too many requests are waiting, please try again later.")
+        ticket = _Ticket(provider, hash_api_key(api_key), session, agent)
+        self._queues.setdefault(session, deque()).append(ticket)
+        self._n_queued += 1
+        scheduler_queued.inc()
+        self._dispatch()
+        try:
+            while not ticket.admitted.done():
+                if on_wait is not None:
+                    on_wait(self.position(ticket), time.monotonic() - ticket.queued_at)
+                await asyncio.wait([ticket.admitted], timeout=SCHEDULER_STATUS_INTERVAL)
+        except BaseException:
+            coro.close()
+            if ticket.admitted.done():
+                self._release(ticket)
+            else:
+                self._dequeue(ticket)
+            raise
+        try:
+            return await coro
+        finally:
+            self._release(ticket)
+
+
+scheduler = Scheduler()
@@ -1,87 +1,54 @@
 """Code containing the state of the app."""
 
 import asyncio
-import csv
+import contextlib
 import gettext
 import os
 import pickle
-import uuid
-from typing import Any, Coroutine, Optional
+import time
+from typing import Any, Coroutine, Optional, TypeVar
+from urllib.parse import urlencode
 
+import cloudpickle
 import reflex as rx
 from dotenv import load_dotenv
-from langchain.agents import AgentType, initialize_agent
-from langchain.callbacks.manager import AsyncCallbackManager
-from langchain.chains import LLMChain
-from langchain.chat_models import ChatAnthropic, ChatOpenAI
+# `rx.UploadFile` is the same class, but getting it from reflex imports the app and all components
+from fastapi import UploadFile
 from langchain.memory import ChatMessageHistory, ConversationBufferMemory
-from langchain.prompts import (
-    ChatPromptTemplate,
-    HumanMessagePromptTemplate,
-    MessagesPlaceholder,
-    SystemMessagePromptTemplate,
-)
-from langchain.schema import AIMessage, HumanMessage
-
-from reflex_gptp.async_callback import CustomAsyncIteratorCallbackHandler
+from langchain.schema.runnable import RunnableConfig
+from reflex.config import get_config
+
+from reflex_gptp.archive import ArchiveError, local_storage_records
+from reflex_gptp.async_callback import TERMINAL_OUTPUT_TYPES, CustomAsyncIteratorCallbackHandler
+from reflex_gptp.backup import export_filenames, import_archive, import_records, read_chunks
+from reflex_gptp.chains import SYSTEM_PROMPT, get_chain, release_chain
+from reflex_gptp.computed_vars import cached_var
+from reflex_gptp.history import ContextWindow, count_tokens, message_tokens, update_context_window
+from reflex_gptp.instrumentation import RequestMetrics, sample_state_size, session_state_size
+from reflex_gptp.llm_pool import TEMPERATURE, close_responses, track_responses
+from reflex_gptp.message_history import MessageHistory
+from reflex_gptp.metrics import Histogram
+from reflex_gptp.models import UUID, Convo, Message, MessagePart, Prompt, SearchResult, make_uuid
+from reflex_gptp.prompts import PROMPT_PAGE_SIZE, get_prompt_index
+from reflex_gptp.response_cache import get_response_cache, replay_response, response_cache_key
+from reflex_gptp.scheduler import QueueFullError, scheduler
+from reflex_gptp.store import get_store
+from reflex_gptp.streaming import TokenBuffer
 from reflex_gptp.utils import MessagePartType, OutputType, plugin_tool, providers_models
 
 load_dotenv()
 
 USE_ENV_API_KEYS = os.getenv("USE_ENV_API_KEYS", "false").lower() == "true"
-
-UUID = str
-
-
-def make_uuid() -> UUID:
-    """Generate a UUID.
-
-    Returns:
-        UUID: A random UUID.
-    """
-    return str(uuid.uuid4())
-
-
-class MessagePart(rx.Base):
-    """A message part."""
-
-    id: UUID  # noqa: A003
-    type: MessagePartType  # noqa: A003
-    text: str
-    extra_output: Optional[str] = None
-    extra_output1: Optional[str] = None
-
-
-class Message(rx.Base):
-    """A message."""
-
-    id: UUID  # noqa: A003
-    parts: list[MessagePart]
-    own: bool
-    is_loading: bool = False
-
-
-class Convo(rx.Base):
-    """A conversation."""
-
-    name: str
-    messages: list[Message]
-
-
-class Prompt(rx.Base):
-    """A prompt."""
-
-    title: str
-    text: str
-
-
-PROMPTS: list[Prompt] = []
-
-with open("prompts.csv", encoding="utf-8") as f:
-    reader = csv.reader(f)
-    next(reader)
-    for row in reader:
-        PROMPTS.append(Prompt(title=row[0], text=row[1]))
+# Conversations other than the current one are unloaded when there are more than this many loaded,
+# or when they have not been viewed for this many seconds
+MAX_LOADED_CONVOS = int(os.getenv("MAX_LOADED_CONVOS", "8"))
+LOADED_CONVO_TTL = float(os.getenv("LOADED_CONVO_TTL", "600"))
+# Number of messages that are shown at first, and added each time the user scrolls up to older messages
+MESSAGE_PAGE_SIZE = int(os.getenv("MESSAGE_PAGE_SIZE", "30"))
+# Opening a search result loads the messages between it and the loaded ones, up to this many pages
+SEARCH_RESULT_MAX_PAGES = int(os.getenv("SEARCH_RESULT_MAX_PAGES", "10"))
+# Seconds to wait for an interrupted response to finish cancelling, before its HTTP streams are closed anyway
+CANCEL_TIMEOUT = float(os.getenv("CANCEL_TIMEOUT", "5"))
 
 
 first_uuid = make_uuid()
@@ -89,70 +56,151 @@ default_provider = "anthropic"
 default_model = "claude-2"
 
 
+S = TypeVar("S", bound="State")
+
+interrupt_to_idle = Histogram(
+    "pychatai_interrupt_to_idle_seconds",
+    "Time from interrupting a response until its chain, tools and HTTP streams are released.",
+)
+
+
 async def wrap_done(fn: Coroutine[Any, Any, dict[str, Any]], queue: asyncio.Queue, interrupt: asyncio.Event):
-    """Wrap an awaitable with a event to signal when it's done or an exception is raised."""
-    try:
+    """Wrap an awaitable with a event to signal when it's done or an exception is raised.
+
+    When interrupted, the awaitable is cancelled and awaited, and the HTTP responses it opened are
+    closed, before the interrupt is put on the queue. The same happens if this is cancelled.
+    """
+    # The responses are tracked in the context of the task, which is copied when it's created
+    with track_responses() as responses:
         fn_task: asyncio.Task = asyncio.create_task(fn)
-        interrupt_task = asyncio.create_task(interrupt.wait())
-        _, pending = await asyncio.wait([fn_task, interrupt_task], return_when="FIRST_COMPLETED")
-        for p in pending:
-            p.cancel()
-        if interrupt.is_set():
+    interrupt_task = asyncio.create_task(interrupt.wait())
+    try:
+        await asyncio.wait([fn_task, interrupt_task], return_when="FIRST_COMPLETED")
+    finally:
+        interrupt_task.cancel()
+        interrupted = not fn_task.done()
+        if interrupted:
+            start = time.perf_counter()
+            fn_task.cancel()
+            await asyncio.wait([fn_task], timeout=CANCEL_TIMEOUT)
+            await close_responses(responses)
+            interrupt_to_idle.observe(time.perf_counter() - start)
+    try:
+        if interrupted:
             queue.put_nowait((OutputType.INTERRUPT, "Interrupted", None))
         else:
             res = fn_task.result()
             queue.put_nowait((OutputType.AGENT_FINISH, res["output"] if "output" in res else res["text"], None))
             return res
+    except QueueFullError as e:
+        queue.put_nowait((OutputType.LLM_ERROR, str(e), None))
     except Exception as e:
         # TODO: handle exception
         print(f"Caught exception: {type(e)}: {e}")
         queue.put_nowait((OutputType.LLM_ERROR, "Error", None))
 
 
+def _apply_output(message: Message, output_type: OutputType, text: str, extra_output: str | None) -> None:
+    """Apply an event of a response other than a token to the message that is being streamed."""
+    last = message.parts[-1]
+    if output_type == OutputType.TOOL_START:
+        if last.type == MessagePartType.TEXT:
+            last.type = MessagePartType.TOOL_START
+            last.text = text
+            last.extra_output = extra_output
+    elif output_type == OutputType.TOOL_END:
+        if last.type == MessagePartType.TOOL_START:
+            last.type = MessagePartType.TOOL_END
+            last.text = text
+            if extra_output is not None:
+                last.extra_output1 = extra_output
+    elif output_type == OutputType.AGENT_FINISH:
+        if last.type == MessagePartType.TEXT:
+            last.type = MessagePartType.AGENT_FINISH
+            last.text = text
+            last.extra_output = extra_output
+    elif output_type == OutputType.LLM_ERROR:
+        message.parts.append(MessagePart(id=make_uuid(), type=MessagePartType.ERROR, text=text))
+    elif output_type == OutputType.INTERRUPT:
+        message.parts.append(MessagePart(id=make_uuid(), type=MessagePartType.INTERRUPT, text=text))
+    else:
+        print(output_type, text)
+
+
 class State(rx.State):
-    """The app state."""
+    """The root state of a session, with the settings and credentials that all substates read.
 
-    convos: dict[UUID, Convo] = {first_uuid: Convo(name="New conversation", messages=[])}
+    Everything else lives in substates, so an event only makes Reflex diff and send the substates it changed:
+    `ConvoState` has the conversations, `StreamState` the response that is being streamed, `UIState` the
+    modals, drawer and input, and `ModelFormState` the form for choosing a model.
+    """
 
     openai_api_key: rx.LocalStorage = os.getenv("OPENAI_API_KEY", "") if USE_ENV_API_KEYS else ""  # type: ignore
     anthropic_api_key: rx.LocalStorage = os.getenv("ANTHROPIC_API_KEY", "") if USE_ENV_API_KEYS else ""  # type: ignore
-    show_api_key_modal: bool = False
+    # Identifies the browser in the conversation store
+    client_id: rx.LocalStorage = ""  # type: ignore
 
-    current_convo: UUID = first_uuid
+    def _api_key(self, provider: str) -> str:
+        """The API key of the user for a provider."""
+        if provider == "openai":
+            return self.openai_api_key
+        if provider == "anthropic":
+            return self.anthropic_api_key
+        return ""
 
-    edit_convo: bool = False
-    drawer_open: bool = False
-    processing: bool = False
-    question: str = ""
-    shift_down: bool = False
-    _interrupt_event: Optional[asyncio.Event] = None
+    def handle_api_key_submit(self, form_data: dict, provider: str):
+        """Handle a form submission."""
+        if provider == "openai":
+            self.openai_api_key = form_data["api_key"]
+        elif provider == "anthropic":
+            self.anthropic_api_key = form_data["api_key"]
 
-    input_should_focus: bool = True
+    def _root_state(self) -> "State":
+        """The root state of the session."""
+        state = self
+        while state.parent_state is not None:
+            state = state.parent_state
+        return state
 
-    convo_model: dict[UUID, dict[str, str]] = {first_uuid: {"provider": default_provider, "name": default_model}}
+    def _substate(self, state_cls: type[S]) -> S:
+        """Get a substate of the session, e.g. to update it from an event handler of another substate."""
+        return self._root_state().get_substate(state_cls.get_full_name().split("."))  # type: ignore
 
-    prompts: list[Prompt] = PROMPTS
 
-    local_storage_convos: rx.LocalStorage = ""  # type: ignore
-    local_storage_current_convo: rx.LocalStorage = ""  # type: ignore
-    local_storage_model: rx.LocalStorage = ""  # type: ignore
-    local_storage_enabled_plugins: rx.LocalStorage = ""  # type: ignore
+class ConvoState(State):
+    """The conversations of the session."""
 
-    enabled_plugins: dict[UUID, dict[str, bool]] = {first_uuid: {k: False for k in plugin_tool}}
+    convos: dict[UUID, Convo] = {first_uuid: Convo(name="New conversation")}
 
-    form_provider: str = default_provider
-    form_model: str = default_model
-    show_model_modal: bool = False
-    show_plugins_modal: bool = False
-    show_prompts_modal: bool = False
+    current_convo: UUID = first_uuid
+    # Number of the newest messages of the current conversation that are rendered
+    message_window: int = MESSAGE_PAGE_SIZE
 
-    show_extra_output_modal: bool = False
+    convo_model: dict[UUID, dict[str, str]] = {first_uuid: {"provider": default_provider, "name": default_model}}
+    enabled_plugins: dict[UUID, dict[str, bool]] = {first_uuid: {k: False for k in plugin_tool}}
 
-    chat_modals_visible: dict[UUID, bool] = {}
+    # Search of the messages of all conversations
+    search_query: str = ""
+    search_results: list[SearchResult] = []
+    # The message that was opened from the search results
+    highlighted_message: UUID = ""
+    # The outcome of the last import of conversations
+    import_status: str = ""
 
-    chat_popovers_visible: dict[UUID, bool] = {}
+    local_storage_current_convo: rx.LocalStorage = ""  # type: ignore
+    # Conversations used to be pickled into local storage, these are only read to migrate them to the store
+    local_storage_convos: rx.LocalStorage = ""  # type: ignore
+    local_storage_model: rx.LocalStorage = ""  # type: ignore
+    local_storage_enabled_plugins: rx.LocalStorage = ""  # type: ignore
+
+    # The messages of the loaded conversations, they're only converted to `Message` models to be rendered
+    _histories: dict[UUID, MessageHistory] = {first_uuid: MessageHistory()}
+    # When each loaded conversation was last viewed
+    _last_viewed: dict[UUID, float] = {}
+    # The history that was sent to the LLM in the last turn of each loaded conversation
+    _context_windows: dict[UUID, ContextWindow] = {}
 
-    @rx.var
+    @cached_var("current_provider", "openai_api_key", "anthropic_api_key")
     def have_api_key(self) -> bool:
         """A computed var that returns whether the user has set an API key."""
         if self.current_provider == "openai":
@@ -161,275 +209,552 @@ class State(rx.State):
             return self.anthropic_api_key != ""
         return True
 
-    def handle_api_key_submit(self, form_data: dict, provider: str):
-        """Handle a form submission."""
-        if provider == "openai":
-            self.openai_api_key = form_data["api_key"]
-        elif provider == "anthropic":
-            self.anthropic_api_key = form_data["api_key"]
-
-    def handle_model_submit(self, form_data: dict):
-        """Handle a form submission."""
-        self.convo_model[self.current_convo]["provider"] = form_data["provider"]
-        self.convo_model[self.current_convo]["name"] = form_data["name"]
-        self.toggle_model_modal()
-        return
-
-    @rx.var
-    def empty_question(self) -> bool:
-        """A computed var that returns whether the question is empty."""
-        return self.question == ""
-
-    @rx.var
+    @cached_var("convos")
     def convo_keys_names(self) -> list[tuple[UUID, str]]:
         """A computed var that returns a list of all conversation names in reverse order (new to old)."""
-        return [(x[0], x[1].name) for x in self.convos.items()][::-1]
+        return [(key, convo.name) for key, convo in reversed(self.convos.items())]
 
-    @rx.var
+    @cached_var("convos", "current_convo")
     def current_convo_name(self) -> str:
         """A computed var that returns the name of the current conversation."""
         return self.convos[self.current_convo].name
 
-    @rx.var
+    @cached_var("_histories", "current_convo", "message_window")
     def current_convo_messages(self) -> list[Message]:
-        """A computed var that returns the messages of the current conversation."""
-        return self.convos[self.current_convo].messages
+        """A computed var that returns the messages of the current conversation that should be rendered."""
+        return list(self._history(self.current_convo)[-self.message_window :])
 
-    @rx.var
+    @cached_var("convos", "_histories", "current_convo", "message_window")
+    def current_convo_has_older(self) -> bool:
+        """A computed var that returns whether the current conversation has older messages than the rendered ones."""
+        return self.convos[self.current_convo].has_older or len(self._history(self.current_convo)) > self.message_window
+
+    @cached_var("enabled_plugins", "current_convo")
     def current_convo_plugins(self) -> dict[str, bool]:
         """A computed var that returns the plugins of the current conversation."""
         return self.enabled_plugins[self.current_convo]
 
-    @rx.var
+    @cached_var("current_convo_plugins")
     def n_enabled_plugins(self) -> int:
         """A computed var that returns the number of enabled plugins."""
         return sum(self.current_convo_plugins.values())
 
-    @rx.var
+    @cached_var("_histories", "current_convo")
     def convo_has_messages(self) -> bool:
         """A computed var that returns whether the current conversation has messages."""
-        return len(self.convos[self.current_convo].messages) > 0
+        return len(self._history(self.current_convo)) > 0
+
+    @cached_var("convo_model", "current_convo")
+    def current_provider(self) -> str:
+        """A computed var that returns the provider of the current conversation."""
+        return self.convo_model[self.current_convo]["provider"]
+
+    @cached_var("convo_model", "current_convo")
+    def current_model(self) -> str:
+        """A computed var that returns the model of the current conversation."""
+        return self.convo_model[self.current_convo]["name"]
+
+    def _history(self, convo_key: UUID) -> MessageHistory:
+        """The loaded messages of a conversation, which are empty if it isn't loaded."""
+        return self._histories.get(convo_key) or MessageHistory()
+
+    def _set_history(self, convo_key: UUID, history: MessageHistory) -> None:
+        """Set the messages of a conversation after changing them.
+
+        Histories are changed in place, which Reflex doesn't see, so they're set again to recompute the vars that read them.
+        """
+        self._histories[convo_key] = history
+
+    def _append_message(self, convo_key: UUID, message: Message) -> None:
+        """Append a finished message to a conversation and save it to the conversation store."""
+        if convo_key in self._histories:
+            # Counted before it's packed, so the context windows built from the history don't count it again
+            message_tokens(message)
+            history = self._histories[convo_key]
+            history.append(message)
+            self._set_history(convo_key, history)
+        self.convos[convo_key].updated_at = time.time()
+        get_store().append_message(convo_key, message)
 
     def set_convo(self, convo_key: UUID) -> None:
         """Set the current conversation."""
-        self.current_convo = convo_key
+        self._activate_convo(convo_key)
         self.local_storage_current_convo = convo_key  # type: ignore
 
+    def _activate_convo(self, convo_key: UUID) -> None:
+        """Make a conversation the current one, loading its messages if needed and unloading stale ones."""
+        if convo_key not in self._histories:
+            messages = get_store().load_messages(convo_key, limit=MESSAGE_PAGE_SIZE + 1)
+            self.convos[convo_key].has_older = len(messages) > MESSAGE_PAGE_SIZE
+            self._set_history(convo_key, messages[-MESSAGE_PAGE_SIZE:])
+        if convo_key != self.current_convo:
+            self.message_window = MESSAGE_PAGE_SIZE
+        self.current_convo = convo_key
+        now = time.time()
+        self._last_viewed[convo_key] = now
+        self._evict_convos(now)
+
+    def _evict_convos(self, now: float) -> None:
+        """Unload the messages of conversations that have not been viewed recently."""
+        live_convo = self._substate(StreamState).live_convo
+        evictable = sorted((t, k) for k, t in self._last_viewed.items() if k not in (self.current_convo, live_convo))
+        n_keep = MAX_LOADED_CONVOS - 1
+        for i, (viewed_at, key) in enumerate(evictable):
+            if i >= len(evictable) - n_keep and now - viewed_at < LOADED_CONVO_TTL:
+                continue
+            del self._last_viewed[key]
+            self._context_windows.pop(key, None)
+            self._histories.pop(key, None)
+            if key in self.convos:
+                self.convos[key].has_older = False
+
+    def load_older_messages(self) -> None:
+        """Render a page of older messages of the current conversation, loading them from the store if needed."""
+        convo = self.convos[self.current_convo]
+        history = self._history(self.current_convo)
+        self.message_window += MESSAGE_PAGE_SIZE
+        missing = self.message_window - len(history)
+        if missing > 0 and convo.has_older:
+            older = get_store().load_messages(self.current_convo, limit=missing + 1, before=history.message_id(0))
+            convo.has_older = len(older) > missing
+            history.prepend(older[-missing:])
+            self._set_history(self.current_convo, history)
+
+    def search_messages(self, query: str) -> None:
+        """Search the messages of all conversations."""
+        self.search_query = query
+        self._search_messages()
+
+    def _search_messages(self) -> None:
+        self.search_results = get_store().search_messages(self.client_id, self.search_query)
+
+    def open_search_result(self, convo_key: UUID, message_id: UUID) -> None:
+        """Open the conversation of a search result and scroll to the matching message."""
+        self.set_convo(convo_key)
+        history = self._history(convo_key)
+        if history.find(message_id) < 0 and history:
+            # Load the messages from the matching one to the loaded ones, so they are shown without gaps
+            limit = SEARCH_RESULT_MAX_PAGES * MESSAGE_PAGE_SIZE
+            older = get_store().load_messages(convo_key, limit=limit + 1, before=history.message_id(0), since=message_id)
+            if len(older) > limit:
+                # Loading a match far back would load most of a long conversation into the state
+                yield UIState.toggle_drawer()  # type: ignore
+                yield rx.window_alert("This message is too far back to open it, scroll up to load older messages.")
+                return
+            history.prepend(older)
+            self._set_history(convo_key, history)
+        index = history.find(message_id)
+        if index < 0:
+            return
+        self.message_window = max(self.message_window, len(history) - index)
+        self.highlighted_message = message_id
+        yield UIState.toggle_drawer()  # type: ignore
+        # Give the messages time to render before scrolling to the matching one
+        yield rx.call_script(
+            f"setTimeout(() => document.getElementById('{message_id}')?.scrollIntoView({{block: 'center'}}), 100)"
+        )
+
     def handle_convo_link_click(self, convo_key: UUID) -> None:
         """Handle a click on a conversation link."""
-        yield State.set_convo(convo_key)  # type: ignore
-        yield State.toggle_drawer()  # type: ignore
-
-    def load_data(self) -> None:
-        """Load conversations and other data from local storage."""
-        # Load convos from local storage
-        if self.local_storage_convos != "":
-            self.convos = pickle.loads(self.local_storage_convos.encode("latin1"))
-        if self.local_storage_current_convo != "":
-            self.current_convo = self.local_storage_current_convo
-        else:
-            self.current_convo = next(iter(self.convos.keys()))
-        # Load convo model from local storage
-        if self.local_storage_model != "":
-            self.convo_model = pickle.loads(self.local_storage_model.encode("latin1"))
-        # Load enabled plugins from local storage
-        if self.local_storage_enabled_plugins != "":
-            self.enabled_plugins = pickle.loads(self.local_storage_enabled_plugins.encode("latin1"))
+        yield ConvoState.set_convo(convo_key)  # type: ignore
+        yield UIState.toggle_drawer()  # type: ignore
 
-    def toggle_api_key_modal(self) -> None:
-        """Toggle the API key modal."""
-        self.show_api_key_modal = not self.show_api_key_modal
+    def load_data(self):
+        """Load conversations and other data from the conversation store.
 
-    def toggle_model_modal(self) -> None:
-        """Toggle the model for selecting a provider and model."""
-        self.show_model_modal = not self.show_model_modal
-        if self.show_model_modal:
-            self.form_provider = self.current_provider
-            self.form_model = self.current_model
+        Returns:
+            An alert if the conversations that an older version kept in local storage couldn't be read.
+        """
+        if self.client_id == "":
+            self.client_id = make_uuid()  # type: ignore
+        alert = self._migrate_local_storage() if self.local_storage_convos != "" else None
+        infos = get_store().list_convos(self.client_id)
+        self.convos = {}
+        self.convo_model = {}
+        self.enabled_plugins = {}
+        self._histories = {}
+        if not infos:
+            self.new_convo(copy_current=False)
+            return alert
+        # Only the index of conversations is loaded, messages are loaded when a conversation is opened
+        self._last_viewed = {}
+        for info in infos:
+            self.convos[info.id] = Convo(name=info.name, created_at=info.created_at, updated_at=info.updated_at)
+            self.convo_model[info.id] = {"provider": info.provider, "name": info.model}
+            self.enabled_plugins[info.id] = {k: info.plugins.get(k, False) for k in plugin_tool}
+        if self.local_storage_current_convo in self.convos:
+            self._activate_convo(self.local_storage_current_convo)
+        else:
+            self._activate_convo(infos[-1].id)
+        return alert
 
-    def toggle_plugins_modal(self) -> None:
-        """Toggle the plugins modal."""
-        self.show_plugins_modal = not self.show_plugins_modal
+    def _migrate_local_storage(self):
+        """Move conversations that were pickled into local storage by older versions to the conversation store.
+
+        Returns:
+            An alert if the conversations couldn't be read, they're dropped since no later load could read them either.
+        """
+        store = get_store()
+        records = local_storage_records(
+            self.local_storage_convos,
+            self.local_storage_model,
+            self.local_storage_enabled_plugins,
+            {"provider": default_provider, "name": default_model},
+        )
+        alert = None
+        # Conversations that are already stored are skipped, so a migration that is run again,
+        # e.g. by another tab of the same browser, doesn't change anything
+        try:
+            with store.transaction():
+                import_records(store, self.client_id, records)
+        except ArchiveError as e:
+            print(f"Could not migrate the conversations in local storage: {e}")
+            alert = rx.window_alert(f"The conversations that an older version saved in this browser couldn't be read: {e}")
+        self.local_storage_convos = ""  # type: ignore
+        self.local_storage_model = ""  # type: ignore
+        self.local_storage_enabled_plugins = ""  # type: ignore
+        return alert
+
+    def _save_convo_info(self, convo_key: UUID) -> None:
+        """Save the name, model and plugins of a conversation to the conversation store."""
+        get_store().save_convo(
+            self.client_id,
+            convo_key,
+            self.convos[convo_key].name,
+            self.convo_model[convo_key],
+            self.enabled_plugins[convo_key],
+        )
 
     def toggle_plugin(self, plugin_name: str, value: bool) -> None:
         """Toggle a plugin."""
         self.enabled_plugins[self.current_convo][plugin_name] = value
+        self._save_convo_info(self.current_convo)
 
-    def toggle_prompts_modal(self) -> None:
-        """Toggle the prompts modal."""
-        self.show_prompts_modal = not self.show_prompts_modal
+    def change_convo_name(self, new_name: str) -> None:
+        """Change the name of the current conversation."""
+        if new_name != "":
+            self.convos[self.current_convo].name = new_name
+            self._save_convo_info(self.current_convo)
 
-    async def set_prompt(self, prompt: dict[str, str]) -> None:
-        """Set a prompt in the input."""
-        self.question = prompt["text"]
-        yield rx.set_value("input", prompt["text"])  # type: ignore
-        yield State.toggle_prompts_modal()  # type: ignore
-
-    def save_data(self):
-        """Save conversations and other data to local storage."""
-        # Save convos to local storage
-        stringified_convos = pickle.dumps(self.convos.copy())
-        self.local_storage_convos = stringified_convos.decode("latin1")  # type: ignore
-        # Save current convo to local storage
-        self.local_storage_current_convo = self.current_convo  # type: ignore
-        # Save convo model to local storage
-        stringified_model = pickle.dumps(self.convo_model.copy())
-        self.local_storage_model = stringified_model.decode("latin1")  # type: ignore
-        # Save enabled plugins to local storage
-        stringified_enabled_plugins = pickle.dumps(self.enabled_plugins.copy())
-        self.local_storage_enabled_plugins = stringified_enabled_plugins.decode("latin1")  # type: ignore
+    def new_convo(self, copy_current: bool = True) -> None:
+        """Create a new conversation."""
+        new_uuid = make_uuid()
+        now = time.time()
+        self.convos[new_uuid] = Convo(name="New conversation", created_at=now, updated_at=now)
+        self._set_history(new_uuid, MessageHistory())
+        self.convo_model[new_uuid] = (
+            self.convo_model[self.current_convo].copy()
+            if copy_current
+            else {"provider": default_provider, "name": default_model}
+        )
+        self.enabled_plugins[new_uuid] = (
+            self.enabled_plugins[self.current_convo].copy() if copy_current else {k: False for k in plugin_tool}
+        )
+        self._activate_convo(new_uuid)
+        self.local_storage_current_convo = new_uuid  # type: ignore
+        self._save_convo_info(new_uuid)
+
+    def handle_new_convo_click(self) -> None:
+        """Handle a click on the new conversation button."""
+        if self.convo_has_messages:
+            yield ConvoState.new_convo()  # type: ignore
+            yield UIState.add_focus()  # type: ignore
+
+    def delete_convo(self, convo_key: UUID) -> None:
+        """Deletes a conversation identified by its key.
+
+        Args:
+            convo_key (UUID): The unique identifier of the conversation to be deleted.
+        """
+        del self.convos[convo_key]
+        del self.convo_model[convo_key]
+        del self.enabled_plugins[convo_key]
+        self._last_viewed.pop(convo_key, None)
+        self._context_windows.pop(convo_key, None)
+        self._histories.pop(convo_key, None)
+        get_store().delete_convo(convo_key)
+        # TODO: delete all related entries in UIState.chat_modals_visible
+        if self.search_query:
+            self._search_messages()
+        if not self.convos:
+            self.new_convo(copy_current=False)
+        elif convo_key == self.current_convo:
+            self._activate_convo(next(iter(self.convos.keys())))
+
+    def delete_convos(self) -> None:
+        """Delete all conversations."""
+        self.convos.clear()
+        self.convo_model.clear()
+        self.enabled_plugins.clear()
+        ui = self._substate(UIState)
+        ui.chat_modals_visible.clear()
+        ui.chat_popovers_visible.clear()
+        self._last_viewed.clear()
+        self._context_windows.clear()
+        self._histories.clear()
+        get_store().delete_convos(self.client_id)
+        self.search_results = []
+        self.new_convo(copy_current=False)
+
+    def export_convos(self):
+        """Download all conversations as an archive, which the backend streams from the conversation store."""
+        url = f"{get_config().api_url}/export?{urlencode({'client_id': self.client_id})}"
+        # As a string, `rx.download()` only takes paths of the frontend
+        return rx.download(url=rx.Var.create_safe(url, _var_is_string=True), filename=export_filenames["gzip"])
+
+    async def import_convos(self, files: list[UploadFile]):
+        """Import the conversations of uploaded archives."""
+        for file in files:
+            try:
+                # Archives are read in chunks from the spooled upload, outside of the event loop
+                result = await asyncio.to_thread(import_archive, get_store(), self.client_id, read_chunks(file.file))
+            except ArchiveError as e:
+                self.import_status = f"Could not import {file.filename}: {e}"
+                break
+            self.import_status = (
+                f"Imported {result.convos} conversations and {result.messages} messages from {file.filename}, "
+                f"skipped {result.skipped_messages} messages."
+            )
+        self.load_data()
+
+    async def regenerate_response(self, message: dict[str, Any]):
+        """Regenerate the response for the given message."""
+        parsed_message = Message.parse_obj(message)
+        yield UIState.set_chat_popover_visible(parsed_message.id, False)  # type: ignore
+        history = self._history(self.current_convo)
+        idx = history.find(parsed_message.id)
+        if idx < 0:
+            return
+        get_store().truncate_messages(self.current_convo, parsed_message.id)
+        self._set_history(self.current_convo, history[:idx])
+        yield StreamState.handle_submit({"input": parsed_message.parts[-1].text})  # type: ignore
+
+
+class StreamState(State):
+    """The response that is being streamed, the only substate that streamed tokens change."""
+
+    processing: bool = False
+    _interrupt_event: Optional[asyncio.Event] = None
+
+    # The response that is currently being streamed lives outside of `convos` until it is finished,
+    # so streamed tokens only update `live_text` instead of resending every conversation.
+    live_convo: UUID = ""
+    live_message: Message = Message(id="", parts=[], own=False)
+    live_text: str = ""
 
     @rx.background
     async def handle_submit(self, form_data: dict):
         """Handle a form submission."""
         question = form_data["input"]
         async with self:
-            if not self.convo_has_messages:
-                self.change_convo_name(question[:20])
-            self.question = ""
+            convo_state = self._substate(ConvoState)
+            ui = self._substate(UIState)
+            if not convo_state.convo_has_messages:
+                convo_state.change_convo_name(question[:20])
+            ui.question = ""
             if question is None or question == "":
                 return
             m_id = make_uuid()
             mp_id = make_uuid()
-            self.convos[self.current_convo].messages.append(
-                Message(id=m_id, parts=[MessagePart(id=mp_id, type=MessagePartType.TEXT, text=question)], own=True)
+            own_message = Message(
+                id=m_id, parts=[MessagePart(id=mp_id, type=MessagePartType.TEXT, text=question)], own=True
             )
-            self.chat_popovers_visible[m_id] = False
-            self.chat_modals_visible[mp_id] = False
+            convo_key = convo_state.current_convo
+            convo_state._append_message(convo_key, own_message)
+            ui.chat_popovers_visible[m_id] = False
+            ui.chat_modals_visible[mp_id] = False
             self.processing = True
             yield
 
-            messages = []
-            for message in self.convos[self.current_convo].messages:
-                msg_cls = HumanMessage if message.own else AIMessage
-                all_text = "\n".join([x.text for x in message.parts])
-                messages.append(msg_cls(content=all_text))
-
-            m_id = make_uuid()
-            mp_id = make_uuid()
-            message = Message(
-                id=m_id, parts=[MessagePart(id=mp_id, type=MessagePartType.TEXT, text="")], own=False, is_loading=True
-            )
-            self.chat_popovers_visible[m_id] = False
-            self.chat_modals_visible[mp_id] = False
-            self.convos[self.current_convo].messages.append(message)
-            yield
-
-            callback = CustomAsyncIteratorCallbackHandler()
-            callback_manager = AsyncCallbackManager([callback])
-
-            if self.current_provider == "openai":
-                llm = ChatOpenAI(
-                    model=self.current_model,
-                    max_tokens=None,
-                    temperature=0.7,
-                    api_key=self.openai_api_key,
-                    n=1,
-                    streaming=True,
-                    callback_manager=callback_manager,
-                )
-            elif self.current_provider == "anthropic":
-                llm = ChatAnthropic(
-                    anthropic_api_key=self.anthropic_api_key,  # type: ignore
-                    streaming=True,
-                    model_name=self.current_model,
-                    callback_manager=callback_manager,
-                    temperature=0.7,
-                    verbose=True,
-                )
-            else:
-                raise ValueError(f"Unknown provider {self.current_provider}")
-
-            history = ChatMessageHistory(messages=messages[:-1])
-            memory = ConversationBufferMemory(chat_memory=history, memory_key="chat_history", return_messages=True)
-
-            tools = [
-                plugin_tool[k](callback_manager=callback_manager)
-                for k, v in self.enabled_plugins[self.current_convo].items()
-                if v
-            ]
-
-            self._interrupt_event = asyncio.Event()
-            self._interrupt_event.clear()
-        if tools:
-            agent = (
-                AgentType.OPENAI_MULTI_FUNCTIONS
-                if self.current_provider == "openai"
-                else AgentType.CHAT_CONVERSATIONAL_REACT_DESCRIPTION
-            )
-            agent_chain = initialize_agent(
-                tools,
-                llm,
-                callback_manager=callback_manager,
-                memory=memory,
-                agent=agent,
-                verbose=True,
-            )
-
-            run = asyncio.create_task(
-                wrap_done(agent_chain.ainvoke({"input": question}), callback.queue, self._interrupt_event)
-            )
-        else:
-            prompt = ChatPromptTemplate(
-                messages=[
-                    SystemMessagePromptTemplate.from_template(
-                        "You are a nice chatbot having a conversation with a human. The output should be valid markdown."
+        request_metrics: RequestMetrics | None = None
+        chain = run = None
+        finished = False
+        try:
+            async with self:
+                # The question is passed to the chain separately, the history is everything before it
+                convo_state = self._substate(ConvoState)
+                ui = self._substate(UIState)
+                provider = convo_state.current_provider
+                model = convo_state.current_model
+                window = update_context_window(
+                    convo_state._context_windows.get(convo_key),
+                    model,
+                    convo_state._history(convo_key)[:-1],
+                    load_older=(
+                        (lambda before: get_store().load_messages(convo_key, limit=MESSAGE_PAGE_SIZE, before=before))
+                        if convo_state.convos[convo_key].has_older
+                        else None
                     ),
-                    # The `variable_name` here is what must align with memory
-                    MessagesPlaceholder(variable_name="chat_history"),
-                    HumanMessagePromptTemplate.from_template("{question}"),
-                ]
-            )  # type: ignore
-            conversation = LLMChain(llm=llm, prompt=prompt, verbose=True, memory=memory)
-            run = asyncio.create_task(
-                wrap_done(conversation.ainvoke({"question": question}), callback.queue, self._interrupt_event)
-            )
+                )
+                convo_state._context_windows[convo_key] = window
 
-        async for output_type, text, extra_output in callback.aiter():
+                m_id = make_uuid()
+                mp_id = make_uuid()
+                message = Message(
+                    id=m_id,
+                    parts=[MessagePart(id=mp_id, type=MessagePartType.TEXT, text="")],
+                    own=False,
+                    is_loading=True,
+                )
+                ui.chat_popovers_visible[m_id] = False
+                ui.chat_modals_visible[mp_id] = False
+                self.live_convo = convo_key
+                self._sync_live_message(message, structural=True)
+                yield
+
+                callback = CustomAsyncIteratorCallbackHandler()
+                request_metrics = RequestMetrics(provider)
+                # The chain and LLM client are shared between requests, so the callbacks are passed when invoking it
+                config: RunnableConfig = {"callbacks": [callback, request_metrics]}
+                history_messages = window.messages(reserve=count_tokens(question))
+                plugins = frozenset(k for k, v in self._substate(ConvoState).enabled_plugins[convo_key].items() if v)
+
+                # Responses of agents depend on their tools, so only plain chats are cached
+                response_cache = get_response_cache() if not plugins else None
+                cache_key = cached_response = None
+                if response_cache is not None:
+                    cache_key = response_cache_key(
+                        provider, model, TEMPERATURE, SYSTEM_PROMPT, history_messages, question
+                    )
+                    cached_response = response_cache.get(cache_key)
+
+                if cached_response is not None:
+                    answer = replay_response(cached_response, callback.queue)
+                else:
+                    history = ChatMessageHistory(messages=history_messages)
+                    memory = ConversationBufferMemory(
+                        chat_memory=history, memory_key="chat_history", return_messages=True
+                    )
+                    chain = get_chain(provider, model, self._api_key(provider), plugins, memory)
+                    # Responses wait for a slot of their provider and API key, and report their place in the queue
+                    answer = scheduler.run(
+                        chain.ainvoke({"input": question}, config),
+                        provider,
+                        self._api_key(provider),
+                        session=self.client_id,
+                        agent=bool(plugins),
+                        on_wait=lambda position, waited: callback.queue.put_nowait(
+                            (OutputType.QUEUE_STATUS, f"Waiting in queue: position {position} ({waited:.0f}s)", None)
+                        ),
+                    )
+
+                self._interrupt_event = asyncio.Event()
+            run = asyncio.create_task(wrap_done(answer, callback.queue, self._interrupt_event))
+            await self._stream_response(message, callback, request_metrics)
+            result = await run
+            if result is not None and cache_key is not None and cached_response is None:
+                response_cache.put(cache_key, result["text"])  # type: ignore
+            async with self:
+                self._end_stream()
+                message.is_loading = False
+                convo_state = self._substate(ConvoState)
+                # The conversation may have been deleted while the response was being generated
+                if convo_key in convo_state.convos:
+                    convo_state._append_message(convo_key, message)
+                if sample_state_size():
+                    self._observe_state_size()
+            finished = True
+        except BaseException as e:
+            if request_metrics is not None:
+                request_metrics.outcome = "interrupted" if isinstance(e, asyncio.CancelledError) else "error"
+            # If this is cancelled, the response must not keep running without anyone reading it
+            if run is not None:
+                run.cancel()
+            raise
+        finally:
+            if request_metrics is not None:
+                request_metrics.finish()
+            # Also kills the sandbox worker of the Python plugin if the response was cancelled or failed
+            if chain is not None:
+                release_chain(chain)
+            # A response that failed must not leave the input disabled and the live message on the page
+            if not finished:
+                async with self:
+                    self._end_stream()
+
+    async def _stream_response(
+        self, message: Message, callback: CustomAsyncIteratorCallbackHandler, request_metrics: RequestMetrics
+    ) -> None:
+        """Apply the events of a response to the message that is being streamed, until the response is done.
+
+        The events are read from the queue of the callback rather than its iterator, so that tokens
+        that are due can be flushed while the queue is empty.
+        """
+        # Tokens are coalesced and only flushed to the client on a time/size budget,
+        # all other events are flushed immediately together with any pending tokens.
+        buffer = TokenBuffer()
+        while True:
+            try:
+                event = await asyncio.wait_for(callback.queue.get(), buffer.flush_timeout())
+            except asyncio.TimeoutError:
+                # The provider paused, so the pending tokens are sent without waiting for the next event
+                n_parts = len(message.parts)
+                message.append_text(buffer.drain())
+                buffer.mark_flushed()
+                async with self:
+                    self._sync_live_message(message, structural=len(message.parts) != n_parts)
+                continue
+            output_type, text, extra_output = event
+            request_metrics.observe(output_type)
+            if output_type == OutputType.QUEUE_STATUS:
+                message.queue_status = text
+                async with self:
+                    self._sync_live_message(message, structural=True)
+                continue
+            message.queue_status = ""
+            n_parts = len(message.parts)
+            was_loading = message.is_loading
             message.is_loading = False
+            if output_type != OutputType.TOKEN and buffer:
+                message.append_text(buffer.drain())
             if output_type == OutputType.TOKEN:
-                if messages and (last := message.parts[-1]).type == MessagePartType.TEXT:
-                    message.parts[-1].text += text
-                else:
-                    mp_id = make_uuid()
-                    message.parts.append(MessagePart(id=mp_id, type=MessagePartType.TEXT, text=text))
-            elif output_type == OutputType.TOOL_START:
-                if messages and (last := message.parts[-1]).type == MessagePartType.TEXT:
-                    last.type = MessagePartType.TOOL_START
-                    last.text = text
-                    last.extra_output = extra_output
-            elif output_type == OutputType.TOOL_END:
-                if messages and (last := message.parts[-1]).type == MessagePartType.TOOL_START:
-                    last.type = MessagePartType.TOOL_END
-                    last.text = text
-                    if extra_output is not None:
-                        last.extra_output1 = extra_output
-            elif output_type == OutputType.AGENT_FINISH:
-                if messages and (last := message.parts[-1]).type == MessagePartType.TEXT:
-                    last.type = MessagePartType.AGENT_FINISH
-                    last.text = text
-                    last.extra_output = extra_output
-            elif output_type == OutputType.LLM_ERROR:
-                mp_id = make_uuid()
-                message.parts.append(MessagePart(id=mp_id, type=MessagePartType.ERROR, text=text))
-            elif output_type == OutputType.INTERRUPT:
-                mp_id = make_uuid()
-                message.parts.append(MessagePart(id=mp_id, type=MessagePartType.INTERRUPT, text=text))
+                buffer.add(text)
+                if not buffer.should_flush():
+                    continue
+                message.append_text(buffer.drain())
             else:
-                print(output_type, text)
-            yield
-
-        await run
-        async with self:
-            self.processing = False
-            message.is_loading = False
-            self.save_data()
+                _apply_output(message, output_type, text, extra_output)
+            buffer.mark_flushed()
+            async with self:
+                self._sync_live_message(
+                    message,
+                    structural=was_loading or output_type != OutputType.TOKEN or len(message.parts) != n_parts,
+                )
+            if output_type in TERMINAL_OUTPUT_TYPES:
+                break
+
+    def _end_stream(self) -> None:
+        """Reset the vars of the response that is being streamed."""
+        self.processing = False
+        self.live_convo = ""
+        self.live_message = Message(id="", parts=[], own=False)
+        self.live_text = ""
+        self._interrupt_event = None
+
+    def _observe_state_size(self) -> None:
+        """Record the size of the state of the session in the metrics."""
+        # Metrics must never break a request, e.g. if a backend var can't be pickled
+        with contextlib.suppress(pickle.PicklingError, TypeError, AttributeError):
+            # Reflex pickles states with cloudpickle, plain pickle can't pickle their setters
+            session_state_size.observe(len(cloudpickle.dumps(self._root_state())))
+
+    def _sync_live_message(self, message: Message, structural: bool) -> None:
+        """Mirror the message that is being streamed into the live vars.
+
+        The text part that is being written is kept in `live_text`, all parts before it in `live_message`.
+        Unless the structure of the message changed, only `live_text` is updated.
+        """
+        streaming_text = message.parts[-1].type == MessagePartType.TEXT
+        if structural:
+            parts = message.parts[:-1] if streaming_text else message.parts
+            self.live_message = message.copy(update={"parts": list(parts)})
+        self.live_text = message.parts[-1].text if streaming_text else ""
 
     def handle_question_submit(self, form_data: dict):
         """Handle question being submitted through the input."""
-        yield State.handle_submit(form_data)  # type: ignore
+        yield StreamState.handle_submit(form_data)  # type: ignore
         yield rx.set_value("input", "")
-        yield State.add_focus()  # type: ignore
+        yield UIState.add_focus()  # type: ignore
 
     async def interrupt_chat(self):
         """Interrupt the chat."""
@@ -437,87 +762,100 @@ class State(rx.State):
             self._interrupt_event.set()
         yield
 
-    def toggle_drawer(self) -> None:
-        """Toggle the drawer."""
-        self.drawer_open = not self.drawer_open
 
-    def toggle_edit_convo(self) -> None:
-        """Toggle the edit conversation mode."""
-        self.edit_convo = not self.edit_convo
+class UIState(State):
+    """The modals, drawer, popovers and input of the page."""
 
-    def change_convo_name(self, new_name: str) -> None:
-        """Change the name of the current conversation."""
-        if new_name != "":
-            self.convos[self.current_convo].name = new_name
-            self.save_data()
+    edit_convo: bool = False
+    drawer_open: bool = False
+    question: str = ""
+    shift_down: bool = False
+    input_should_focus: bool = True
 
-    def new_convo(self, copy_current: bool = True) -> None:
-        """Create a new conversation."""
-        new_uuid = make_uuid()
-        self.convos[new_uuid] = Convo(name="New conversation", messages=[])
-        self.convo_model[new_uuid] = (
-            self.convo_model[self.current_convo].copy()
-            if copy_current
-            else {"provider": default_provider, "name": default_model}
-        )
-        self.enabled_plugins[new_uuid] = (
-            self.enabled_plugins[self.current_convo].copy() if copy_current else {k: False for k in plugin_tool}
-        )
-        self.current_convo = new_uuid
-        self.save_data()
+    show_api_key_modal: bool = False
+    show_plugins_modal: bool = False
+    show_prompts_modal: bool = False
+    show_extra_output_modal: bool = False
+    show_backup_modal: bool = False
 
-    def handle_new_convo_click(self) -> None:
-        """Handle a click on the new conversation button."""
-        if self.convo_has_messages:
-            yield State.new_convo()  # type: ignore
-            yield State.add_focus()  # type: ignore
+    chat_modals_visible: dict[UUID, bool] = {}
 
-    def delete_convo(self, convo_key: UUID) -> None:
-        """Deletes a conversation identified by its key.
+    chat_popovers_visible: dict[UUID, bool] = {}
 
-        Args:
-            convo_key (UUID): The unique identifier of the conversation to be deleted.
-        """
-        del self.convos[convo_key]
-        del self.convo_model[convo_key]
-        # TODO: delete all related entries in self.chat_modals_visible
-        if convo_key == self.current_convo:
-            self.current_convo = next(iter(self.convos.keys()))
-        self.save_data()
+    # The page of the prompt library that is shown, it's only loaded while the prompts modal is open
+    prompts: list[Prompt] = []
+    prompt_query: str = ""
+    prompts_offset: int = 0
+    prompts_total: int = 0
 
-    def delete_convos(self) -> None:
-        """Delete all conversations."""
-        self.convos.clear()
-        self.convo_model.clear()
-        self.enabled_plugins.clear()
-        self.chat_modals_visible.clear()
-        self.chat_popovers_visible.clear()
-        self.new_convo(copy_current=False)
-        self.save_data()
+    @cached_var("question")
+    def empty_question(self) -> bool:
+        """A computed var that returns whether the question is empty."""
+        return self.question == ""
 
-    def handle_provider_change(self, provider: str) -> None:
-        """Handle a change in the provider in the model form."""
-        self.form_provider = provider
-        self.form_model = providers_models[provider][0]
+    def toggle_api_key_modal(self) -> None:
+        """Toggle the API key modal."""
+        self.show_api_key_modal = not self.show_api_key_modal
 
-    def handle_model_change(self, model: str) -> None:
-        """Handle a change in the model in the model form."""
-        self.form_model = model
+    def toggle_plugins_modal(self) -> None:
+        """Toggle the plugins modal."""
+        self.show_plugins_modal = not self.show_plugins_modal
 
-    @rx.var
-    def current_provider(self) -> str:
-        """A computed var that returns the provider of the current conversation."""
-        return self.convo_model[self.current_convo]["provider"]
+    def toggle_backup_modal(self) -> None:
+        """Toggle the modal for exporting and importing conversations."""
+        self.show_backup_modal = not self.show_backup_modal
 
-    @rx.var
-    def current_model(self) -> str:
-        """A computed var that returns the model of the current conversation."""
-        return self.convo_model[self.current_convo]["name"]
+    def toggle_prompts_modal(self) -> None:
+        """Toggle the prompts modal."""
+        self.show_prompts_modal = not self.show_prompts_modal
+        if self.show_prompts_modal:
+            self.search_prompts(self.prompt_query)
+        else:
+            self.prompts = []
+
+    def search_prompts(self, query: str) -> None:
+        """Show the first page of the prompts that match a query."""
+        self.prompt_query = query
+        self._load_prompts(0)
+
+    def next_prompts_page(self) -> None:
+        """Show the next page of prompts."""
+        if self.prompts_offset + PROMPT_PAGE_SIZE < self.prompts_total:
+            self._load_prompts(self.prompts_offset + PROMPT_PAGE_SIZE)
+
+    def previous_prompts_page(self) -> None:
+        """Show the previous page of prompts."""
+        self._load_prompts(max(self.prompts_offset - PROMPT_PAGE_SIZE, 0))
+
+    def _load_prompts(self, offset: int) -> None:
+        self.prompts, self.prompts_total = get_prompt_index().search(self.prompt_query, offset, PROMPT_PAGE_SIZE)
+        self.prompts_offset = offset
+
+    @cached_var("prompts", "prompts_offset", "prompts_total")
+    def prompts_page_info(self) -> str:
+        """The range of prompts that is shown, e.g. `1-20 of 150`."""
+        if self.prompts_total == 0:
+            return "No prompts found"
+        return f"{self.prompts_offset + 1}-{self.prompts_offset + len(self.prompts)} of {self.prompts_total}"
+
+    @cached_var("prompts", "prompts_offset", "prompts_total")
+    def prompts_has_next_page(self) -> bool:
+        """Whether there are more prompts after the page that is shown."""
+        return self.prompts_offset + len(self.prompts) < self.prompts_total
 
-    @rx.var
-    def form_provider_models(self) -> list[str]:
-        """A computed var that returns the available models of the current provider."""
-        return providers_models[self.form_provider]
+    async def set_prompt(self, prompt: dict[str, str]) -> None:
+        """Set a prompt in the input."""
+        self.question = prompt["text"]
+        yield rx.set_value("input", prompt["text"])  # type: ignore
+        yield UIState.toggle_prompts_modal()  # type: ignore
+
+    def toggle_drawer(self) -> None:
+        """Toggle the drawer."""
+        self.drawer_open = not self.drawer_open
+
+    def toggle_edit_convo(self) -> None:
+        """Toggle the edit conversation mode."""
+        self.edit_convo = not self.edit_convo
 
     def remove_focus(self, _):
         """Remove focus from the input."""
@@ -545,13 +883,43 @@ class State(rx.State):
     def copy_message(self, message: dict[str, Any]):
         """Copy the text of the given message to the clipboard."""
         yield rx.set_clipboard(message["parts"][-1]["text"])
-        yield State.set_chat_popover_visible(message["id"], False)  # type: ignore
+        yield UIState.set_chat_popover_visible(message["id"], False)  # type: ignore
 
-    async def regenerate_response(self, message: dict[str, Any]):
-        """Regenerate the response for the given message."""
-        parsed_message = Message.parse_obj(message)
-        yield State.set_chat_popover_visible(parsed_message.id, False)  # type: ignore
-        idx = next(i for i, m in enumerate(self.convos[self.current_convo].messages) if m.id == parsed_message.id)
-        new_messages = self.convos[self.current_convo].messages.copy()[:idx]
-        self.convos[self.current_convo] = Convo(name=self.convos[self.current_convo].name, messages=new_messages)
-        yield State.handle_submit({"input": parsed_message.parts[-1].text})  # type: ignore
+
+class ModelFormState(State):
+    """The form for choosing the provider and model of the current conversation."""
+
+    form_provider: str = default_provider
+    form_model: str = default_model
+    show_model_modal: bool = False
+
+    @cached_var("form_provider")
+    def form_provider_models(self) -> list[str]:
+        """A computed var that returns the available models of the current provider."""
+        return providers_models[self.form_provider]
+
+    def toggle_model_modal(self) -> None:
+        """Toggle the model for selecting a provider and model."""
+        self.show_model_modal = not self.show_model_modal
+        if self.show_model_modal:
+            convo_state = self._substate(ConvoState)
+            self.form_provider = convo_state.current_provider
+            self.form_model = convo_state.current_model
+
+    def handle_provider_change(self, provider: str) -> None:
+        """Handle a change in the provider in the model form."""
+        self.form_provider = provider
+        self.form_model = providers_models[provider][0]
+
+    def handle_model_change(self, model: str) -> None:
+        """Handle a change in the model in the model form."""
+        self.form_model = model
+
+    def handle_model_submit(self, form_data: dict):
+        """Handle a form submission."""
+        convo_state = self._substate(ConvoState)
+        convo_state.convo_model[convo_state.current_convo]["provider"] = form_data["provider"]
+        convo_state.convo_model[convo_state.current_convo]["name"] = form_data["name"]
+        convo_state._save_convo_info(convo_state.current_convo)
+        self.toggle_model_modal()
+        return
@@ -0,0 +1,386 @@
+"""Server-side storage of conversations.
+
+Conversations are stored per client, with one row per conversation, message and message part.
+Messages are only ever appended (or truncated when a response is regenerated), so a new
+response costs a few row inserts instead of rewriting the whole history.
+
+The text of messages is indexed for full-text search. The index is kept up to date by the
+database itself whenever message parts are inserted or deleted.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import AbstractContextManager, contextmanager
+from typing import Callable, Iterable, Iterator, NamedTuple
+
+from reflex_gptp.message_history import MessageHistory
+from reflex_gptp.models import UUID, Message, SearchResult
+from reflex_gptp.utils import MessagePartType
+
+CONVO_STORE = os.getenv("CONVO_STORE", "sqlite")
+CONVO_STORE_PATH = os.getenv("CONVO_STORE_PATH", "pychatai.db")
+# Maximum number of results of a search
+SEARCH_LIMIT = int(os.getenv("SEARCH_LIMIT", "50"))
+
+
+class ConvoInfo(NamedTuple):
+    """Everything about a conversation except its messages."""
+
+    id: UUID  # noqa: A003
+    name: str
+    provider: str
+    model: str
+    plugins: dict[str, bool]
+    created_at: float
+    updated_at: float
+
+
+class ConvoStore(ABC):
+    """A store for the conversations of all clients."""
+
+    @abstractmethod
+    def list_convos(self, client_id: str) -> list[ConvoInfo]:
+        """List the conversations of a client, from old to new."""
+
+    @abstractmethod
+    def load_messages(
+        self, convo_id: UUID, limit: int | None = None, before: UUID | None = None, since: UUID | None = None
+    ) -> MessageHistory:
+        """Load the messages of a conversation, from old to new.
+
+        Args:
+            convo_id: The conversation to load the messages of.
+            limit: If given, only load this many of the newest messages.
+            before: If given, only load messages older than the message with this id.
+            since: If given, only load the message with this id and the messages after it.
+        """
+
+    @abstractmethod
+    def iter_messages(self, convo_id: UUID, batch_size: int) -> Iterator[MessageHistory]:
+        """Read all messages of a conversation from old to new, in batches of at most `batch_size` messages."""
+
+    @abstractmethod
+    def search_messages(self, client_id: str, query: str, limit: int = SEARCH_LIMIT) -> list[SearchResult]:
+        """Search the messages of all conversations of a client, best matches first.
+
+        Every word of the query must match the start of a word in the message.
+        """
+
+    @abstractmethod
+    def save_convo(
+        self, client_id: str, convo_id: UUID, name: str, model: dict[str, str], plugins: dict[str, bool]
+    ) -> None:
+        """Create a conversation or update its name, model and plugins."""
+
+    @abstractmethod
+    def append_message(self, convo_id: UUID, message: Message) -> None:
+        """Append a finished message to a conversation."""
+
+    @abstractmethod
+    def import_convo(self, client_id: str, info: ConvoInfo) -> bool:
+        """Create a conversation with its timestamps, unless it already exists.
+
+        Returns:
+            Whether the conversation was created.
+        """
+
+    @abstractmethod
+    def import_messages(self, convo_id: UUID, messages: Iterable[Message]) -> int:
+        """Append messages to a conversation at once, skipping the messages whose id is already stored.
+
+        Returns:
+            The number of messages that were appended.
+        """
+
+    @abstractmethod
+    def truncate_messages(self, convo_id: UUID, message_id: UUID) -> None:
+        """Delete a message and all messages after it from a conversation."""
+
+    @abstractmethod
+    def transaction(self) -> AbstractContextManager[None]:
+        """Make the changes in a block at once, or not at all if the block raises.
+
+        Transactions can be nested, the changes are only made when the outermost one ends.
+        """
+
+    @abstractmethod
+    def delete_convo(self, convo_id: UUID) -> None:
+        """Delete a conversation and its messages."""
+
+    @abstractmethod
+    def delete_convos(self, client_id: str) -> None:
+        """Delete all conversations of a client."""
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS convos (
+    id TEXT PRIMARY KEY,
+    client_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    provider TEXT NOT NULL,
+    model TEXT NOT NULL,
+    plugins TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS convos_client ON convos (client_id, created_at);
+CREATE TABLE IF NOT EXISTS messages (
+    id TEXT PRIMARY KEY,
+    convo_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    own INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_convo ON messages (convo_id, seq);
+CREATE TABLE IF NOT EXISTS parts (
+    id TEXT PRIMARY KEY,
+    message_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    text TEXT NOT NULL,
+    extra_output TEXT,
+    extra_output1 TEXT
+);
+CREATE INDEX IF NOT EXISTS parts_message ON parts (message_id, seq);
+"""
+
+# The client of a part is indexed as a column of its own, so searches only look at the posting
+# lists of the client instead of filtering the matches of all clients. Rows of the index have the
+# rowid of their part, which is stable because the database is never vacuumed.
+# The transaction takes the write lock right away, so workers that start at the same time create
+# the index one after the other, and the backfill skips the parts that are already indexed.
+SEARCH_SCHEMA = """
+BEGIN IMMEDIATE;
+CREATE VIRTUAL TABLE IF NOT EXISTS parts_fts USING fts5 (text, client, tokenize = 'unicode61', prefix = '2 3');
+CREATE TRIGGER IF NOT EXISTS parts_fts_insert AFTER INSERT ON parts WHEN new.type IN ('text', 'agent_finish') BEGIN
+    INSERT INTO parts_fts (rowid, text, client)
+    SELECT new.rowid, new.text, c.client_id FROM messages m JOIN convos c ON c.id = m.convo_id
+    WHERE m.id = new.message_id;
+END;
+CREATE TRIGGER IF NOT EXISTS parts_fts_delete AFTER DELETE ON parts BEGIN
+    DELETE FROM parts_fts WHERE rowid = old.rowid;
+END;
+INSERT INTO parts_fts (rowid, text, client)
+SELECT p.rowid, p.text, c.client_id FROM parts p
+JOIN messages m ON m.id = p.message_id JOIN convos c ON c.id = m.convo_id
+WHERE p.type IN ('text', 'agent_finish') AND NOT EXISTS (SELECT 1 FROM parts_fts f WHERE f.rowid = p.rowid);
+COMMIT;
+"""
+
+
+def _fts_string(text: str) -> str:
+    return '"' + text.replace('"', '""') + '"'
+
+
+def _fts_query(client_id: str, query: str) -> str:
+    """Turn a query into an FTS5 query for the parts of a client with words starting with every word of the query."""
+    words = " ".join(_fts_string(word) + "*" for word in query.split())
+    return f"client : {_fts_string(client_id)} AND text : ({words})"
+
+
+class SQLiteConvoStore(ConvoStore):
+    """A conversation store backed by an embedded SQLite database."""
+
+    def __init__(self, path: str = CONVO_STORE_PATH):
+        # Reentrant, so the methods can be called in a transaction
+        self._lock = threading.RLock()
+        self._in_transaction = False
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        has_search = self._conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'parts_fts'").fetchone()
+        if not has_search:
+            # Also indexes the messages that were stored before the store had a search index
+            self._conn.executescript(SEARCH_SCHEMA)
+
+    def list_convos(self, client_id: str) -> list[ConvoInfo]:
+        """List the conversations of a client, from old to new."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, name, provider, model, plugins, created_at, updated_at FROM convos "
+                "WHERE client_id = ? ORDER BY created_at, rowid",
+                (client_id,),
+            ).fetchall()
+        return [ConvoInfo(r[0], r[1], r[2], r[3], json.loads(r[4]), r[5], r[6]) for r in rows]
+
+    def load_messages(
+        self, convo_id: UUID, limit: int | None = None, before: UUID | None = None, since: UUID | None = None
+    ) -> MessageHistory:
+        """Load the messages of a conversation, from old to new."""
+        condition = "convo_id = ?"
+        params: list = [convo_id]
+        if before is not None:
+            condition += " AND seq < (SELECT seq FROM messages WHERE id = ?)"
+            params.append(before)
+        if since is not None:
+            condition += " AND seq >= (SELECT seq FROM messages WHERE id = ?)"
+            params.append(since)
+        params.append(-1 if limit is None else limit)
+        with self._lock:
+            # The condition is built from fixed strings, the values are parameters
+            rows = self._conn.execute(
+                "SELECT m.id, m.own, p.id, p.type, p.text, p.extra_output, p.extra_output1 "  # noqa: S608
+                "FROM messages m JOIN parts p ON p.message_id = m.id "
+                f"WHERE m.id IN (SELECT id FROM messages WHERE {condition} ORDER BY seq DESC LIMIT ?) "
+                "ORDER BY m.seq, p.seq",
+                params,
+            ).fetchall()
+        return MessageHistory.from_parts(rows)
+
+    def iter_messages(self, convo_id: UUID, batch_size: int) -> Iterator[MessageHistory]:
+        """Read all messages of a conversation from old to new, in batches of at most `batch_size` messages."""
+        last_seq = -1
+        while True:
+            # The lock is only held for a batch, so reading a long conversation doesn't block other sessions
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT m.seq, m.id, m.own, p.id, p.type, p.text, p.extra_output, p.extra_output1 "
+                    "FROM messages m JOIN parts p ON p.message_id = m.id "
+                    "WHERE m.id IN (SELECT id FROM messages WHERE convo_id = ? AND seq > ? ORDER BY seq LIMIT ?) "
+                    "ORDER BY m.seq, p.seq",
+                    (convo_id, last_seq, batch_size),
+                ).fetchall()
+            if not rows:
+                return
+            last_seq = rows[-1][0]
+            yield MessageHistory.from_parts(row[1:] for row in rows)
+
+    def search_messages(self, client_id: str, query: str, limit: int = SEARCH_LIMIT) -> list[SearchResult]:
+        """Search the messages of all conversations of a client, best matches first."""
+        if not query.split():
+            return []
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT c.id, c.name, m.id, snippet(parts_fts, 0, '**', '**', '...', 16) "
+                "FROM parts_fts JOIN parts p ON p.rowid = parts_fts.rowid "
+                "JOIN messages m ON m.id = p.message_id JOIN convos c ON c.id = m.convo_id "
+                "WHERE parts_fts MATCH ? ORDER BY rank LIMIT ?",
+                (_fts_query(client_id, query), limit),
+            ).fetchall()
+        return [SearchResult(convo_id=r[0], convo_name=r[1], message_id=r[2], snippet=r[3]) for r in rows]
+
+    def save_convo(
+        self, client_id: str, convo_id: UUID, name: str, model: dict[str, str], plugins: dict[str, bool]
+    ) -> None:
+        """Create a conversation or update its name, model and plugins."""
+        now = time.time()
+        with self.transaction():
+            self._conn.execute(
+                "INSERT INTO convos (id, client_id, name, provider, model, plugins, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (id) DO UPDATE SET "
+                "name = excluded.name, provider = excluded.provider, model = excluded.model, "
+                "plugins = excluded.plugins, updated_at = excluded.updated_at",
+                (convo_id, client_id, name, model["provider"], model["name"], json.dumps(dict(plugins)), now, now),
+            )
+
+    def append_message(self, convo_id: UUID, message: Message) -> None:
+        """Append a finished message to a conversation."""
+        with self.transaction():
+            self._conn.execute(
+                "INSERT INTO messages (id, convo_id, seq, own) "
+                "SELECT ?, ?, COALESCE(MAX(seq) + 1, 0), ? FROM messages WHERE convo_id = ?",
+                (message.id, convo_id, message.own, convo_id),
+            )
+            self._conn.executemany(
+                "INSERT INTO parts (id, message_id, seq, type, text, extra_output, extra_output1) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (p.id, message.id, i, MessagePartType(p.type).value, p.text, p.extra_output, p.extra_output1)
+                    for i, p in enumerate(message.parts)
+                ],
+            )
+            self._conn.execute("UPDATE convos SET updated_at = ? WHERE id = ?", (time.time(), convo_id))
+
+    def import_convo(self, client_id: str, info: ConvoInfo) -> bool:
+        """Create a conversation with its timestamps, unless it already exists."""
+        with self.transaction():
+            cursor = self._conn.execute(
+                "INSERT INTO convos (id, client_id, name, provider, model, plugins, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (id) DO NOTHING",
+                (info.id, client_id, info.name, info.provider, info.model, json.dumps(info.plugins), info.created_at, info.updated_at),
+            )
+        return cursor.rowcount == 1
+
+    def import_messages(self, convo_id: UUID, messages: Iterable[Message]) -> int:
+        """Append messages to a conversation at once, skipping the messages whose id is already stored."""
+        n_imported = 0
+        with self.transaction():
+            seq = self._conn.execute(
+                "SELECT COALESCE(MAX(seq) + 1, 0) FROM messages WHERE convo_id = ?", (convo_id,)
+            ).fetchone()[0]
+            for message in messages:
+                cursor = self._conn.execute(
+                    "INSERT INTO messages (id, convo_id, seq, own) VALUES (?, ?, ?, ?) ON CONFLICT (id) DO NOTHING",
+                    (message.id, convo_id, seq, message.own),
+                )
+                if cursor.rowcount == 0:
+                    continue
+                self._conn.executemany(
+                    "INSERT INTO parts (id, message_id, seq, type, text, extra_output, extra_output1) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (id) DO NOTHING",
+                    [
+                        (p.id, message.id, i, MessagePartType(p.type).value, p.text, p.extra_output, p.extra_output1)
+                        for i, p in enumerate(message.parts)
+                    ],
+                )
+                seq += 1
+                n_imported += 1
+        return n_imported
+
+    def truncate_messages(self, convo_id: UUID, message_id: UUID) -> None:
+        """Delete a message and all messages after it from a conversation."""
+        with self.transaction():
+            ids = self._conn.execute(
+                "SELECT id FROM messages WHERE convo_id = ? AND seq >= (SELECT seq FROM messages WHERE id = ?)",
+                (convo_id, message_id),
+            ).fetchall()
+            self._delete_messages([i[0] for i in ids])
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """Make the changes in a block at once, or not at all if the block raises."""
+        with self._lock:
+            if self._in_transaction:
+                yield
+                return
+            self._in_transaction = True
+            try:
+                with self._conn:
+                    yield
+            finally:
+                self._in_transaction = False
+
+    def delete_convo(self, convo_id: UUID) -> None:
+        """Delete a conversation and its messages."""
+        with self.transaction():
+            ids = self._conn.execute("SELECT id FROM messages WHERE convo_id = ?", (convo_id,)).fetchall()
+            self._delete_messages([i[0] for i in ids])
+            self._conn.execute("DELETE FROM convos WHERE id = ?", (convo_id,))
+
+    def delete_convos(self, client_id: str) -> None:
+        """Delete all conversations of a client."""
+        for info in self.list_convos(client_id):
+            self.delete_convo(info.id)
+
+    def _delete_messages(self, message_ids: list[UUID]) -> None:
+        self._conn.executemany("DELETE FROM parts WHERE message_id = ?", [(i,) for i in message_ids])
+        self._conn.executemany("DELETE FROM messages WHERE id = ?", [(i,) for i in message_ids])
+
+
+convo_stores: dict[str, Callable[[], ConvoStore]] = {
+    "sqlite": SQLiteConvoStore,
+}
+
+_store: ConvoStore | None = None
+
+
+def get_store() -> ConvoStore:
+    """Get the conversation store of this process, as configured by the `CONVO_STORE` environment variable."""
+    global _store
+    if _store is None:
+        _store = convo_stores[CONVO_STORE]()
+    return _store
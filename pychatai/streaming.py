@@ -0,0 +1,60 @@
+"""Helpers for streaming LLM output to the client."""
+
+import os
+import time
+
+STREAM_FLUSH_INTERVAL = float(os.getenv("STREAM_FLUSH_INTERVAL_MS", "50")) / 1000
+STREAM_FLUSH_MAX_TOKENS = int(os.getenv("STREAM_FLUSH_MAX_TOKENS", "64"))
+
+
+class TokenBuffer:
+    """Buffer for streamed tokens that decides when they should be flushed to the client.
+
+    The first token is always flushed immediately, so time-to-first-token is unaffected.
+    After that, tokens are accumulated until either `flush_interval` seconds have passed
+    since the last flush or `max_tokens` tokens are pending.
+    """
+
+    def __init__(self, flush_interval: float = STREAM_FLUSH_INTERVAL, max_tokens: int = STREAM_FLUSH_MAX_TOKENS):
+        self.flush_interval = flush_interval
+        self.max_tokens = max_tokens
+        self._tokens: list[str] = []
+        self._last_flush: float | None = None
+
+    def __len__(self) -> int:
+        """The number of buffered tokens."""
+        return len(self._tokens)
+
+    def add(self, token: str) -> None:
+        """Add a token to the buffer."""
+        self._tokens.append(token)
+
+    def should_flush(self) -> bool:
+        """Whether the pending tokens should be sent to the client now."""
+        if not self._tokens:
+            return False
+        if self._last_flush is None or len(self._tokens) >= self.max_tokens:
+            return True
+        return time.monotonic() - self._last_flush >= self.flush_interval
+
+    def flush_timeout(self) -> float | None:
+        """The seconds until the pending tokens are due to be flushed, or None if none are pending.
+
+        Waiting for the next event no longer than this keeps the time budget when the provider
+        pauses, e.g. while an agent thinks, instead of holding the tokens until the next event.
+        """
+        if not self._tokens:
+            return None
+        if self._last_flush is None:
+            return 0.0
+        return max(0.0, self.flush_interval - (time.monotonic() - self._last_flush))
+
+    def drain(self) -> str:
+        """Return all pending tokens as a single string and reset the buffer."""
+        text = "".join(self._tokens)
+        self._tokens.clear()
+        return text
+
+    def mark_flushed(self) -> None:
+        """Record that the client has just been updated."""
+        self._last_flush = time.monotonic()
@@ -0,0 +1,147 @@
+"""A cache of the results of plugin tools that look things up on the web.
+
+Agents often repeat a lookup within one run, and users often ask for the same thing, so the
+results of these tools are cached per tool for a time to live. Identical lookups that are in
+flight at the same time are coalesced: only the first one calls the tool, the others wait for
+its result. Queries are normalized before they are used as keys, so differences in case and
+whitespace don't matter.
+"""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+from langchain.callbacks.manager import AsyncCallbackManagerForToolRun, CallbackManagerForToolRun
+from langchain.tools import BaseTool
+
+from reflex_gptp.metrics import Counter
+
+TOOL_CACHE = os.getenv("TOOL_CACHE", "true").lower() == "true"
+TOOL_CACHE_SIZE = int(os.getenv("TOOL_CACHE_SIZE", "1024"))
+
+# Time to live of the cached results of each plugin, in seconds. Plugins that are not listed are not cached.
+tool_cache_ttl: dict[str, float] = {
+    "DuckDuckGo": float(os.getenv("TOOL_CACHE_TTL_DUCKDUCKGO", "3600")),
+    "Wikipedia": float(os.getenv("TOOL_CACHE_TTL_WIKIPEDIA", "86400")),
+    "YouTube": float(os.getenv("TOOL_CACHE_TTL_YOUTUBE", "3600")),
+}
+
+tool_cache_hits = Counter("pychatai_tool_cache_hits_total", "Tool runs answered from the tool cache.")
+tool_cache_misses = Counter("pychatai_tool_cache_misses_total", "Tool runs that called the tool.")
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a query, so lookups that only differ in case or whitespace get the same key."""
+    return " ".join(query.casefold().split())
+
+
+class ToolCache:
+    """Results of a tool, with least-recently-used and time-to-live eviction and coalescing of lookups."""
+
+    def __init__(self, ttl: float, max_size: int = TOOL_CACHE_SIZE) -> None:
+        self.ttl = ttl
+        self.max_size = max_size
+        self._results: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._in_flight: dict[str, asyncio.Future[str]] = {}
+
+    def get(self, key: str) -> str | None:
+        """Get a result, if it's in the cache and has not expired."""
+        entry = self._results.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[1] > self.ttl:
+            del self._results[key]
+            return None
+        self._results.move_to_end(key)
+        return entry[0]
+
+    def put(self, key: str, result: str) -> None:
+        """Add a result to the cache, dropping the least recently used results if it's full."""
+        self._results[key] = (result, time.monotonic())
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_size:
+            self._results.popitem(last=False)
+
+    async def aget_or_run(self, key: str, run: Callable[[], Awaitable[str]]) -> tuple[str, bool]:
+        """Get a result from the cache, or from a lookup that is in flight, or by awaiting `run()`.
+
+        Results are only cached if `run()` doesn't raise, lookups that wait for a failed lookup get its error.
+
+        Returns:
+            The result and whether it was not produced by this call.
+        """
+        result = self.get(key)
+        if result is not None:
+            return result, True
+        if (future := self._in_flight.get(key)) is not None:
+            try:
+                return await asyncio.shield(future), True
+            except asyncio.CancelledError:
+                # If the lookup that this was waiting for was cancelled, this one does it instead
+                if not future.cancelled() or asyncio.current_task().cancelling():  # type: ignore
+                    raise
+                return await self.aget_or_run(key, run)
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await run()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Nobody may be waiting for the lookup, then the error must not be logged as never retrieved
+            future.exception()
+            raise
+        else:
+            self.put(key, result)
+            future.set_result(result)
+        finally:
+            del self._in_flight[key]
+        return result, False
+
+
+# One cache per plugin, shared by all chains of the process
+_caches: dict[str, ToolCache] = {}
+
+
+class CachedTool(BaseTool):
+    """A tool that caches the results of another tool that takes a single query."""
+
+    tool: BaseTool
+    cache: ToolCache
+
+    def _run(self, query: str, run_manager: CallbackManagerForToolRun | None = None) -> str:
+        key = normalize_query(query)
+        result = self.cache.get(key)
+        if result is not None:
+            tool_cache_hits.inc()
+            if run_manager is not None:
+                run_manager.on_text("", cache_hit=True)
+            return result
+        tool_cache_misses.inc()
+        # The cached tool runs without callbacks, the events of this run are the ones of the lookup
+        result = self.tool.run(query)
+        self.cache.put(key, result)
+        return result
+
+    async def _arun(self, query: str, run_manager: AsyncCallbackManagerForToolRun | None = None) -> str:
+        result, cache_hit = await self.cache.aget_or_run(normalize_query(query), lambda: self.tool.arun(query))
+        if cache_hit:
+            tool_cache_hits.inc()
+            if run_manager is not None:
+                await run_manager.on_text("", cache_hit=True)
+        else:
+            tool_cache_misses.inc()
+        return result
+
+
+def cache_tool(plugin: str, tool: BaseTool) -> BaseTool:
+    """Wrap the tool of a plugin in a cache, if results of the plugin are cached."""
+    if not TOOL_CACHE or plugin not in tool_cache_ttl:
+        return tool
+    if plugin not in _caches:
+        _caches[plugin] = ToolCache(tool_cache_ttl[plugin])
+    return CachedTool(name=tool.name, description=tool.description, tool=tool, cache=_caches[plugin])
@@ -1,12 +1,9 @@
 """Utility functions and constants."""
 
+import os
 from enum import Enum
-from functools import partial
-from typing import Callable
-
-from langchain.tools import DuckDuckGoSearchRun, WikipediaQueryRun, YouTubeSearchTool
-from langchain.utilities import WikipediaAPIWrapper
-from langchain_experimental.tools.python.tool import PythonREPLTool
+from importlib.metadata import EntryPoint, entry_points
+from typing import Any, Callable
 
 
 class OutputType(str, Enum):
@@ -18,6 +15,7 @@ class OutputType(str, Enum):
     AGENT_FINISH = "agent_finish"
     LLM_ERROR = "llm_error"
     INTERRUPT = "interrupt"
+    QUEUE_STATUS = "queue_status"
 
 
 class MessagePartType(str, Enum):
@@ -31,14 +29,68 @@ class MessagePartType(str, Enum):
     INTERRUPT = "interrupt"
 
 
+def _import(target: str) -> Any:
+    # Resolved like the value of an entry point, so the attribute can be dotted, e.g. `module:Class.create`
+    return EntryPoint(name=target, value=target, group="pychatai.plugins").load()
+
+
+class LazyTool:
+    """A plugin tool that is only imported when it's first created.
+
+    Args:
+        target: The tool class (or a function that creates the tool), as `"module:attribute"` like the
+            value of an entry point, where the attribute can be dotted.
+        **arguments: Arguments of the tool that are created once, when the tool is first created,
+            also given as `"module:attribute"` of a class or function that is called without arguments.
+    """
+
+    def __init__(self, target: str, **arguments: str) -> None:
+        self.target = target
+        self.arguments = arguments
+        self._factory: Callable | None = None
+        self._kwargs: dict[str, Any] = {}
+
+    def __call__(self, **kwargs: Any) -> Any:
+        """Create the tool."""
+        if self._factory is None:
+            self._kwargs = {k: _import(v)() for k, v in self.arguments.items()}
+            self._factory = _import(self.target)
+        return self._factory(**self._kwargs, **kwargs)
+
+    def __repr__(self) -> str:
+        """Shows the target without importing it."""
+        return f"LazyTool({self.target!r})"
+
+
 plugin_tool: dict[str, Callable] = {
-    "Python": PythonREPLTool,
-    "DuckDuckGo": DuckDuckGoSearchRun,
-    "Wikipedia": partial(WikipediaQueryRun, api_wrapper=WikipediaAPIWrapper()),
-    "YouTube": YouTubeSearchTool,
+    "Python": LazyTool("reflex_gptp.sandbox:SandboxedPythonTool"),
+    "DuckDuckGo": LazyTool("langchain.tools:DuckDuckGoSearchRun"),
+    "Wikipedia": LazyTool("langchain.tools:WikipediaQueryRun", api_wrapper="langchain.utilities:WikipediaAPIWrapper"),
+    "YouTube": LazyTool("langchain.tools:YouTubeSearchTool"),
 }
 
+# Other packages can add plugins with an entry point in this group,
+# named after the plugin and pointing to a tool class or a function that creates the tool.
+for _entry_point in entry_points(group="pychatai.plugins"):
+    plugin_tool.setdefault(_entry_point.name, LazyTool(_entry_point.value))
+
 providers_models = {
     "openai": ["gpt-3.5-turbo", "gpt-4", "gpt-4-1106-preview"],
     "anthropic": ["claude-2", "claude-instant-1"],
 }
+
+# The offline fake provider (see `fake_llm.py`) is only offered when it's enabled, for tests and benchmarks
+if os.getenv("FAKE_PROVIDER", "false").lower() == "true":
+    providers_models["fake"] = ["fake-markov", "fake-random", "fake-script"]
+
+# Size of the context window of each model, in tokens
+model_context_size = {
+    "gpt-3.5-turbo": 4096,
+    "gpt-4": 8192,
+    "gpt-4-1106-preview": 128000,
+    "claude-2": 100000,
+    "claude-instant-1": 100000,
+    "fake-markov": 4096,
+    "fake-random": 4096,
+    "fake-script": 4096,
+}
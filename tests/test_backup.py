@@ -0,0 +1,117 @@
+"""Round trips of conversations through archives."""
+
+import pytest
+from reflex_gptp.archive import ArchiveError, encode, message_record
+from reflex_gptp.backup import export_archive, import_archive
+from reflex_gptp.models import Message, MessagePart, make_uuid
+from reflex_gptp.store import SQLiteConvoStore
+from reflex_gptp.utils import MessagePartType
+
+MODEL = {"provider": "openai", "name": "gpt-4"}
+
+
+def make_message(text: str, own: bool) -> Message:
+    """A message with a single text part."""
+    return Message(id=make_uuid(), parts=[MessagePart(id=make_uuid(), type=MessagePartType.TEXT, text=text)], own=own)
+
+
+def texts(store: SQLiteConvoStore, convo_id: str) -> list[str]:
+    """The texts of the messages of a conversation, from old to new."""
+    return [m.parts[0].text for m in store.load_messages(convo_id)]
+
+
+@pytest.fixture()
+def store(tmp_path) -> SQLiteConvoStore:
+    """A store with a conversation of two questions and their answers."""
+    store = SQLiteConvoStore(str(tmp_path / "convos.db"))
+    store.save_convo("alice", "convo", "Conversation", MODEL, {"Python": True})
+    for i in range(2):
+        store.append_message("convo", make_message(f"question {i}", True))
+        store.append_message("convo", make_message(f"answer {i}", False))
+    return store
+
+
+def test_round_trip(store: SQLiteConvoStore, tmp_path) -> None:
+    """An archive imported into another store has the same conversations and messages."""
+    other = SQLiteConvoStore(str(tmp_path / "other.db"))
+    result = import_archive(other, "bob", export_archive(store, "alice", batch_size=3), batch_size=3)
+
+    assert result == (1, 4, 0)
+    [info] = other.list_convos("bob")
+    assert (info.name, info.provider, info.model, info.plugins) == ("Conversation", "openai", "gpt-4", {"Python": True})
+    assert info.created_at == store.list_convos("alice")[0].created_at
+    assert texts(other, "convo") == texts(store, "convo")
+
+
+def test_import_again(store: SQLiteConvoStore) -> None:
+    """Importing an archive into the store it was exported from changes nothing."""
+    archive = b"".join(export_archive(store, "alice"))
+
+    assert import_archive(store, "alice", [archive]) == (0, 0, 4)
+    assert texts(store, "convo") == ["question 0", "answer 0", "question 1", "answer 1"]
+
+
+def test_import_after_regenerate(store: SQLiteConvoStore) -> None:
+    """A conversation that changed since it was exported keeps its newer history."""
+    archive = b"".join(export_archive(store, "alice"))
+    # Regenerating the last answer truncates it and appends the new one
+    stale = store.load_messages("convo")[-1]
+    store.truncate_messages("convo", stale.id)
+    store.append_message("convo", make_message("new answer 1", False))
+
+    import_archive(store, "alice", [archive])
+
+    assert texts(store, "convo") == ["question 0", "answer 0", "question 1", "new answer 1"]
+
+
+def test_import_other_client(store: SQLiteConvoStore) -> None:
+    """Conversations of another client aren't changed by an import."""
+    archive = b"".join(export_archive(store, "alice"))
+
+    assert import_archive(store, "mallory", [archive]) == (0, 0, 4)
+    assert store.list_convos("mallory") == []
+
+
+def test_invalid_record(store: SQLiteConvoStore, tmp_path) -> None:
+    """A conversation with an invalid record isn't imported at all."""
+    other = SQLiteConvoStore(str(tmp_path / "other.db"))
+    records = [
+        {"type": "convo", "id": "new", "name": "New", "provider": "openai", "model": "gpt-4", "plugins": {}, "created_at": 0.0, "updated_at": 0.0},
+        {"type": "message", "convo_id": "new", "id": "m1", "own": True, "parts": []},
+        # Misses whether the user wrote it
+        {"type": "message", "convo_id": "new", "id": "m2", "parts": []},
+    ]
+
+    with pytest.raises(ArchiveError, match="Invalid record"):
+        import_archive(other, "alice", encode(records), batch_size=1)
+    assert other.list_convos("alice") == []
+
+
+def test_interleaved_records(tmp_path) -> None:
+    """Messages are imported into the conversation of their own record, whatever record they follow."""
+    store = SQLiteConvoStore(str(tmp_path / "convos.db"))
+    first, second = make_message("first", True), make_message("second", True)
+    records = [
+        {"type": "convo", "id": "a", "name": "A", "provider": "openai", "model": "gpt-4", "plugins": {}, "created_at": 0.0, "updated_at": 0.0},
+        {"type": "convo", "id": "b", "name": "B", "provider": "openai", "model": "gpt-4", "plugins": {}, "created_at": 1.0, "updated_at": 1.0},
+        message_record("a", first),
+        message_record("b", second),
+        message_record("a", make_message("first again", False)),
+    ]
+
+    assert import_archive(store, "alice", encode(records)) == (2, 3, 0)
+    assert texts(store, "a") == ["first", "first again"]
+    assert texts(store, "b") == ["second"]
+
+
+def test_unknown_convo(tmp_path) -> None:
+    """A message whose conversation isn't in the archive before it is rejected."""
+    store = SQLiteConvoStore(str(tmp_path / "convos.db"))
+    records = [
+        {"type": "convo", "id": "a", "name": "A", "provider": "openai", "model": "gpt-4", "plugins": {}, "created_at": 0.0, "updated_at": 0.0},
+        message_record("b", make_message("lost", True)),
+    ]
+
+    with pytest.raises(ArchiveError, match="unknown conversation b"):
+        import_archive(store, "alice", encode(records))
+    assert texts(store, "a") == []
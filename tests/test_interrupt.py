@@ -0,0 +1,77 @@
+"""Interrupting a response that is streamed from a local fake OpenAI server."""
+
+import asyncio
+import time
+
+from aiohttp import web
+from chat_pipeline import Bench
+from interrupt_latency import FakeServer
+from reflex_gptp import state as state_module
+from reflex_gptp import store as store_module
+from reflex_gptp.state import ConvoState, ModelFormState, State, StreamState
+from reflex_gptp.store import SQLiteConvoStore
+
+# Seconds from interrupting a response until the session can ask the next question
+LATENCY_BUDGET = 1.0
+
+
+async def interrupt_response(server: FakeServer, after_tokens: int) -> float:
+    """Ask a question, interrupt the response after some tokens and return the seconds until it's done."""
+    bench = Bench()
+    sid = "interrupt"
+    await bench.send(sid, ConvoState, "load_data")
+    await bench.send(sid, State, "handle_api_key_submit", form_data={"api_key": "sk-interrupt"}, provider="openai")
+    model = {"provider": "openai", "name": "gpt-3.5-turbo"}
+    await bench.send(sid, ModelFormState, "handle_model_submit", form_data=model)
+    task = await bench.send(sid, StreamState, "handle_submit", form_data={"input": "Hello"})
+    assert task is not None
+    while server.sent < after_tokens:
+        assert not task.done()
+        await asyncio.sleep(0.001)
+
+    start = time.perf_counter()
+    await bench.send(sid, StreamState, "interrupt_chat")
+    await asyncio.wait_for(task, LATENCY_BUDGET)
+    elapsed = time.perf_counter() - start
+
+    assert not (await bench.get_state(sid, StreamState)).processing
+    return elapsed
+
+
+def test_interrupt(tmp_path, monkeypatch) -> None:
+    """An interrupted response releases its chain, closes its HTTP stream and ends within the latency budget."""
+    monkeypatch.setattr(store_module, "_store", SQLiteConvoStore(str(tmp_path / "convos.db")))
+    released = []
+    monkeypatch.setattr(state_module, "release_chain", lambda chain: released.append(chain))
+    closed = []
+    close_responses = state_module.close_responses
+
+    async def record_closed(responses: set) -> None:
+        tracked = list(responses)
+        await close_responses(responses)
+        closed.extend(tracked)
+
+    monkeypatch.setattr(state_module, "close_responses", record_closed)
+
+    async def run() -> float:
+        server = FakeServer(n_tokens=2000, interval=0.005)
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", server.chat_completions)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        # The OpenAI client reads the base URL when the chat model is created
+        port = runner.addresses[0][1]
+        monkeypatch.setenv("OPENAI_API_BASE", f"http://127.0.0.1:{port}/v1")
+        try:
+            return await interrupt_response(server, after_tokens=20)
+        finally:
+            await runner.cleanup()
+
+    elapsed = asyncio.run(run())
+
+    assert elapsed < LATENCY_BUDGET
+    assert len(released) == 1
+    assert closed
+    assert all(response.closed for response in closed)
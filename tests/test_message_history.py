@@ -0,0 +1,30 @@
+"""Packing messages into the compact history of a conversation."""
+
+from reflex_gptp.message_history import MessageHistory
+from reflex_gptp.models import Message, MessagePart, make_uuid
+from reflex_gptp.utils import MessagePartType
+
+
+def test_round_trip() -> None:
+    """A message read from a history is the message that was appended, including its token count."""
+    message = Message(
+        id=make_uuid(),
+        parts=[
+            MessagePart(id=make_uuid(), type=MessagePartType.TOOL_END, text="Result", extra_output="1 + 1"),
+            MessagePart(id="not-a-uuid", type=MessagePartType.AGENT_FINISH, text="Two"),
+        ],
+        own=False,
+        n_tokens=7,
+    )
+    history = MessageHistory()
+    history.append(message)
+
+    assert history[0] == message
+    assert [m.n_tokens for m in history[:]] == [7]
+
+
+def test_from_parts() -> None:
+    """Messages built from the rows of the store haven't been counted yet."""
+    history = MessageHistory.from_parts([("m1", 1, "p1", "text", "Hello", None, None)])
+
+    assert (history[0].id, history[0].own, history[0].parts[0].text, history[0].n_tokens) == ("m1", True, "Hello", None)
@@ -0,0 +1,19 @@
+"""Coalescing streamed tokens."""
+
+from reflex_gptp.streaming import TokenBuffer
+
+
+def test_flush_timeout() -> None:
+    """Pending tokens are due within the flush interval of the last flush, whether or not more tokens arrive."""
+    buffer = TokenBuffer(flush_interval=10)
+    assert buffer.flush_timeout() is None
+
+    buffer.add("first")
+    assert buffer.flush_timeout() == 0
+    buffer.drain()
+    buffer.mark_flushed()
+    assert buffer.flush_timeout() is None
+
+    buffer.add("second")
+    assert 9 < buffer.flush_timeout() <= 10  # type: ignore
+    assert not buffer.should_flush()